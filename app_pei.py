@@ -10,15 +10,23 @@ import tempfile
 from PIL import Image
 import pandas as pd
 from streamlit_gsheets import GSheetsConnection
+from armazenamento import (
+    SheetsValuesClient, SheetsBackend, SQLiteBackend, JsonFileBackend, SharedStore, QuotaGuard, AntiWipeError, VersionConflictError, DocCache,
+    SUMMARY_COLUMNS, record_version, three_way_merge, merge_patch, externalize_photo, canonical_hash, changed_fields,
+    dirty_sections,
+    begin_run, memoized, memoized_many, forget, frame_bytes, estimate_size,
+)
 import time
 import uuid
 
+# Os DataFrames do cache são compartilhados entre as sessões por cópias rasas (armazenamento.share);
+# com copy-on-write (padrão a partir do pandas 3), quem alterar uma delas copia só o que alterou.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 MIN_DATA = date(1900, 1, 1)
 MAX_DATA = date(2100, 12, 31)
 
-# --- CONEXÃO COM GOOGLE SHEETS ---
-conn = st.connection("gsheets", type=GSheetsConnection)
-
 # --- CONFIGURAÇÃO INICIAL ---
 st.set_page_config(
     page_title="Integra | Sistema AEE",
@@ -27,6 +35,12 @@ st.set_page_config(
     initial_sidebar_state="auto"
 )
 
+# --- MEMOIZAÇÃO DE LEITURAS POR EXECUÇÃO ---
+# Cada rerun começa sem leituras memorizadas. Se um callback de widget (que roda antes
+# do script) já abriu a execução, ela é mantida para reaproveitar o que ele leu.
+if not st.session_state.pop('_execucao_aberta_por_callback', False):
+    begin_run()
+
 # --- OCULTAR TOOLBAR E MENU E RESPONSIVIDADE ---
 hide_st_style = """
             <style>
@@ -63,61 +77,201 @@ st.markdown(hide_st_style, unsafe_allow_html=True)
 
 # --- FUNÇÕES DE BANCO DE DADOS E UTILITÁRIOS (COM PROTEÇÃO ANTI-WIPE) ---
 
+@st.cache_resource
+def get_storage():
+    """
+    Backend de persistência do processo, escolhido em [storage] no secrets.toml:
+    backend = "sheets" (padrão), "sqlite" (arquivo local em sqlite_path,
+    com o Google Sheets como espelho opcional quando sync_sheets = true) ou "json"
+    (arquivo json_path no formato de banco_dados_aee_final.json, sem acesso ao Google).
+    O espelho é atualizado em segundo plano por uma fila durável (write_behind = true, padrão).
+    Toda chamada ao Google Sheets respeita os limites de [quota] (leituras/escritas por minuto).
+    shared_cache = caminho de um arquivo SQLite em que os processos do mesmo servidor dividem
+    as leituras do Google Sheets (para rodar várias réplicas do app).
+    Sem o Google Sheets ("json", ou "sqlite" sem espelho), o armazenamento local começa vazio
+    (sem Professores, ninguém entra). A semente resolve o primeiro acesso:
+    seed = "sheets" copia tudo da planilha uma única vez, enquanto o local estiver vazio;
+    seed_path = arquivo JSON {"Professores": [{"matricula": ..., "nome": ...}], "Monitores": [...]}
+    cujas abas preenchem as que ainda estiverem vazias.
+    """
+    cfg = st.secrets.get("storage", {})
+    backend = cfg.get("backend", "sheets")
+
+    def connect_sheets():
+        conn = st.connection("gsheets", type=GSheetsConnection)
+        guard = QuotaGuard.from_config(st.secrets.get("quota", {}))
+        client = SheetsValuesClient.from_secrets(st.secrets["connections"]["gsheets"], guard=guard)
+        # Várias réplicas no mesmo servidor: cache compartilhado num arquivo SQLite (shared_cache)
+        shared = SharedStore(cfg["shared_cache"]) if cfg.get("shared_cache") else None
+        return SheetsBackend(conn, client, guard=guard, shared=shared)
+
+    sheets = None
+    if backend not in ("sqlite", "json") or (backend == "sqlite" and cfg.get("sync_sheets", False)):
+        sheets = connect_sheets()
+    if backend == "sqlite":
+        storage = SQLiteBackend(cfg.get("sqlite_path", "integra.db"), mirror=sheets,
+                                write_behind=cfg.get("write_behind", True))
+    elif backend == "json":
+        storage = JsonFileBackend(cfg.get("json_path", "banco_dados_aee_final.json"))
+    else:
+        storage = sheets
+        # Migração: preenche as colunas derivadas (doc_uuid, resumo, hash) das linhas antigas
+        # e confere os metadados de integridade da aba Alunos
+        try:
+            sheets.backfill_summaries()
+        except Exception as e:
+            print(f"Aviso: não foi possível preencher os resumos dos documentos: {e}")
+    if sheets is None:
+        try:
+            if cfg.get("seed") == "sheets" and storage.load_db().empty and storage.safe_read("Professores").empty:
+                storage.seed_from(connect_sheets())
+            if cfg.get("seed_path") and os.path.exists(cfg["seed_path"]):
+                with open(cfg["seed_path"], encoding="utf-8") as f:
+                    storage.seed_worksheets(json.load(f))
+        except Exception as e:
+            print(f"Aviso: não foi possível aplicar a semente do armazenamento local: {e}")
+    # Migração: fotos embutidas nos documentos passam para o armazenamento de blobs
+    try:
+        storage.migrate_photos()
+    except Exception as e:
+        print(f"Aviso: não foi possível migrar as fotos dos documentos: {e}")
+    return storage
+
 def load_db(strict=False):
     """
-    Lê os dados da planilha do Google.
-    strict=True: Levanta erro se a leitura falhar (usado antes de salvar para garantir que leu tudo).
+    Lê os dados dos alunos (no Sheets, via cache do processo conferido pelo carimbo de versão).
+    strict=True: Ignora o cache e levanta erro se a leitura falhar (usado antes de salvar para garantir que leu tudo).
     strict=False: Retorna vazio se falhar (usado apenas para visualização).
     """
     try:
-        df = conn.read(worksheet="Alunos", ttl=0)
-        # Se o DF vier vazio, verificar se não foi erro de conexão silencioso
-        if df.empty and strict:
-             # Tenta ler outra aba leve apenas para testar conexão
-             conn.read(worksheet="Professores", ttl=0)
-        
-        df = df.dropna(how="all")
-        return df
+        if strict:
+            return get_storage().load_db(strict=True)
+        return memoized(("load_db", "Alunos"), lambda: get_storage().load_db())
     except Exception as e:
         if strict:
             st.error(f"❌ ERRO CRÍTICO DE LEITURA: Não foi possível ler o banco de dados. Operação de salvamento bloqueada para evitar perda de dados. Detalhe: {e}")
             raise e # Para a execução
         return pd.DataFrame(columns=["nome", "tipo_doc", "dados_json", "id"])
 
+def load_columns(*columns):
+    """Apenas as colunas pedidas da aba Alunos (projeção, sem o dados_json); retorna vazio se falhar"""
+    try:
+        return memoized((f"load_columns:{','.join(columns)}", "Alunos"), lambda: get_storage().load_columns(columns))
+    except Exception:
+        return pd.DataFrame(columns=list(columns))
+
+def load_summary():
+    """
+    Projeção leve dos alunos (id, nome, tipo_doc, doc_uuid, resumo, version), sem o dados_json.
+    Usada pelas listagens e pelo painel; retorna vazio se falhar.
+    """
+    try:
+        return memoized(("load_summary", "Alunos"), lambda: get_storage().load_summary())
+    except Exception:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+@st.cache_resource
+def get_doc_cache():
+    """LRU de documentos decodificados (dados_json), compartilhado por todas as sessões"""
+    return DocCache(max_bytes=int(st.secrets.get("cache", {}).get("documentos_mb", 64)) * 1024 * 1024)
+
+def parse_doc(row, mutable=False):
+    """
+    dados_json de uma linha do banco já decodificado, via cache de documentos.
+    mutable=True devolve uma cópia própria (ex.: para carregar no session_state).
+    """
+    return get_doc_cache().get(row.get("id"), row["dados_json"], mutable=mutable)
+
+def parse_resumo(row):
+    """Resumo (campos de listagem + progresso) de uma linha de load_summary(), via cache de documentos"""
+    return get_doc_cache().get(("resumo", row.get("id")), row["resumo"])
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_photo(sha):
+    """Bytes da foto pelo hash (endereçada pelo conteúdo, então o cache nunca fica desatualizado)"""
+    data = get_storage().get_blob(sha)
+    if data is None:
+        # Exceções não entram no cache: uma foto ainda não sincronizada é buscada de novo na próxima vez
+        raise LookupError(f"Foto {sha[:12]} não encontrada no armazenamento.")
+    return data
+
+def photo_bytes(doc):
+    """
+    Foto do documento: a recém-carregada (ainda em base64, até o próximo salvamento)
+    ou a referenciada por 'foto_sha256', buscada só quando alguma tela precisa dela.
+    """
+    try:
+        if doc.get('foto_base64'):
+            return base64.b64decode(doc['foto_base64'])
+        if doc.get('foto_sha256'):
+            return load_photo(doc['foto_sha256'])
+    except Exception as e:
+        print(f"Aviso: não foi possível carregar a foto: {e}")
+    return None
+
+def memoria_sessao():
+    """Estimativa (bytes) do que só esta sessão ocupa: documentos em edição e tabelas no session_state"""
+    total = 0
+    for valor in st.session_state.to_dict().values():
+        if isinstance(valor, pd.DataFrame): total += frame_bytes(valor)
+        elif isinstance(valor, (dict, list)): total += estimate_size(valor)
+    return total
+
+def converter_datas(dados):
+    """Converte (no próprio dict) os campos 'AAAA-MM-DD' de primeiro nível em date"""
+    for k, v in dados.items():
+        if isinstance(v, str) and len(v) == 10 and v.count('-') == 2:
+            try: dados[k] = datetime.strptime(v, '%Y-%m-%d').date()
+            except: pass
+    return dados
+
 def safe_read(worksheet_name, columns):
-    """Lê uma aba com segurança, retornando vazio se falhar"""
+    """Lê uma aba com segurança, retornando vazio se falhar (uma única leitura por execução do script)"""
     try:
-        df = conn.read(worksheet=worksheet_name, ttl=0)
+        df = memoized(("safe_read", worksheet_name), lambda: get_storage().safe_read(worksheet_name))
         if df.empty:
              return pd.DataFrame(columns=columns)
         return df
     except:
         return pd.DataFrame(columns=columns)
 
+def prefetch(*worksheets):
+    """
+    Declara as abas que a página vai usar: as que ainda não foram lidas nesta execução
+    vêm numa única requisição e ficam memorizadas para safe_read().
+    Se a leitura em lote falhar, cada safe_read() faz a sua leitura normalmente.
+    """
+    try:
+        memoized_many([("safe_read", w) for w in worksheets], lambda faltando: {
+            ("safe_read", w): df for w, df in get_storage().read_many([k[1] for k in faltando]).items()
+        })
+    except Exception as e:
+        print(f"Aviso: leitura em lote de {', '.join(worksheets)} falhou: {e}")
+
 def safe_update(worksheet_name, data):
     """Atualiza uma aba com segurança"""
     try:
-        conn.update(worksheet=worksheet_name, data=data)
+        get_storage().safe_update(worksheet_name, data)
+        forget(worksheet_name)
         return True
     except Exception as e:
         st.error(f"Erro ao atualizar {worksheet_name}: {e}")
         return False
 
-def create_backup(df_atual):
-    """Cria um backup de segurança na aba 'Backup_Alunos' antes de qualquer alteração"""
-    if not df_atual.empty:
-        try:
-            # Tenta salvar na aba de Backup. Se ela não existir, o gsheets cria ou dá erro dependendo da permissão
-            # O ideal é criar uma aba "Backup_Alunos" manualmente no Google Sheets antes.
-            conn.update(worksheet="Backup_Alunos", data=df_atual)
-        except Exception as e:
-            print(f"Aviso: Não foi possível criar backup: {e}")
+def create_backup(anterior, novo=None, operacao="Salvar"):
+    """
+    Anota no journal de backup a versão anterior (e a nova) do registro ANTES da alteração.
+    O custo é proporcional ao registro alterado; snapshots completos saem da compactação periódica.
+    """
+    try:
+        get_storage().create_backup(anterior, novo, st.session_state.get('usuario_nome', 'Desconhecido'), operacao)
+    except Exception as e:
+        print(f"Aviso: Não foi possível criar backup: {e}")
 
 # --- LOGGER ---
 def log_action(student_name, action, details):
-    """Registra ação no histórico"""
+    """Registra ação no histórico (no Sheets apenas enfileira; a gravação é feita em lote)"""
     try:
-        df_hist = safe_read("Historico", ["Data_Hora", "Aluno", "Usuario", "Acao", "Detalhes"])
         novo_log = {
             "Data_Hora": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
             "Aluno": student_name,
@@ -125,8 +279,7 @@ def log_action(student_name, action, details):
             "Acao": action,
             "Detalhes": details
         }
-        df_hist = pd.concat([df_hist, pd.DataFrame([novo_log])], ignore_index=True)
-        safe_update("Historico", df_hist)
+        get_storage().log_action(novo_log)
     except Exception as e:
         print(f"Erro ao logar: {e}")
 
@@ -141,19 +294,15 @@ def save_student(doc_type, name, data, section="Geral"):
         return
 
     try:
-        # 1. LEITURA ESTRITA: Se falhar a leitura, O CÓDIGO PARA AQUI.
-        # Isso impede que o sistema ache que o banco está vazio por erro de internet.
-        df_atual = load_db(strict=True)
-        
-        # 2. BACKUP AUTOMÁTICO
-        create_backup(df_atual)
-
         id_registro = f"{name} ({doc_type})"
         
         # Garantir UUID
         if 'doc_uuid' not in data or not data['doc_uuid']:
             data['doc_uuid'] = str(uuid.uuid4()).upper()
 
+        # A foto vai para o armazenamento de blobs; o documento guarda só o hash
+        externalize_photo(data, get_storage().put_blob)
+
         def serializar_datas(obj):
             if isinstance(obj, (date, datetime)): return obj.strftime("%Y-%m-%d")
             if isinstance(obj, dict): return {k: serializar_datas(v) for k, v in obj.items()}
@@ -163,42 +312,74 @@ def save_student(doc_type, name, data, section="Geral"):
         data_limpa = serializar_datas(data)
         novo_json = json.dumps(data_limpa, ensure_ascii=False)
 
-        # Lógica de Atualização vs Inserção
-        df_final = df_atual.copy()
-        
-        if not df_atual.empty and "id" in df_atual.columns and id_registro in df_atual["id"].values:
-            # ATUALIZAÇÃO
-            df_final.loc[df_final["id"] == id_registro, "dados_json"] = novo_json
-        else:
-            # INSERÇÃO
-            novo_registro = {
-                "id": id_registro,
-                "nome": name,
-                "tipo_doc": doc_type,
-                "dados_json": novo_json
-            }
-            # Se o banco estava vazio, cria o DF, senão concatena
-            if df_final.empty:
-                df_final = pd.DataFrame([novo_registro])
-            else:
-                df_final = pd.concat([df_final, pd.DataFrame([novo_registro])], ignore_index=True)
-
-        # 3. TRAVA DE SEGURANÇA (ANTI-WIPE)
-        # Se o banco tinha dados (ex: 100 linhas) e o df_final tem muito menos (ex: 1 linha),
-        # significa que algo deu errado na leitura ou concatenação. Bloqueia o salvamento.
-        qtd_antes = len(df_atual)
-        qtd_depois = len(df_final)
+        novo_registro = {
+            "id": id_registro,
+            "nome": name,
+            "tipo_doc": doc_type,
+            "dados_json": novo_json
+        }
 
-        if qtd_antes > 5 and qtd_depois < (qtd_antes * 0.9): 
-            # Se tentar apagar mais de 10% da base de uma vez numa função de salvar, é erro.
-            st.error(f"⛔ BLOQUEIO DE SEGURANÇA: O sistema detectou uma possível perda de dados em massa (De {qtd_antes} para {qtd_depois} registros). A operação foi cancelada.")
+        # SALVAMENTO SEM ALTERAÇÕES: se o documento é igual ao carregado (mesmo resumo canônico,
+        # ou nenhum campo diferente), não há backup, gravação nem entrada no histórico
+        bases = st.session_state.setdefault('docs_base', {})
+        resumos = st.session_state.setdefault('docs_hash', {})
+        base = bases.get(id_registro)
+        novo_resumo = canonical_hash(data_limpa)
+        if base is not None and resumos.get(id_registro) == novo_resumo:
+            st.toast(f"Nenhuma alteração em {name} para salvar.", icon="ℹ️")
             return
-
-        # 4. SALVAMENTO FINAL
-        conn.update(worksheet="Alunos", data=df_final)
+        base_doc = json.loads(base["dados_json"]) if base else {}
+        alterados = changed_fields(base_doc, data_limpa)
+        if base is not None and not alterados:
+            resumos[id_registro] = novo_resumo
+            st.toast(f"Nenhuma alteração em {name} para salvar.", icon="ℹ️")
+            return
+        # Seções com campos alterados (o "Salvar completo" registra só as que mudaram)
+        secoes = dirty_sections(doc_type, alterados, section if section != "Completo" else "Geral")
+
+        # CONCORRÊNCIA OTIMISTA: grava apenas se o registro ainda estiver na versão carregada.
+        # Se outra pessoa salvou antes, mescla os campos alterados por cada um e tenta de novo;
+        # só há bloqueio quando os dois alteraram o mesmo campo.
+        versao_esperada = record_version(base)
+        for _ in range(3):
+            try:
+                # SALVAMENTO POR REGISTRO (UPSERT) com BACKUP AUTOMÁTICO da versão anterior.
+                # Se a localização do registro falhar, a exceção interrompe o salvamento.
+                # TRAVA DE SEGURANÇA: apenas o registro deste documento é gravado.
+                # Documento já existente: vai também o merge patch (só os campos alterados), que o
+                # backend aplica sobre a versão gravada e guarda no log do documento
+                salvo = get_storage().save_student(
+                    novo_registro, st.session_state.get('usuario_nome', 'Desconhecido'), f"Salvou {doc_type}",
+                    expected_version=versao_esperada, patch=merge_patch(base_doc, data_limpa) if base else None
+                )
+                break
+            except VersionConflictError as conflito:
+                atual = conflito.current
+                if atual is None:
+                    # Outro usuário excluiu o documento: só recria com a confirmação de quem está editando,
+                    # pedida na barra lateral na próxima execução
+                    st.session_state.confirm_recreate = {"id": id_registro, "doc_type": doc_type, "name": name,
+                                                         "data": data, "section": section}
+                    st.rerun()
+                mesclado, conflitos = three_way_merge(base_doc, data_limpa, json.loads(atual["dados_json"]))
+                if conflitos:
+                    st.error(f"⚠️ CONFLITO DE EDIÇÃO: outro usuário alterou os mesmos campos deste documento ({', '.join(conflitos)}). Recarregue o aluno para ver a versão atual antes de salvar.")
+                    return
+                base, data_limpa = atual, mesclado
+                base_doc = json.loads(atual["dados_json"])
+                versao_esperada = record_version(atual)
+                novo_registro["dados_json"] = json.dumps(mesclado, ensure_ascii=False)
+                # Traz para a tela as alterações feitas pelo outro usuário
+                data.update(converter_datas(dict(mesclado)))
+        else:
+            st.error("⚠️ O documento está sendo alterado por outros usuários. Tente salvar novamente.")
+            return
+        bases[id_registro] = salvo
+        resumos[id_registro] = canonical_hash(data_limpa)
+        forget("Alunos")
         
-        # Registra no histórico
-        log_action(name, f"Salvou {doc_type}", f"Seção: {section}")
+        # Registra no histórico (apenas as seções alteradas)
+        log_action(name, f"Salvou {doc_type}", f"Seção: {', '.join(secoes)}")
         
         st.toast(f"✅ Alterações em {name} salvas com segurança!", icon="💾")
         
@@ -213,30 +394,17 @@ def delete_student(student_name):
         return False
         
     try:
-        # Leitura Estrita
-        df = load_db(strict=True)
-        create_backup(df) # Backup antes de deletar
-
-        if "nome" in df.columns:
-            # Filtra removendo o aluno
-            df_new = df[df["nome"] != student_name]
-            
-            qtd_antes = len(df)
-            qtd_depois = len(df_new)
-
-            # Trava: Se a exclusão apagar TUDO ou mais do que o esperado
-            if qtd_antes > 0 and qtd_depois == 0 and qtd_antes > 5: 
-                # Se tinha mais de 5 alunos e vai sobrar zero, provavelmente a lógica de filtro falhou ou string vazia
-                st.error("⛔ BLOQUEIO: Tentativa de excluir TODOS os registros detectada. Operação cancelada.")
-                return False
-
-            if qtd_depois < qtd_antes:
-                conn.update(worksheet="Alunos", data=df_new)
-                log_action(student_name, "Exclusão", "Registro do aluno excluído")
-                st.toast(f"🗑️ Registro de {student_name} excluído com sucesso!", icon="🔥")
-                return True
-            else:
-                st.warning("Nenhum registro encontrado para exclusão.")
+        # Localização das linhas, trava anti-wipe e backup dos registros removidos ficam a cargo do backend
+        removidos = get_storage().delete_student(student_name, st.session_state.get('usuario_nome', 'Desconhecido'))
+        forget("Alunos")
+        if removidos:
+            log_action(student_name, "Exclusão", "Registro do aluno excluído")
+            st.toast(f"🗑️ Registro de {student_name} excluído com sucesso!", icon="🔥")
+            return True
+        else:
+            st.warning("Nenhum registro encontrado para exclusão.")
+    except AntiWipeError as e:
+        st.error(f"⛔ BLOQUEIO: {e}")
     except Exception as e:
         st.error(f"Erro ao excluir: {e}")
     return False
@@ -485,7 +653,9 @@ def login():
                         try:
                             SENHA_MESTRA = st.secrets.get("credentials", {}).get("password", "admin")
                             user_id_limpo = str(user_id).strip()
-                            df_professores = conn.read(worksheet="Professores", ttl=0)
+                            # Professores e Monitores numa única requisição
+                            prefetch("Professores", "Monitores")
+                            df_professores = memoized(("safe_read", "Professores"), lambda: get_storage().safe_read("Professores"))
                             authenticated_as_prof = False
                             
                             if not df_professores.empty:
@@ -526,27 +696,21 @@ def login():
                 if st.button("Verificar Autenticidade", type="primary"):
                     if uuid_input:
                         try:
-                            df_alunos = load_db()
-                            encontrado = False
-                            for _, row in df_alunos.iterrows():
-                                try:
-                                    d = json.loads(row['dados_json'])
-                                    if d.get('doc_uuid') == uuid_input.strip():
-                                        encontrado = True
-                                        st.success("✅ DOCUMENTO VÁLIDO E AUTÊNTICO")
-                                        st.markdown(f"**Aluno:** {d.get('nome', 'N/A')}")
-                                        st.markdown(f"**Tipo:** {row['tipo_doc']}")
-                                        
-                                        assinaturas = d.get('signatures', [])
-                                        if assinaturas:
-                                            st.markdown("---")
-                                            st.markdown("### Assinaturas Digitais:")
-                                            for sig in assinaturas:
-                                                st.info(f"✍️ **{sig['name']}** ({sig.get('role', 'Profissional')})\n\n📅 Assinado em: {sig['date']}")
-                                        else:
-                                            st.warning("Este documento ainda não possui assinaturas digitais registradas.")
-                                        break
-                                except: pass
+                            encontrado = get_storage().find_by_uuid(uuid_input.strip(), parse=parse_doc)
+                            if encontrado:
+                                row, d = encontrado
+                                st.success("✅ DOCUMENTO VÁLIDO E AUTÊNTICO")
+                                st.markdown(f"**Aluno:** {d.get('nome', 'N/A')}")
+                                st.markdown(f"**Tipo:** {row['tipo_doc']}")
+                                
+                                assinaturas = d.get('signatures', [])
+                                if assinaturas:
+                                    st.markdown("---")
+                                    st.markdown("### Assinaturas Digitais:")
+                                    for sig in assinaturas:
+                                        st.info(f"✍️ **{sig['name']}** ({sig.get('role', 'Profissional')})\n\n📅 Assinado em: {sig['date']}")
+                                else:
+                                    st.warning("Este documento ainda não possui assinaturas digitais registradas.")
                             if not encontrado:
                                 st.error("❌ Documento não encontrado ou código inválido.")
                         except Exception as e:
@@ -685,6 +849,9 @@ if 'data_declaracao' not in st.session_state:
     st.session_state.data_declaracao = {}
 
 def carregar_dados_aluno():
+    # Callback: roda antes do script, então abre a execução atual
+    begin_run()
+    st.session_state._execucao_aberta_por_callback = True
     selecao = st.session_state.get('aluno_selecionado')
     
     # Init empty
@@ -693,20 +860,22 @@ def carregar_dados_aluno():
     st.session_state.data_conduta = {}
     st.session_state.data_avaliacao = {}
     st.session_state.data_diario = {}
+    st.session_state.data_declaracao = {}
     st.session_state.data_pdi = {
         'metas': [{'objetivo': '', 'prazo': '', 'estrategia': '', 'status': 'Pendente'} for _ in range(5)],
         'pdi_fortalezas': '', 'pdi_desafios': '', 'pdi_recursos': '', 'pdi_periodo': 'Trimestral', 'pdi_obs': ''
     }
     st.session_state.nome_original_salvamento = None
+    st.session_state.docs_base = {}
+    st.session_state.docs_hash = {}
 
     if not selecao or selecao == "-- Novo Registro --":
         return
 
     try:
-        df_db = load_db()
-        # Filter by name
-        if "nome" in df_db.columns:
-            rows = df_db[df_db["nome"] == selecao]
+        # Apenas os documentos do aluno selecionado (consulta indexada no backend local)
+        rows = get_storage().load_student(selecao)
+        if "nome" in rows.columns:
             if rows.empty: return
             
             st.session_state.nome_original_salvamento = selecao
@@ -719,12 +888,10 @@ def carregar_dados_aluno():
 
             for _, row in rows.iterrows():
                 try:
-                    dados = json.loads(row["dados_json"])
-                    # Date conversion
-                    for k, v in dados.items():
-                        if isinstance(v, str) and len(v) == 10 and v.count('-') == 2:
-                            try: dados[k] = datetime.strptime(v, '%Y-%m-%d').date()
-                            except: pass
+                    dados = converter_datas(parse_doc(row, mutable=True))
+                    # Versão carregada (controle de concorrência ao salvar)
+                    st.session_state.docs_base[row["id"]] = row.to_dict()
+                    st.session_state.docs_hash[row["id"]] = canonical_hash(parse_doc(row))
                     
                     dtype = row["tipo_doc"]
                     if dtype == "PEI":
@@ -739,6 +906,8 @@ def carregar_dados_aluno():
                         st.session_state.data_diario.update(dados)
                     elif dtype == "PDI":
                         st.session_state.data_pdi.update(dados)
+                    elif dtype == "DECLARACAO":
+                        st.session_state.data_declaracao.update(dados)
                 except: pass
             
             st.toast(f"✅ {selecao} carregado.")
@@ -834,7 +1003,7 @@ with st.sidebar:
 # --- SEÇÃO GESTÃO DE ALUNOS ---
     if app_mode == "👥 Gestão de Alunos":
         st.divider()
-        df_db = load_db()
+        df_db = load_columns("nome")
         # Garante que a lista tenha apenas os nomes cadastrados
         lista_nomes = df_db["nome"].dropna().unique().tolist() if not df_db.empty else []
         
@@ -851,16 +1020,16 @@ with st.sidebar:
         )
 
         # Foto na Sidebar
-        current_photo_sb = None
+        img_bytes_sb = None
         if selected_student != "-- Novo Registro --":
-            if st.session_state.get('data_pei', {}).get('nome') == selected_student:
-                 current_photo_sb = st.session_state.data_pei.get('foto_base64')
-            elif st.session_state.get('data_case', {}).get('nome') == selected_student:
-                 current_photo_sb = st.session_state.data_case.get('foto_base64')
+            # A foto do PEI tem preferência; sem ela, usa a do Estudo de Caso
+            for chave_doc in ('data_pei', 'data_case'):
+                doc_sb = st.session_state.get(chave_doc, {})
+                if not img_bytes_sb and doc_sb.get('nome') == selected_student:
+                    img_bytes_sb = photo_bytes(doc_sb)
                  
-        if current_photo_sb:
+        if img_bytes_sb:
             try:
-                img_bytes_sb = base64.b64decode(current_photo_sb)
                 st.image(img_bytes_sb, use_container_width=True)
             except: pass
         
@@ -898,6 +1067,31 @@ with st.sidebar:
             if c_del2.button("🗑️", type="secondary", help="Excluir Aluno"):
                 st.session_state.confirm_delete = True
 
+    # Google Sheets fora do ar: o app segue com a última leitura, sem permitir gravações
+    storage_stats = get_storage().stats()
+    if storage_stats.get("quota", {}).get("circuit_open"):
+        st.warning("⚠️ Google Sheets indisponível no momento. Exibindo a última versão carregada (somente leitura).")
+
+    # Alterações ainda não enviadas ao Google Sheets (modo write-behind)
+    sync_stats = storage_stats.get("sync")
+    if sync_stats and sync_stats["depth"] and not is_monitor:
+        st.caption(f"🔄 {sync_stats['depth']} alteração(ões) aguardando sincronização ({sync_stats['lag_seconds']:.0f}s)")
+
+    # Memória: os snapshots do banco e os documentos decodificados são compartilhados pelo processo;
+    # cada sessão soma apenas os documentos que está editando
+    if not is_monitor:
+        with st.expander("⚙️ Diagnóstico", expanded=False):
+            mb = lambda b: f"{b / (1024 * 1024):.1f} MB"
+            if "cache" in storage_stats:
+                st.caption(f"Snapshot compartilhado do banco: {mb(storage_stats['cache']['bytes'])}")
+            st.caption(f"Documentos decodificados (compartilhados): {mb(get_doc_cache().stats()['bytes'])}")
+            st.caption(f"Esta sessão: {mb(memoria_sessao())}")
+            if "single_flight" in storage_stats:
+                voos = storage_stats["single_flight"]
+                st.caption(f"Leituras agrupadas: {voos['coalesced']} de {voos['coalesced'] + voos['fetches']}")
+            if storage_stats.get("integrity", {}).get("issues"):
+                st.caption(f"⚠️ Divergências de integridade: {storage_stats['integrity']['issues']}")
+
     # 4. RODAPÉ FIXO
     if st.sidebar.button("🚪 Sair", use_container_width=True):
         for key in list(st.session_state.keys()): del st.session_state[key]
@@ -920,6 +1114,21 @@ with st.sidebar:
                 st.session_state.confirm_delete = False
                 st.rerun()
 
+    # Confirmação de recriação (documento excluído por outro usuário durante a edição)
+    recriar = st.session_state.get("confirm_recreate")
+    if recriar:
+        st.warning(f"⚠️ O documento {recriar['doc_type']} de {recriar['name']} foi excluído por outro usuário enquanto você editava. Recriar com os dados da tela?")
+        col_r1, col_r2 = st.columns(2)
+        if col_r1.button("✅ Recriar", key="recriar_sim"):
+            st.session_state.confirm_recreate = None
+            # Sem a versão carregada, o salvamento grava o documento completo como novo (versão 0)
+            st.session_state.setdefault('docs_base', {}).pop(recriar["id"], None)
+            st.session_state.setdefault('docs_hash', {}).pop(recriar["id"], None)
+            save_student(recriar["doc_type"], recriar["name"], recriar["data"], recriar["section"])
+        if col_r2.button("❌ Não", key="recriar_nao"):
+            st.session_state.confirm_recreate = None
+            st.rerun()
+
 # ==============================================================================
 # VIEW: DASHBOARD
 # ==============================================================================
@@ -942,7 +1151,10 @@ if app_mode == "📊 Painel de Gestão":
     </div>
     """, unsafe_allow_html=True)
     
-    df_dash = load_db()
+    # Abas usadas pelo painel (mural e agenda), lidas numa única requisição
+    prefetch("Recados", "Agenda")
+    # Projeção leve: o painel lê apenas o resumo de cada documento, nunca o dados_json completo
+    df_dash = load_summary()
     
     # --- CHECK DE ASSINATURAS PENDENTES ---
     pending_docs = []
@@ -951,8 +1163,7 @@ if app_mode == "📊 Painel de Gestão":
     if not df_dash.empty and user_name_lower:
         for idx, row in df_dash.iterrows():
             try:
-                d = json.loads(row['dados_json'])
-                doc_uuid = d.get('doc_uuid')
+                d = parse_resumo(row)
                 signatures = d.get('signatures', [])
                 signed_names = [s.get('name', '').strip().lower() for s in signatures]
                 
@@ -992,57 +1203,6 @@ if app_mode == "📊 Painel de Gestão":
     total_caso = len(df_dash[df_dash["tipo_doc"] == "CASO"])
     total_pdi = len(df_dash[df_dash["tipo_doc"] == "PDI"])
     
-    # Função Auxiliar de Progresso
-    def calc_progress(row_json, keys_check):
-        try:
-            data = json.loads(row_json)
-            filled = 0
-            for k in keys_check:
-                val = data.get(k)
-                if val:
-                    if isinstance(val, list) and len(val) > 0: filled += 1
-                    elif isinstance(val, dict) and len(val) > 0: filled += 1
-                    elif isinstance(val, str) and val.strip() != "": filled += 1
-                    elif isinstance(val, (int, float)): filled += 1
-                    elif val is True: filled += 1
-            return int((filled / len(keys_check)) * 100)
-        except: return 0
-
-    # --- DEFINIÇÃO DAS CHAVES ESSENCIAIS PARA CADA DOCUMENTO ---
-    
-    keys_pei = [
-        'prof_poli', 'prof_aee',       # 1. Identificação
-        'defic_txt', 'saude_extra',    # 2. Saúde
-        'beh_interesses', 'beh_desafios', # 3. Conduta
-        'dev_afetivo',                 # 4. Escolar
-        'aval_port', 'aval_ling_verbal', # 5. Acadêmico (um dos dois)
-        'meta_social_obj', 'meta_acad_obj', # 6. Metas
-        'plano_obs_geral'              # Final
-    ]
-
-    keys_caso = [
-        'endereco', 'quem_mora',                   # Identificação e Família
-        'hist_idade_entrou', 'gest_parentesco',    # Histórico e Gestação
-        'saude_prob', 'med_uso',                   # Saúde
-        'entrevista_prof', 'entrevista_resp'       # Comportamento / Entrevista
-    ]
-
-    keys_aval = [
-        'aspectos_gerais', 'defic_chk',            # Identificação
-        'alim_nivel', 'hig_nivel', 'loc_nivel',    # Parte I
-        'comportamento', 'part_grupo', 'interacao',# Parte II
-        'rotina', 'ativ_pedag',                    # Parte III
-        'atencao_sust', 'linguagem',               # Parte IV
-        'conclusao_nivel', 'resp_ee'               # Conclusão
-    ]
-
-    keys_pdi = [
-        'potencialidades', 'areas_interesse',      # Avaliação Inicial
-        'acao_escola', 'acao_sala', 'acao_familia',# Ações Necessárias
-        'aee_tempo', 'aee_tipo',                   # Organização AEE
-        'goals_specific'                           # Objetivos Detalhados
-    ]
-    
     concluidos = 0
     deficiencies_count = {}
     
@@ -1055,7 +1215,7 @@ if app_mode == "📊 Painel de Gestão":
     # --- LOOP DE CÁLCULO GERAL ---
     for idx, row in df_dash.iterrows():
         try:
-            d = json.loads(row['dados_json'])
+            d = parse_resumo(row)
             
             # Gráfico de Deficiências
             for dtype in d.get('diag_tipo', []):
@@ -1064,25 +1224,22 @@ if app_mode == "📊 Painel de Gestão":
                 d_txt = d.get('defic_txt').upper().strip()
                 deficiencies_count[d_txt] = deficiencies_count.get(d_txt, 0) + 1
             
-            # Separação por Tipo de Documento e Cálculo
+            # Separação por Tipo de Documento (progresso já calculado ao salvar)
             tipo_documento = row['tipo_doc']
             nome_aluno = row['nome']
+            prog = d.get('progresso', 0)
             
             if tipo_documento == "PEI":
-                prog = calc_progress(row['dados_json'], keys_pei)
                 pei_progress_list.append({"Aluno": nome_aluno, "Progresso": prog})
                 if prog >= 90: concluidos += 1
                 
             elif tipo_documento == "CASO":
-                prog = calc_progress(row['dados_json'], keys_caso)
                 caso_progress_list.append({"Aluno": nome_aluno, "Progresso": prog})
                 
             elif tipo_documento == "AVALIACAO":
-                prog = calc_progress(row['dados_json'], keys_aval)
                 apoio_progress_list.append({"Aluno": nome_aluno, "Progresso": prog})
                 
             elif tipo_documento == "PDI":
-                prog = calc_progress(row['dados_json'], keys_pdi)
                 pdi_progress_list.append({"Aluno": nome_aluno, "Progresso": prog})
                 
         except: pass
@@ -1097,7 +1254,7 @@ if app_mode == "📊 Painel de Gestão":
     if not df_dash.empty:
         for _, row in df_dash.iterrows():
             try:
-                d_laudo = json.loads(row['dados_json'])
+                d_laudo = parse_resumo(row)
                 # Checa no PEI se marcou "Sim" para diagnóstico conclusivo
                 if row['tipo_doc'] == "PEI" and d_laudo.get('diag_status') == "Sim":
                     alunos_com_laudo.add(row['nome'])
@@ -1116,7 +1273,7 @@ if app_mode == "📊 Painel de Gestão":
         df_aval = df_dash[df_dash["tipo_doc"] == "AVALIACAO"]
         for _, row in df_aval.iterrows():
             try:
-                d_aval = json.loads(row['dados_json'])
+                d_aval = parse_resumo(row)
                 nivel = d_aval.get('conclusao_nivel', '')
                 if "Nível 2" in nivel or "Nível 3" in nivel or d_aval.get('apoio_existente'):
                     total_apoio += 1
@@ -1311,13 +1468,14 @@ elif app_mode == "👥 Gestão de Alunos":
                 with col_img:
                     st.markdown("📷 **Foto**")
                     # Se ja tiver foto, mostra
-                    if data.get('foto_base64'):
+                    foto_atual = photo_bytes(data)
+                    if foto_atual:
                         try:
-                            b = base64.b64decode(data['foto_base64'])
-                            st.image(b, use_container_width=True)
+                            st.image(foto_atual, use_container_width=True)
                             if not is_monitor:
                                 if st.checkbox("Remover", key="rem_foto_pei"):
                                     data['foto_base64'] = None
+                                    data['foto_sha256'] = None
                         except:
                             st.error("Erro foto")
                     
@@ -1821,9 +1979,9 @@ elif app_mode == "👥 Gestão de Alunos":
                 
                 # --- FOTO ---
                 # Retângulo da foto: x=256, y=53, w=30, h=40
-                if data.get('foto_base64'):
+                img_data = photo_bytes(data)
+                if img_data:
                     try:
-                        img_data = base64.b64decode(data.get('foto_base64'))
                         with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
                             tmp_file.write(img_data)
                             tmp_path = tmp_file.name
@@ -4133,10 +4291,9 @@ elif app_mode == "👥 Gestão de Alunos":
                     # FOTO (Placeholder circular visual - quadrado com label por simplicidade do FPDF)
                     pdf.set_xy(10, start_y)
                     # Tenta carregar foto do PEI se não tiver no conduta (usa mesma ref)
-                    foto_b64 = data_pei.get('foto_base64')
-                    if foto_b64:
+                    img_data = photo_bytes(data_pei)
+                    if img_data:
                         try:
-                            img_data = base64.b64decode(foto_b64)
                             with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
                                 tmp_file.write(img_data)
                                 tmp_path = tmp_file.name
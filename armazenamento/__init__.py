@@ -0,0 +1,22 @@
+"""Camada de armazenamento do Sistema Integra (Google Sheets e afins)."""
+from .sheets import SheetsValuesClient, a1, col_letter, spreadsheet_id_from_url
+from .historico import HistoryLogger, HISTORY_COLUMNS, PATCH_COLUMNS
+from .backup import BackupJournal, JOURNAL_COLUMNS
+from .cache import WorksheetCache, VersionCells, RowIndex, DocCache, SingleFlight, share, frame_bytes, estimate_size, begin_run, memoized, memoized_many, forget
+from .backends import (
+    StorageBackend, SheetsBackend, AntiWipeError, VersionConflictError, DB_COLUMNS, SUMMARY_COLUMNS,
+    record_version, upsert_frame, with_summary, externalize_photo,
+)
+from .cota import QuotaGuard, TokenBucket, CircuitOpenError, GuardedConnection
+from .blobs import SheetsBlobStore, blob_hash
+from .mudancas import ChangeFeed, CHANGE_COLUMNS
+from .compartilhado import SharedStore, SharedVersions
+from .integridade import row_hash, combine, HASH_COLUMN
+from .codec import encode_cells, decode_cells, decode_frame
+from .sqlite import SQLiteBackend
+from .arquivo import JsonFileBackend
+from .sync import WriteBehindQueue
+from .documentos import (
+    three_way_merge, merge_patch, apply_merge_patch, canonical_hash, changed_fields, dirty_sections, summarize, progress,
+    SUMMARY_FIELDS, PROGRESS_KEYS, SECTION_FIELDS,
+)
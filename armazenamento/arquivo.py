@@ -0,0 +1,439 @@
+"""
+Backend em arquivo JSON local, no formato de banco_dados_aee_final.json: um objeto
+{"Nome (TIPO)": documento}. Serve para desenvolvimento, testes e para trabalhar sem o
+Google Sheets; carrega tudo na memória na inicialização, sem nenhuma requisição.
+
+Cada gravação é acrescentada (e sincronizada no disco) a um log de alterações ao lado
+do arquivo (<nome>.log, uma linha JSON por alteração). O arquivo principal só é reescrito
+na compactação, num temporário seguido de rename atômico; o que não cabe no formato
+(versões, resumos e abas auxiliares) vai para <nome>.aux.json, gravado da mesma forma.
+As fotos ficam fora dos dois, uma por arquivo em <nome>.blobs/<sha256>: nunca são
+carregadas na memória nem reescritas, e o mesmo arquivo serve a todos os documentos. A compactação grava um documento por linha, o que permite carregar o
+arquivo em fluxo, sem decodificar os documentos. O journal de backup só cresce: fica em
+<nome>.backup.log (uma linha JSON por entrada), que não é lido na carga nem reescrito na
+compactação. Apenas um processo deve usar o arquivo por vez.
+"""
+import base64
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from .backends import (
+    DB_COLUMNS, SEED_WORKSHEETS, SUMMARY_COLUMNS, StorageBackend, apply_patch, check_version, effective_patch,
+    guard_delete, parse_row, patch_entry, record_version, with_summary,
+)
+from .backup import replay
+from .blobs import blob_hash
+from .cache import share
+
+# O hash vem de dentro dos documentos: só um SHA-256 em hexadecimal vira nome de arquivo
+SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+def split_id(doc_id):
+    """("Nome", "TIPO") de um id no formato "Nome (TIPO)" """
+    name, sep, rest = doc_id.rpartition(" (")
+    if not sep or not rest.endswith(")"):
+        return doc_id, ""
+    return name, rest[:-1]
+
+
+def _read_json(path, default):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return default
+    with open(path, "rb") as f:
+        return json.loads(f.read())
+
+
+def signature(path):
+    """Tamanho e data de modificação do arquivo: revela edições feitas fora do app"""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def scan_lines(path):
+    """
+    Leitura em fluxo do arquivo gravado pela compactação (um documento por linha):
+    {id: texto JSON do documento}, sem decodificar os documentos. None se o arquivo
+    tiver outro layout (ex.: o JSON indentado original), que então é lido por inteiro.
+    """
+    decoder = json.JSONDecoder()
+    docs = {}
+    with open(path, encoding="utf-8") as f:
+        if f.readline().strip() != "{":
+            return None
+        for line in f:
+            line = line.strip()
+            if line == "}":
+                return docs
+            if not line:
+                continue
+            try:
+                doc_id, end = decoder.raw_decode(line)
+            except ValueError:
+                return None
+            key, _, raw = line[end:].partition(":")
+            raw = raw.strip().rstrip(",")
+            if key.strip() or not (raw.startswith("{") and raw.endswith("}")):
+                return None
+            docs[doc_id] = raw
+    return None
+
+
+def atomic_write(path, write, binary=False):
+    """Grava 'path' por 'write(arquivo)' num temporário do mesmo diretório e o renomeia por cima"""
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        # mkstemp cria o temporário com permissão 0600; o arquivo substituído mantém a sua
+        os.chmod(tmp, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        with (os.fdopen(fd, "wb") if binary else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class JsonFileBackend(StorageBackend):
+    """Persistência em um arquivo JSON local ({"Nome (TIPO)": documento}) com log de alterações."""
+
+    def __init__(self, path, compact_every=500):
+        self.path = path
+        base = os.path.splitext(path)[0]
+        self.log_path = base + ".log"
+        self.aux_path = base + ".aux.json"
+        self.backup_path = base + ".backup.log"
+        self.blobs_path = base + ".blobs"
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._log = None
+        self._table = None
+        self._backup_count = None
+        self._load()
+
+    # --- CARGA E COMPACTAÇÃO ---
+    def _load(self):
+        aux = _read_json(self.aux_path, {})
+        self._seq = aux.get("seq", 0)
+        self._sheets = aux.get("planilhas", {})
+        # Fotos em base64 no auxiliar (versões anteriores) passam para arquivos próprios
+        legacy_blobs = aux.get("blobs", {})
+        for data in legacy_blobs.values():
+            self._write_blob(base64.b64decode(data))
+        # Backups de versões anteriores (no auxiliar ou no log) passam para o journal próprio
+        self._legacy_backups = list(aux.get("backup", []))
+        self._patches = aux.get("patches", {})
+        versions = aux.get("versoes", {})
+        # Arquivo intacto desde a última compactação: lido em fluxo, sem decodificar os documentos,
+        # com doc_uuid e resumo vindos do auxiliar
+        docs = None
+        if os.path.exists(self.path) and aux.get("arquivo") == signature(self.path):
+            docs = scan_lines(self.path)
+        if docs is None:
+            docs = {k: json.dumps(v, ensure_ascii=False) for k, v in _read_json(self.path, {}).items()}
+            derived = {}
+        else:
+            derived = aux.get("derivados", {})
+        self._records = {}
+        for doc_id, raw in docs.items():
+            name, doc_type = split_id(doc_id)
+            record = {"id": doc_id, "nome": name, "tipo_doc": doc_type, "dados_json": raw,
+                      "version": versions.get(doc_id, 0)}
+            if doc_id in derived:
+                record["doc_uuid"], record["resumo"] = derived[doc_id]
+            else:
+                record = with_summary(record)
+            self._records[doc_id] = record
+        self._pending = 0
+        for entry in self._read_log():
+            if entry.get("seq", 0) > self._seq:
+                self._apply(entry)
+                self._seq = entry["seq"]
+                self._pending += 1
+        migrated = bool(self._legacy_backups or legacy_blobs)
+        if self._legacy_backups:
+            self._append_backups(self._legacy_backups)
+            self._legacy_backups = []
+        if migrated:
+            self.compact()
+
+    def _read_log(self):
+        # Lido linha a linha: o log nunca é carregado inteiro na memória
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as f:
+            good = 0
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("linha incompleta")
+                    entry = json.loads(line)
+                except ValueError:
+                    # Queda durante a gravação: a alteração não chegou a valer; a sobra é cortada
+                    # para que as próximas linhas não sejam acrescentadas depois dela
+                    break
+                good = f.tell()
+                yield entry
+            else:
+                return
+        os.truncate(self.log_path, good)
+
+    def compact(self):
+        """Reescreve o arquivo principal e o auxiliar com o estado atual e esvazia o log"""
+        with self._lock:
+            records = list(self._records.values())
+
+            def write_docs(f):
+                # O dados_json já é JSON: entra no arquivo sem ser decodificado de novo
+                f.write("{\n")
+                f.write(",\n".join(f"    {json.dumps(r['id'], ensure_ascii=False)}: {r['dados_json']}"
+                                   for r in records))
+                f.write("\n}\n")
+
+            # Ordem segura: documentos, depois o auxiliar (com o 'seq'), depois o log. Se o processo
+            # cair no meio, o log é reaplicado a partir do 'seq' do auxiliar que chegou ao disco.
+            atomic_write(self.path, write_docs)
+            aux = {
+                "seq": self._seq,
+                "arquivo": signature(self.path),
+                "versoes": {r["id"]: r["version"] for r in records},
+                "derivados": {r["id"]: [r["doc_uuid"], r["resumo"]] for r in records},
+                "planilhas": self._sheets,
+                "patches": self._patches,
+            }
+            atomic_write(self.aux_path, lambda f: json.dump(aux, f, ensure_ascii=False, default=str))
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            open(self.log_path, "w").close()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._pending:
+                self.compact()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    # --- LOG DE ALTERAÇÕES ---
+    def _commit(self, entry):
+        """Anota a alteração no log (sincronizado no disco) e só então a aplica na memória"""
+        with self._lock:
+            self._seq += 1
+            entry = dict(entry, seq=self._seq)
+            if self._log is None:
+                self._log = open(self.log_path, "a", encoding="utf-8")
+            self._log.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._apply(entry)
+            self._pending += 1
+            if self._pending >= self.compact_every:
+                self.compact()
+
+    def _apply(self, entry):
+        op = entry["op"]
+        if op == "save":
+            record = entry["registro"]
+            self._records[record["id"]] = record
+        elif op == "patch":
+            # O documento é refeito a partir do gravado; o patch também fica no log do documento
+            doc_id = entry["registro"]["id"]
+            self._records[doc_id] = apply_patch(entry["registro"], self._records.get(doc_id),
+                                                json.loads(entry["log"]["patch"]))
+            self._patches.setdefault(doc_id, []).append(entry["log"])
+        elif op == "delete":
+            for doc_id in entry["ids"]:
+                self._records.pop(doc_id, None)
+        elif op == "planilha":
+            self._sheets[entry["aba"]] = entry["linhas"]
+        elif op == "linha":
+            self._sheets.setdefault(entry["aba"], []).append(entry["linha"])
+        elif op == "blob":
+            # Só em logs de versões anteriores: hoje a foto vai direto para o seu arquivo
+            self._write_blob(base64.b64decode(entry["dados"]))
+        elif op == "backup":
+            self._legacy_backups.append(entry["registro"])
+        if op in ("save", "patch", "delete"):
+            self._table = None
+
+    def seed_from(self, source):
+        """Copia Alunos e as abas auxiliares de outro backend para o arquivo"""
+        df = source.load_db(strict=True)
+        with self._lock:
+            for _, r in df.iterrows():
+                if isinstance(r.get("dados_json"), str):
+                    self._commit({"op": "save", "registro": with_summary({
+                        "id": str(r["id"]), "nome": str(r["nome"]), "tipo_doc": str(r["tipo_doc"]),
+                        "dados_json": r["dados_json"], "version": record_version(r)})})
+            for worksheet in SEED_WORKSHEETS:
+                try:
+                    self.safe_update(worksheet, source.safe_read(worksheet))
+                except Exception as e:
+                    print(f"Aviso: não foi possível copiar a aba {worksheet}: {e}")
+            self.compact()
+
+    # --- ALUNOS ---
+    def _frame(self):
+        # Um único DataFrame para todas as leituras, refeito só depois de uma gravação
+        with self._lock:
+            if self._table is None:
+                self._table = pd.DataFrame(list(self._records.values()), columns=DB_COLUMNS)
+            return self._table
+
+    def load_db(self, strict=False):
+        return share(self._frame())
+
+    def load_columns(self, columns):
+        unknown = [c for c in columns if c not in DB_COLUMNS]
+        if unknown:
+            raise ValueError(f"Colunas inexistentes em alunos: {unknown}")
+        return self._frame()[list(columns)]
+
+    def load_summary(self):
+        return self._frame()[SUMMARY_COLUMNS]
+
+    def load_student(self, name):
+        with self._lock:
+            records = [r for r in self._records.values() if r["nome"] == name]
+        return pd.DataFrame(records, columns=DB_COLUMNS)
+
+    def find_by_uuid(self, doc_uuid, parse=None):
+        with self._lock:
+            record = next((r for r in self._records.values() if r["doc_uuid"] == doc_uuid), None)
+        if record is None:
+            return None
+        row = pd.Series(record)
+        return row, (parse or parse_row)(row)
+
+    def save_student(self, record, user, operation, backup=True, expected_version=None, patch=None):
+        with self._lock:
+            previous = self._records.get(record["id"])
+            patch = effective_patch(previous, patch)
+            saved = with_summary(check_version(apply_patch(record, previous, patch), previous, expected_version))
+            if backup:
+                self.create_backup(previous, saved, user, operation)
+            if patch is None:
+                self._commit({"op": "save", "registro": saved})
+            else:
+                # No log de alterações vai só o patch (tamanho proporcional à seção), sem o dados_json
+                self._commit({"op": "patch", "registro": {k: v for k, v in saved.items() if k != "dados_json"},
+                              "log": patch_entry(saved, user, patch)})
+        return saved
+
+    def patch_log(self, record_id):
+        with self._lock:
+            return [dict(e, patch=json.loads(e["patch"])) for e in self._patches.get(record_id, [])]
+
+    def delete_student(self, name, user, backup=True):
+        with self._lock:
+            records = [r for r in self._records.values() if r["nome"] == name]
+            guard_delete(name, records)
+            if backup:
+                for r in records:
+                    self.create_backup(r, None, user, "Exclusão")
+            if records:
+                self._commit({"op": "delete", "ids": [r["id"] for r in records]})
+        return records
+
+    # --- BLOBS (FOTOS) ---
+    def _blob_file(self, sha):
+        return os.path.join(self.blobs_path, sha)
+
+    def _write_blob(self, data):
+        # Endereçado pelo conteúdo: um arquivo que já existe tem exatamente esses bytes. A gravação
+        # (sincronizada no disco) termina antes de o documento que a referencia ir para o log
+        sha = blob_hash(data)
+        path = self._blob_file(sha)
+        if not os.path.exists(path):
+            os.makedirs(self.blobs_path, exist_ok=True)
+            atomic_write(path, lambda f: f.write(data), binary=True)
+        return sha
+
+    def put_blob(self, data):
+        return self._write_blob(data)
+
+    def get_blob(self, sha):
+        if not isinstance(sha, str) or not SHA256.fullmatch(sha):
+            return None
+        try:
+            with open(self._blob_file(sha), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if blob_hash(data) != sha:
+            raise ValueError(f"Foto {sha[:12]} corrompida em {self.blobs_path}.")
+        return data
+
+    # --- BACKUP E HISTÓRICO ---
+    def create_backup(self, previous, new, user, operation):
+        if previous is None and new is None:
+            return
+        base = new if new is not None else previous
+        self._append_backups([{
+            "data_hora": datetime.now().strftime("%d/%m/%Y %H:%M:%S"), "usuario": user, "operacao": operation,
+            "id": base.get("id"), "nome": base.get("nome"), "tipo_doc": base.get("tipo_doc"),
+            "dados_anterior": "" if previous is None else previous.get("dados_json", ""),
+            "dados_novo": "" if new is None else new.get("dados_json", ""),
+        }])
+
+    def _append_backups(self, entries):
+        # Só acrescenta (e sincroniza no disco) no journal; nada dele fica na memória
+        with self._lock:
+            with open(self.backup_path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if self._backup_count is not None:
+                self._backup_count += len(entries)
+
+    def read_backups(self):
+        """Entradas do journal de backup, da mais antiga à mais nova (lidas em fluxo)"""
+        if not os.path.exists(self.backup_path):
+            return
+        with open(self.backup_path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+
+    def restore_to(self, seq=None):
+        # 'seq' de uma entrada é a sua posição no journal (1 = primeira). Como no SQLite, parte do
+        # estado atual e desfaz o que veio depois
+        with self._lock:
+            current = list(self._records.values())
+            journal = [] if seq is None else [dict(e, seq=i) for i, e in enumerate(self.read_backups(), 1)
+                                              if i > int(seq)]
+        return replay(current, journal, float("inf"), seq)
+
+    def log_action(self, entry):
+        self._commit({"op": "linha", "aba": "Historico", "linha": json.loads(json.dumps(entry, default=str))})
+
+    # --- ABAS AUXILIARES ---
+    def safe_read(self, worksheet):
+        with self._lock:
+            rows = list(self._sheets.get(worksheet, []))
+        return pd.DataFrame(rows)
+
+    def safe_update(self, worksheet, df):
+        rows = df.dropna(how="all").to_dict("records") if df is not None else []
+        # Ida e volta pelo JSON: a memória fica igual ao que o log reaplicaria
+        self._commit({"op": "planilha", "aba": worksheet,
+                      "linhas": json.loads(json.dumps(rows, ensure_ascii=False, default=str))})
+
+    def stats(self):
+        with self._lock:
+            if self._backup_count is None:
+                self._backup_count = sum(1 for _ in self.read_backups())
+            return {"alunos": len(self._records), "journal": self._backup_count, "log": self._pending,
+                    "patches": sum(len(v) for v in self._patches.values()), "path": self.path}
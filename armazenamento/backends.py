@@ -0,0 +1,732 @@
+"""
+Interface de persistência do app e sua implementação sobre o Google Sheets.
+
+O app (app_pei.py) cuida de permissões e mensagens; os backends apenas leem e
+gravam, levantando exceção em caso de falha.
+"""
+import base64
+import json
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from .backup import BackupJournal
+from .blobs import SheetsBlobStore
+from .cache import RowIndex, SingleFlight, VersionCells, WorksheetCache, index_add, index_delete, share
+from .codec import CELL_LIMIT, decode_cells, decode_frame, encode_cells
+from .compartilhado import SharedVersions
+from .cota import GuardedConnection
+from .documentos import apply_merge_patch, summarize
+from .historico import PATCH_COLUMNS, HistoryLogger
+from .integridade import HASH_COLUMN, combine, row_hash, stored_hash
+from .mudancas import ChangeFeed
+from .sheets import a1, cell_text, col_letter, http_status, is_retryable
+
+DB_COLUMNS = ["id", "nome", "tipo_doc", "dados_json", "version", "doc_uuid", "resumo"]
+# Projeção estreita usada pelas listagens (sem o dados_json)
+SUMMARY_COLUMNS = ["id", "nome", "tipo_doc", "doc_uuid", "resumo", "version"]
+# Abas auxiliares copiadas para um backend local na primeira inicialização
+SEED_WORKSHEETS = ["Professores", "Monitores", "Recados", "Agenda", "Historico"]
+
+
+class AntiWipeError(Exception):
+    """Operação bloqueada pela trava de segurança contra perda de dados em massa."""
+
+
+class VersionConflictError(Exception):
+    """O registro foi alterado por outra pessoa desde que foi lido ('current' traz a versão atual)."""
+
+    def __init__(self, record_id, expected, current):
+        super().__init__(f"'{record_id}' foi alterado por outro usuário "
+                         f"(versão esperada {expected}, atual {record_version(current)}).")
+        self.record_id = record_id
+        self.expected = expected
+        self.current = current
+
+
+def record_version(record):
+    """Versão de um registro (linhas antigas, sem a coluna, contam como 0)"""
+    if record is None:
+        return 0
+    try:
+        return int(float(record.get("version") or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def guard_delete(name, records):
+    """
+    Trava contra exclusão em massa: só permite apagar linhas de um nome não vazio e, no máximo,
+    um documento por tipo; cada linha precisa ser do aluno e ter o id "nome (tipo)".
+    """
+    if not str(name or "").strip():
+        raise AntiWipeError("Nome do aluno vazio na exclusão. Operação cancelada.")
+    types = set()
+    for r in records:
+        doc_type = str(r.get("tipo_doc"))
+        if str(r.get("nome")) != str(name) or str(r.get("id")) != f"{name} ({doc_type})" or doc_type in types:
+            raise AntiWipeError(f"A exclusão de '{name}' atingiria a linha '{r.get('id')}', que não é um documento "
+                                "único do aluno. Operação cancelada.")
+        types.add(doc_type)
+
+
+def guard_count(worksheet, expected, actual, tolerance=10):
+    """
+    Trava contra perda em massa: a aba não pode ter bem menos linhas do que os metadados registram
+    (a folga cobre gravações simultâneas que os metadados ainda não contaram).
+    """
+    if expected is None:
+        return
+    if actual < expected - max(tolerance, expected // 10):
+        raise AntiWipeError(f"A aba {worksheet} tem {actual} linha(s), mas os metadados registram {expected}. "
+                            "Gravação bloqueada até a conferência da planilha.")
+
+
+def check_version(record, previous, expected_version):
+    """
+    Compare-and-swap: confere a versão esperada e devolve o registro com a versão seguinte.
+    expected_version=None grava sem conferir (ex.: espelho de um backend que já conferiu).
+    """
+    if expected_version is None:
+        return dict(record, version=record.get("version") or record_version(previous) + 1)
+    if record_version(previous) != expected_version:
+        raise VersionConflictError(record["id"], expected_version, previous)
+    return dict(record, version=expected_version + 1)
+
+
+def effective_patch(previous, patch):
+    """
+    O patch só vale sobre um dados_json gravado. Sem ele (documento novo, ou excluído por outro
+    usuário) não há base: grava-se o documento completo do registro, sem entrada no log de patches.
+    """
+    return patch if previous is not None and previous.get("dados_json") else None
+
+
+def apply_patch(record, previous, patch):
+    """
+    Registro com o dados_json resultante de aplicar o merge patch ao dados_json gravado
+    ('previous'); sem patch ou sem base, o próprio registro. As colunas derivadas ficam por conta do chamador.
+    """
+    patch = effective_patch(previous, patch)
+    if patch is None:
+        return record
+    current = json.loads(previous["dados_json"])
+    return dict(record, dados_json=json.dumps(apply_merge_patch(current, patch), ensure_ascii=False))
+
+
+def patch_entry(record, user, patch):
+    """Entrada do log de patches (PATCH_COLUMNS) para o registro gravado"""
+    return {"data_hora": datetime.now().strftime("%d/%m/%Y %H:%M:%S"), "id": record["id"],
+            "versao": record_version(record), "usuario": user,
+            "patch": json.dumps(patch, ensure_ascii=False, separators=(",", ":"))}
+
+
+def parse_row(row):
+    return json.loads(row["dados_json"])
+
+
+def with_summary(record):
+    """Registro com as colunas derivadas do dados_json (doc_uuid e resumo) recalculadas"""
+    try:
+        doc = json.loads(record["dados_json"])
+    except (TypeError, ValueError):
+        return dict(record, doc_uuid="", resumo="")
+    return dict(record, doc_uuid=doc.get("doc_uuid") or "",
+                resumo=json.dumps(summarize(record.get("tipo_doc"), doc), ensure_ascii=False))
+
+
+def summary_frame(df):
+    """Projeção SUMMARY_COLUMNS de um DataFrame completo, calculando o resumo das linhas que não o têm"""
+    if df.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    rows = []
+    for _, row in df.iterrows():
+        r = row.to_dict()
+        if not isinstance(r.get("resumo"), str) or not r["resumo"]:
+            r = with_summary(r)
+        rows.append({k: r.get(k) for k in SUMMARY_COLUMNS})
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def externalize_photo(doc, put_blob):
+    """
+    Troca o 'foto_base64' do documento (dict) pela referência 'foto_sha256', gravando a
+    imagem com put_blob(bytes). Retorna True se o documento foi alterado.
+    """
+    if "foto_base64" not in doc:
+        return False
+    photo = doc.pop("foto_base64")
+    if photo:
+        doc["foto_sha256"] = put_blob(base64.b64decode(photo))
+    return True
+
+
+def upsert_frame(df, record):
+    """Aplica um registro (upsert por 'id') num DataFrame de alunos e o devolve"""
+    if not df.empty and "id" not in df.columns:
+        raise KeyError("id")
+    if not df.empty and "id" in df.columns and record["id"] in df["id"].values:
+        mask = df["id"] == record["id"]
+        for k, v in record.items():
+            # Frames lidos da planilha têm colunas de texto (dtype 'str' no pandas 3), que recusam
+            # números: o valor entra como a planilha o devolveria
+            if isinstance(v, (int, float)) and not pd.isna(v) and isinstance(df.dtypes.get(k), pd.StringDtype):
+                v = cell_text(v)
+            df.loc[mask, k] = v
+        return df
+    return pd.concat([df, pd.DataFrame([record])], ignore_index=True)
+
+
+class StorageBackend:
+    """Operações de persistência usadas pelo app; toda falha é sinalizada com exceção."""
+
+    def load_db(self, strict=False):
+        """DataFrame da aba Alunos (id, nome, tipo_doc, dados_json)"""
+        raise NotImplementedError
+
+    def load_columns(self, columns):
+        """Apenas as colunas pedidas da aba Alunos (projeção); colunas inexistentes vêm vazias"""
+        return self.load_db().reindex(columns=list(columns))
+
+    def load_student(self, name):
+        """Linhas (todos os tipos de documento) de um aluno"""
+        df = self.load_db()
+        return df[df["nome"] == name] if "nome" in df.columns else df.iloc[0:0]
+
+    def load_summary(self):
+        """DataFrame com as colunas SUMMARY_COLUMNS (resumo em JSON), sem o dados_json"""
+        df = self.load_columns(SUMMARY_COLUMNS)
+        if df.empty or df["resumo"].map(lambda v: isinstance(v, str) and v != "").all():
+            return df
+        # Linhas ainda sem resumo: calcula a partir do documento completo
+        return summary_frame(self.load_db())
+
+    def find_by_uuid(self, doc_uuid, parse=None):
+        """(linha, documento) cujo doc_uuid é 'doc_uuid', ou None. 'parse(linha)' decodifica o dados_json."""
+        parse = parse or parse_row
+        df = self.load_db()
+        if "doc_uuid" in df.columns:
+            # Só decodifica as linhas sem a coluna preenchida (ainda não migradas)
+            df = df[(df["doc_uuid"] == doc_uuid) | (df["doc_uuid"].fillna("") == "")]
+        for _, row in df.iterrows():
+            try:
+                doc = parse(row)
+            except Exception:
+                continue
+            if doc.get("doc_uuid") == doc_uuid:
+                return row, doc
+        return None
+
+    def safe_read(self, worksheet):
+        raise NotImplementedError
+
+    def put_blob(self, data):
+        """Grava um arquivo (bytes) no armazenamento por conteúdo e retorna seu SHA-256"""
+        raise NotImplementedError
+
+    def get_blob(self, sha):
+        """Conteúdo do arquivo com esse SHA-256, ou None"""
+        raise NotImplementedError
+
+    def migrate_photos(self, user="Sistema"):
+        """
+        Migração: move o 'foto_base64' embutido nos documentos para o armazenamento de blobs,
+        deixando no documento apenas 'foto_sha256'. Cada documento é regravado com conferência
+        de versão; os que mudarem no meio do caminho ficam para a próxima execução.
+        Retorna quantos documentos foram migrados.
+        """
+        migrated = 0
+        for _, row in self.load_db().iterrows():
+            raw = row.get("dados_json")
+            if not isinstance(raw, str) or '"foto_base64"' not in raw:
+                continue
+            try:
+                doc = json.loads(raw)
+                if not externalize_photo(doc, self.put_blob):
+                    continue
+                record = {k: row[k] for k in ("id", "nome", "tipo_doc")}
+                record["dados_json"] = json.dumps(doc, ensure_ascii=False)
+                self.save_student(record, user, "Migração de foto", backup=False,
+                                  expected_version=record_version(row))
+                migrated += 1
+            except VersionConflictError:
+                continue
+        return migrated
+
+    def safe_update(self, worksheet, df):
+        raise NotImplementedError
+
+    def seed_worksheets(self, tables):
+        """
+        Semente de um armazenamento local (sem o Google Sheets): grava as abas de 'tables'
+        ({aba: lista de linhas ou DataFrame}) que ainda estão vazias aqui, para que Professores
+        e Monitores existam no primeiro acesso. Retorna as abas gravadas.
+        """
+        filled = []
+        for worksheet, rows in tables.items():
+            df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+            if not df.empty and self.safe_read(worksheet).empty:
+                self.safe_update(worksheet, df)
+                filled.append(worksheet)
+        return filled
+
+    def read_many(self, worksheets):
+        """Várias abas de uma vez: dict aba -> DataFrame (no Sheets, numa única requisição)"""
+        return {w: self.safe_read(w) for w in worksheets}
+
+    def save_student(self, record, user, operation, backup=True, expected_version=None, patch=None):
+        """
+        Upsert do registro por 'id', com controle otimista de concorrência: se
+        'expected_version' for informado e a versão atual for outra, levanta
+        VersionConflictError sem gravar. Retorna o registro gravado (com a nova 'version').
+        Com 'patch' (merge patch, RFC 7386), o dados_json gravado é o atual com o patch
+        aplicado, e o patch entra no log do documento (patch_log).
+        """
+        raise NotImplementedError
+
+    def patch_log(self, record_id):
+        """Entradas (PATCH_COLUMNS, com o patch decodificado) do log do documento, da mais antiga à mais nova"""
+        return []
+
+    def delete_student(self, name, user, backup=True):
+        """Remove todos os documentos do aluno. Retorna a lista de registros removidos."""
+        raise NotImplementedError
+
+    def create_backup(self, previous, new, user, operation):
+        raise NotImplementedError
+
+    def restore_to(self, seq=None):
+        """
+        Registros (id, nome, tipo_doc, dados_json) de Alunos no ponto 'seq' do journal de
+        backup (None = mais recente); não grava nada.
+        """
+        raise NotImplementedError
+
+    def log_action(self, entry):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class SheetsBackend(StorageBackend):
+    """
+    Persistência no Google Sheets: leituras completas pela conexão do Streamlit
+    (com cache versionado) e gravações por linha pela API de valores.
+    """
+
+    def __init__(self, conn, client, guard=None, shared=None):
+        # Com um QuotaGuard, todas as chamadas (conexão e cliente) passam pelo controle de cota
+        if guard is not None:
+            conn = GuardedConnection(conn, guard)
+            client.guard = client.guard or guard
+        self.conn = conn
+        self.client = client
+        self.guard = guard
+        # O dados_json fica comprimido na planilha (codec); o cache guarda o JSON já decodificado
+        versions = VersionCells(client)
+        # Com um SharedStore, as réplicas do mesmo servidor dividem carimbos, snapshots e índice
+        self.shared = shared
+        if shared is not None:
+            versions = SharedVersions(versions, shared)
+        # Carimbos e metadados de integridade (linhas e soma dos resumos) da aba Alunos
+        self.versions = versions
+        self.integrity_issues = 0
+        # Leituras idênticas simultâneas (várias sessões abrindo o painel) viram uma só requisição
+        self.flights = SingleFlight()
+        # Gravações de outros processos chegam pelo feed de alterações (só as linhas alteradas)
+        self.feed = ChangeFeed(client)
+        self.cache = WorksheetCache(fetch=self._fetch, versions=versions, flights=self.flights, delta=self._delta,
+                                    shared=shared)
+        # Índice nome -> linhas da aba Alunos (abrir um aluno lê só as linhas dele)
+        self.index = RowIndex(self._index_rows, versions, "Alunos", flights=self.flights, delta=self._index_delta,
+                              shared=shared)
+        self.journal = BackupJournal(client)
+        self.blobs = SheetsBlobStore(client)
+        self._logger = None
+        self._patches = None
+        self._workers_lock = threading.Lock()
+        # Última leitura boa de cada aba auxiliar, servida (somente leitura) se a API cair
+        self._last_good = {}
+        # Abas auxiliares não têm carimbo: um contador local, trocado a cada gravação, faz o papel de revisão
+        self._generation = {}
+
+    @property
+    def logger(self):
+        # Criado sob demanda: inicia uma thread de envio. Sob a trava, para que duas sessões
+        # simultâneas não criem dois (um deles ficaria órfão, com entradas que o close() não envia)
+        if self._logger is None:
+            with self._workers_lock:
+                if self._logger is None:
+                    self._logger = HistoryLogger(self.client)
+        return self._logger
+
+    @property
+    def patches(self):
+        if self._patches is None:
+            with self._workers_lock:
+                if self._patches is None:
+                    self._patches = HistoryLogger(self.client, "Patches", columns=PATCH_COLUMNS)
+        return self._patches
+
+    def _fetch(self, worksheet, columns=None):
+        if worksheet == "Alunos" and self.feed.cursor is None:
+            # Posiciona o feed antes do primeiro download: as gravações feitas depois dele ficam
+            # ao alcance do delta (sem isso, o primeiro alcance sempre baixaria a aba inteira)
+            try:
+                self.feed.poll()
+            except Exception as e:
+                print(f"Aviso: não foi possível ler o feed de alterações: {e}")
+        if columns is None:
+            return decode_frame(self.conn.read(worksheet=worksheet, ttl=0))
+        return self._read_columns(worksheet, columns)
+
+    def _read_columns(self, worksheet, columns):
+        """
+        Projeção: lê o cabeçalho e depois só as colunas pedidas (um intervalo A1 por coluna,
+        numa única requisição batchGet), sem baixar o dados_json.
+        """
+        header = self.client.header(worksheet)
+        present = [c for c in columns if c in header]
+        ranges = [a1(worksheet, f"{col_letter(header.index(c))}2:{col_letter(header.index(c))}") for c in present]
+        values = dict(zip(present, self.client.batch_get(ranges)))
+        size = max((len(v) for v in values.values()), default=0)
+        data = {c: [(values[c][i][0] if i < len(values[c]) and values[c][i] else None) for i in range(size)]
+                if c in values else [None] * size for c in columns}
+        return pd.DataFrame(data, columns=list(columns)).dropna(how="all").reset_index(drop=True)
+
+    def load_columns(self, columns):
+        return self.cache.get("Alunos", columns=columns)
+
+    def _index_rows(self):
+        header = self.client.header("Alunos")
+        if "nome" not in header:
+            return []
+        return [(i + 2, v) for i, v in enumerate(self.client.column("Alunos", header, "nome")) if v]
+
+    def _read_rows(self, rows):
+        """(cabeçalho, registros) das linhas 'rows' da aba Alunos, numa única requisição batchGet"""
+        header = self.client.header("Alunos")
+        last = col_letter(len(header) - 1)
+        values = self.client.batch_get([a1("Alunos", f"A{r}:{last}{r}") for r in rows])
+        return header, [{k: (v[0][i] if v and i < len(v[0]) else None) for i, k in enumerate(header)} for v in values]
+
+    def load_student(self, name):
+        # Lê apenas as linhas do aluno, localizadas pelo índice
+        for _ in range(2):
+            rows = self.index.rows(str(name))
+            if not rows:
+                return pd.DataFrame(columns=DB_COLUMNS)
+            header, records = self._read_rows(rows)
+            if all(str(r.get("nome")) == str(name) for r in records):
+                return decode_frame(pd.DataFrame(records, columns=header))
+            # Linhas deslocadas por uma gravação externa: reconstrói o índice e tenta de novo
+            self.index.invalidate()
+        return super().load_student(name)
+
+    # --- FEED DE ALTERAÇÕES ---
+    def _changed_rows(self, old, new):
+        """{id: (nome, linha)} gravados por outros processos entre os dois carimbos de Alunos, ou None"""
+        changes = self.feed.chain("Alunos", old, new)
+        # Exclusões deslocam as linhas de baixo: só um download completo reposiciona tudo
+        if changes is None or any(c["op"] != "save" or not c["linha"] for c in changes):
+            return None
+        return {c["id"]: (c["nome"], int(float(c["linha"]))) for c in changes}
+
+    def _delta(self, worksheet, old, new):
+        rows = self._changed_rows(old, new) if worksheet == "Alunos" else None
+        if not rows:
+            return None
+        _, raw = self._read_rows([n for _, n in rows.values()])
+        if any(str(r.get("id")) != record_id for r, record_id in zip(raw, rows)):
+            return None
+        records = [decode_cells(r) for r in raw]
+
+        def mutate(df):
+            for record in records:
+                df = upsert_frame(df, record)
+            return df
+        return mutate
+
+    def _index_delta(self, old, new):
+        rows = self._changed_rows(old, new)
+        if not rows:
+            return None
+
+        def change(index):
+            for name, number in rows.values():
+                index_add(name, number)(index)
+        return change
+
+    def _record_change(self, op, record_id, name, row_number, revisions):
+        # Falha no feed não desfaz a gravação: os outros processos apenas baixam a aba inteira
+        try:
+            self.feed.record("Alunos", op, record_id, name, row_number, revisions)
+        except Exception as e:
+            print(f"Aviso: não foi possível anotar a alteração no feed: {e}")
+
+    def load_db(self, strict=False):
+        df = self.cache.get("Alunos", fresh=strict)
+        # Se o DF vier vazio, verificar se não foi erro de conexão silencioso
+        if df.empty and strict:
+            # Os metadados de integridade dizem quantas linhas a aba deveria ter (uma leitura mínima)
+            expected = self.versions.integrity("Alunos", fresh=True)[0]
+            if expected:
+                raise ConnectionError(f"A leitura de Alunos veio vazia, mas os metadados registram {expected} linha(s).")
+            if expected is None:
+                # Sem metadados ainda: tenta ler outra aba leve apenas para testar conexão
+                self.conn.read(worksheet="Professores", ttl=0)
+        return df.dropna(how="all")
+
+    # --- INTEGRIDADE ---
+    def _guard_count(self, actual):
+        try:
+            guard_count("Alunos", self.versions.integrity("Alunos")[0], actual)
+        except AntiWipeError:
+            # Os metadados vistos podem estar atrasados (exclusões de outro processo): confere de novo
+            guard_count("Alunos", self.versions.integrity("Alunos", fresh=True)[0], actual)
+
+    def _verify_row(self, raw, previous):
+        """Resumo gravado na linha; se não bater com o conteúdo, a linha foi alterada fora do sistema"""
+        stored = str(raw.get(HASH_COLUMN) or "")
+        if stored and stored != row_hash(previous):
+            self.integrity_issues += 1
+            print(f"Aviso: a linha de '{previous.get('id')}' foi alterada fora do sistema ou está corrompida "
+                  "(o resumo não confere).")
+        return stored or row_hash(previous)
+
+    def _check_integrity(self, count, total):
+        """Compara contagem e soma calculadas numa leitura completa com os metadados e grava a nova linha de base"""
+        expected, expected_total = self.versions.integrity("Alunos", fresh=True)
+        if expected == count and expected_total == total:
+            return True
+        if expected is not None:
+            self.integrity_issues += 1
+            print(f"Aviso: metadados de integridade de Alunos divergentes (registrado {expected} linha(s), "
+                  f"encontrado {count}{'' if expected_total == total else '; soma dos resumos diferente'}).")
+        self.versions.set_integrity("Alunos", count, total)
+        return expected is None
+
+    def _fallback(self, worksheets, error):
+        """Última leitura boa das abas quando a API está fora (cota esgotada, 5xx, circuito aberto)"""
+        if not is_retryable(error) or any(w not in self._last_good for w in worksheets):
+            raise error
+        print(f"Aviso: servindo a última leitura de {', '.join(worksheets)} (API indisponível: {error})")
+        return {w: share(self._last_good[w]) for w in worksheets}
+
+    def _flight_key(self, kind, worksheets):
+        return (kind, tuple(worksheets), tuple(self._generation.get(w, 0) for w in worksheets))
+
+    def safe_read(self, worksheet):
+        def read():
+            df = self.conn.read(worksheet=worksheet, ttl=0)
+            self._last_good[worksheet] = df
+            return df
+
+        try:
+            df = self.flights.do(self._flight_key("safe_read", [worksheet]), read)
+        except Exception as e:
+            return self._fallback([worksheet], e)[worksheet]
+        return share(df)
+
+    def safe_update(self, worksheet, df):
+        self.conn.update(worksheet=worksheet, data=df)
+        self._generation[worksheet] = self._generation.get(worksheet, 0) + 1
+        self._last_good[worksheet] = share(df)
+
+    def read_many(self, worksheets):
+        def batch(max_age):
+            # Só as abas que existem: uma aba ausente (ex.: Monitores) faria o batchGet inteiro falhar
+            present = [w for w in worksheets if w in self.client.titles(max_age)]
+            return present, self.client.batch_get([a1(w) for w in present])
+
+        def read():
+            try:
+                present, results = batch(60.0)
+            except Exception as e:
+                if http_status(e) != 400:
+                    raise
+                # Aba removida depois da última consulta aos metadados: relê a lista e tenta de novo
+                present, results = batch(0)
+            frames = {w: pd.DataFrame() for w in worksheets if w not in present}
+            for worksheet, rows in zip(present, results):
+                header = [str(c) for c in rows[0]] if rows else []
+                body = [[r[i] if i < len(r) else None for i in range(len(header))] for r in rows[1:]]
+                frames[worksheet] = self._last_good[worksheet] = pd.DataFrame(body, columns=header).dropna(how="all")
+            return frames
+
+        try:
+            frames = self.flights.do(self._flight_key("read_many", worksheets), read)
+        except Exception as e:
+            return self._fallback(worksheets, e)
+        return {w: share(df) for w, df in frames.items()}
+
+    def save_student(self, record, user, operation, backup=True, expected_version=None, patch=None):
+        # Localiza a linha pelo 'id' e grava apenas ela (ou acrescenta uma nova).
+        # A linha alvo é relida e conferida antes da escrita, então um salvamento
+        # nunca altera registros de outros alunos. A versão é conferida na mesma releitura,
+        # o que reduz (mas não elimina, no Sheets) a janela entre conferir e gravar.
+        # Na planilha o dados_json vai comprimido (e dividido em colunas, se passar do limite da célula)
+        written = {}
+
+        def check_keys(keys):
+            # Anti-wipe sem leitura completa: a coluna 'id' (lida de qualquer forma para localizar a linha)
+            # é contada e comparada com o número de linhas dos metadados de integridade
+            self._guard_count(sum(1 for k in keys if k))
+
+        def before_write(raw):
+            previous = decode_cells(raw) if raw else None
+            written["patch"] = effective_patch(previous, patch)
+            final = check_version(apply_patch(record, previous, patch), previous, expected_version)
+            if written["patch"] is not None:
+                final = with_summary(final)
+            written["record"] = final
+            if raw:
+                written["removed"] = [self._verify_row(raw, previous)]
+            if backup:
+                self.create_backup(previous, final, user, operation)
+            encoded = encode_cells(final)
+            encoded[HASH_COLUMN] = written["hash"] = row_hash(final)
+            # Limpa as colunas de continuação que a versão anterior (maior) ocupava
+            for k in (raw or {}):
+                if k not in encoded and k not in final:
+                    encoded[k] = ""
+            return encoded
+
+        record = with_summary(dict(record, version=record.get("version", 0)))
+        row_number, previous, _ = self.client.upsert("Alunos", "id", dict(encode_cells(record), hash=""),
+                                                     before_write=before_write, check_keys=check_keys)
+        saved = written["record"]
+        removed = written.get("removed", [])
+
+        def meta(count, total):
+            if count is None:
+                return None, ""
+            return count + (0 if previous else 1), combine(total, [written["hash"]], removed)
+
+        # Atualiza o cache do processo (write-through) em vez de forçar novo download
+        revisions = self.cache.write_through("Alunos", lambda df: upsert_frame(df, dict(saved, hash=written["hash"])),
+                                             meta)
+        if row_number is None:
+            self.index.invalidate()
+        else:
+            self.index.record_write(revisions, index_add(str(saved["nome"]), row_number))
+        self._record_change("save", saved["id"], saved["nome"], row_number, revisions)
+        if written["patch"] is not None:
+            self._log_patch(saved, user, written["patch"])
+        return saved
+
+    def _log_patch(self, record, user, patch):
+        # O log fica na aba "Patches", enviado em lote pela fila do histórico (sem colunas de continuação)
+        entry = patch_entry(record, user, patch)
+        if len(entry["patch"]) > CELL_LIMIT:
+            print(f"Aviso: patch de '{record['id']}' passa do limite da célula e não entrou no log")
+            return
+        self.patches.log(entry)
+
+    def patch_log(self, record_id):
+        # Consulta rara (auditoria): leitura direta da aba, depois de enviar o que ainda está na fila
+        if self._patches is not None:
+            self._patches.flush()
+        self.client.ensure_worksheet("Patches")
+        entries = [dict(r, versao=record_version({"version": r.get("versao")}), patch=json.loads(r["patch"]))
+                   for r in self.client.read_records("Patches") if r.get("id") == record_id and r.get("patch")]
+        return sorted(entries, key=lambda e: e["versao"])
+
+    def delete_student(self, name, user, backup=True):
+        # Localiza as linhas do aluno lendo apenas a coluna 'nome' e apaga só esses intervalos,
+        # numa única requisição (sem baixar e regravar a aba inteira)
+        header = self.client.header("Alunos")
+        if "nome" not in header:
+            return []
+        rows = [i + 2 for i, v in enumerate(self.client.column("Alunos", header, "nome")) if v == str(name)]
+        if not rows:
+            guard_delete(name, [])  # nome vazio é recusado mesmo sem linhas
+            return []
+
+        records = [decode_cells(r) for r in self._read_rows(rows)[1]]
+        if any(str(r.get("nome")) != str(name) for r in records):
+            raise RuntimeError(f"As linhas de '{name}' mudaram de posição durante a exclusão. Tente novamente.")
+        # Trava: no máximo um documento por tipo, cada um com o id do aluno
+        guard_delete(name, records)
+        if backup:
+            for r in records:
+                self.create_backup(r, None, user, "Exclusão")
+        removed = [stored_hash(r) for r in records]
+        self.client.delete_rows("Alunos", rows)
+
+        def meta(count, total):
+            return (None, "") if count is None else (count - len(rows), combine(total, remove=removed))
+
+        revisions = self.cache.write_through("Alunos", lambda df: df[df["nome"] != name].reset_index(drop=True), meta)
+        self.index.record_write(revisions, index_delete(rows))
+        self._record_change("delete", "", name, "", revisions)
+        return records
+
+    def put_blob(self, data):
+        return self.blobs.put(data)
+
+    def get_blob(self, sha):
+        return self.blobs.get(sha)
+
+    def backfill_summaries(self):
+        """
+        Migração: preenche doc_uuid, resumo e hash das linhas que ainda não os têm,
+        gravando apenas essas células (numa única chamada). Na mesma leitura confere os
+        metadados de integridade (linhas e soma dos resumos). Retorna quantas linhas foram preenchidas.
+        """
+        header = self.client.ensure_header("Alunos", DB_COLUMNS + [HASH_COLUMN])
+        rows = self.client.get(a1("Alunos", f"A2:{col_letter(len(header) - 1)}"))
+        updates = []
+        filled = set()
+        hashes = []
+        for i, values in enumerate(rows):
+            raw = {k: (values[j] if j < len(values) else "") for j, k in enumerate(header)}
+            if not raw.get("id"):
+                continue
+            hashes.append(stored_hash(raw))
+            if not raw.get(HASH_COLUMN):
+                updates.append((a1("Alunos", f"{col_letter(header.index(HASH_COLUMN))}{i + 2}"), [[hashes[-1]]]))
+                filled.add(i)
+            if raw.get("resumo") or not raw.get("dados_json"):
+                continue
+            r = with_summary(decode_cells(raw))
+            for col in ("doc_uuid", "resumo"):
+                letter = col_letter(header.index(col))
+                updates.append((a1("Alunos", f"{letter}{i + 2}"), [[r[col]]]))
+            filled.add(i)
+        if updates:
+            self.client.batch_set(updates)
+            self.cache.invalidate("Alunos")
+        self._check_integrity(len(hashes), combine("", hashes))
+        return len(filled)
+
+    def create_backup(self, previous, new, user, operation):
+        """Anota a alteração no journal de backup; falhas não impedem o salvamento"""
+        if previous is None and new is None:
+            return
+        try:
+            self.journal.record(previous, new, user, operation)
+            self.journal.maybe_compact()
+        except Exception as e:
+            print(f"Aviso: Não foi possível criar backup: {e}")
+
+    def restore_to(self, seq=None):
+        return self.journal.restore_to(seq)
+
+    def log_action(self, entry):
+        self.logger.log(entry)
+
+    def stats(self):
+        stats = {"cache": self.cache.stats(), "index_rebuilds": self.index.rebuilds,
+                 "single_flight": self.flights.stats(), "changes": self.feed.stats()}
+        if self.guard is not None:
+            stats["quota"] = self.guard.stats()
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        # Só os metadados já vistos: stats() alimenta a barra lateral e não pode fazer E/S (nem falhar)
+        seen = self.versions.cached_integrity("Alunos")
+        stats["integrity"] = {"rows": "unknown" if seen is None or seen[0] is None else seen[0],
+                              "issues": self.integrity_issues}
+        return stats
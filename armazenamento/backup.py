@@ -0,0 +1,167 @@
+"""
+Backup incremental em journal.
+
+Cada gravação anexa à aba "Backup_Journal" apenas o registro alterado (versão
+anterior e nova do dados_json). Periodicamente uma compactação grava um snapshot
+completo em "Backup_Alunos"; a restauração parte do snapshot e reaplica o journal
+até o ponto desejado.
+"""
+import threading
+import time
+from datetime import datetime
+
+from .codec import decode_cells, encode_cells
+
+JOURNAL_COLUMNS = ["seq", "data_hora", "usuario", "operacao", "id", "nome", "tipo_doc",
+                   "dados_anterior", "dados_novo"]
+SNAPSHOT_SEQ_COLUMN = "_seq"
+RESTORE_COLUMNS = ["id", "nome", "tipo_doc", "dados_json"]
+# Gravações cujo journal foi anotado pouco antes da leitura do snapshot podem ainda não
+# estar nele; por isso a reaplicação começa um pouco antes do carimbo (em microssegundos).
+SNAPSHOT_MARGIN = 60 * 1_000_000
+
+
+def _seq(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class BackupJournal:
+    """Journal de alterações por registro + compactação periódica em snapshot completo."""
+
+    def __init__(self, client, worksheet="Backup_Journal", snapshot_worksheet="Backup_Alunos",
+                 source_worksheet="Alunos", compact_every=200, compact_max_age=24 * 3600):
+        self.client = client
+        self.worksheet = worksheet
+        self.snapshot_worksheet = snapshot_worksheet
+        self.source_worksheet = source_worksheet
+        self.compact_every = compact_every
+        self.compact_max_age = compact_max_age
+        self._lock = threading.Lock()
+        self._last_seq = 0
+        self._header = None
+        self._since_compaction = 0
+        self._last_compaction = time.time()
+        self._compacting = False
+
+    def next_seq(self):
+        """
+        Número de sequência monotônico: microssegundos desde a época, nunca repetido no processo.
+        Dispensa ler o journal para descobrir o último número e ordena também entre processos.
+        """
+        with self._lock:
+            self._last_seq = max(self._last_seq + 1, time.time_ns() // 1000)
+            return self._last_seq
+
+    def record(self, previous, new, user, operation):
+        """
+        Anota a alteração de um registro. 'previous'/'new' são dicts da linha
+        (id, nome, tipo_doc, dados_json); None indica inserção ou exclusão.
+        """
+        base = new if new is not None else previous
+        entry = {
+            "seq": self.next_seq(),
+            "data_hora": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            "usuario": user,
+            "operacao": operation,
+            "id": base.get("id"),
+            "nome": base.get("nome"),
+            "tipo_doc": base.get("tipo_doc"),
+            "dados_anterior": "" if previous is None else previous.get("dados_json", ""),
+            "dados_novo": "" if new is None else new.get("dados_json", ""),
+        }
+        # As duas imagens vão comprimidas; documentos muito grandes ocupam colunas de continuação
+        entry = encode_cells(encode_cells(entry, "dados_anterior"), "dados_novo")
+        if self._header is None or any(k not in self._header for k in entry):
+            self._header = self.client.ensure_header(self.worksheet, list(dict.fromkeys(JOURNAL_COLUMNS + list(entry))))
+        self.client.append_rows(self.worksheet, self._header, [entry])
+        self._since_compaction += 1
+        return entry["seq"]
+
+    # --- COMPACTAÇÃO ---
+    def compaction_due(self):
+        return (self._since_compaction >= self.compact_every
+                or time.time() - self._last_compaction >= self.compact_max_age)
+
+    def compact(self):
+        """Grava um snapshot completo da aba de origem, carimbado com o número de sequência atual"""
+        stamp = self.next_seq()
+        records = self.client.read_records(self.source_worksheet)
+        header = [c for c in (list(records[0].keys()) if records else ["id", "nome", "tipo_doc", "dados_json"])
+                  if c != SNAPSHOT_SEQ_COLUMN] + [SNAPSHOT_SEQ_COLUMN]
+        for r in records:
+            r[SNAPSHOT_SEQ_COLUMN] = stamp
+        self.client.replace_all(self.snapshot_worksheet, header, records)
+        self._since_compaction = 0
+        self._last_compaction = time.time()
+        return stamp
+
+    def maybe_compact(self):
+        """Dispara a compactação em segundo plano quando o limite de entradas ou de idade é atingido"""
+        with self._lock:
+            if self._compacting or not self.compaction_due():
+                return False
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Aviso: compactação do backup falhou: {e}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="backup-compactacao", daemon=True).start()
+        return True
+
+    # --- RESTAURAÇÃO ---
+    def _read(self, worksheet):
+        # Antes da primeira compactação (ou da primeira entrada) a aba não existe e a leitura daria 400
+        if worksheet not in self.client.titles(max_age=0):
+            return []
+        return self.client.read_records(worksheet)
+
+    def restore_to(self, seq=None):
+        """
+        Reconstrói o estado da aba de origem no ponto 'seq' (None = mais recente registrado).
+        Parte do snapshot (sem snapshot: vazio, carimbo 0): para frente reaplica 'dados_novo';
+        para trás desfaz com 'dados_anterior'.
+        Retorna a lista de registros (id, nome, tipo_doc, dados_json); não grava nada.
+        """
+        snapshot = self._read(self.snapshot_worksheet)
+        stamp = max((_seq(r.get(SNAPSHOT_SEQ_COLUMN)) for r in snapshot), default=0)
+        records = [{k: v for k, v in decode_cells(r).items() if k != SNAPSHOT_SEQ_COLUMN} for r in snapshot]
+        journal = [decode_cells(decode_cells(e, "dados_anterior"), "dados_novo") for e in self._read(self.worksheet)]
+        return replay(records, journal, stamp, seq, margin=SNAPSHOT_MARGIN)
+
+
+def replay(records, journal, stamp, seq=None, margin=0):
+    """
+    Estado de 'records' (tirado no ponto 'stamp') levado ao ponto 'seq' pelo journal:
+    para frente reaplica 'dados_novo'; para trás desfaz com 'dados_anterior'. 'margin'
+    alarga a janela reaplicada em volta do carimbo (entradas que podem ou não estar no
+    estado de partida: reaplicá-las dá o mesmo resultado).
+    """
+    state = {r["id"]: {k: r.get(k) for k in RESTORE_COLUMNS} for r in records}
+    journal = sorted(journal, key=lambda e: _seq(e.get("seq")))
+    target = _seq(seq) if seq is not None else float("inf")
+
+    def apply(entry, image):
+        if entry.get(image):
+            row = state.setdefault(entry["id"], {"id": entry["id"]})
+            row.update({"nome": entry.get("nome"), "tipo_doc": entry.get("tipo_doc"),
+                        "dados_json": entry[image]})
+        else:
+            state.pop(entry["id"], None)
+
+    if target >= stamp:
+        for entry in journal:
+            if stamp - margin < _seq(entry.get("seq")) <= target:
+                apply(entry, "dados_novo")
+    else:
+        for entry in reversed(journal):
+            if target < _seq(entry.get("seq")) <= stamp + margin:
+                apply(entry, "dados_anterior")
+    return list(state.values())
@@ -0,0 +1,73 @@
+"""
+Armazenamento de arquivos binários (fotos) endereçados pelo conteúdo.
+
+O documento guarda apenas o SHA-256 do arquivo; o conteúdo fica numa aba própria
+("Fotos"), dividido em partes em base64 que cabem numa célula. Como a chave é o
+próprio hash, o mesmo arquivo usado em vários documentos é gravado uma única vez e
+pode ser cacheado indefinidamente.
+"""
+import base64
+import hashlib
+import threading
+
+from .sheets import a1, col_letter
+
+BLOB_COLUMNS = ["sha256", "parte", "dados"]
+PART_SIZE = 45000
+
+
+def blob_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class SheetsBlobStore:
+    """Blobs na aba 'worksheet' (sha256 | parte | dados), uma linha por parte."""
+
+    def __init__(self, client, worksheet="Fotos"):
+        self.client = client
+        self.worksheet = worksheet
+        self._header = None
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def _rows_of(self, sha):
+        """Números das linhas com as partes do blob (pela coluna sha256)"""
+        if self._header is None:
+            self._header = self.client.ensure_header(self.worksheet, BLOB_COLUMNS)
+        hashes = self.client.column(self.worksheet, self._header, "sha256")
+        return [i + 2 for i, h in enumerate(hashes) if h == sha]
+
+    def put(self, data):
+        """Grava o blob (se ainda não existir) e retorna seu hash"""
+        sha = blob_hash(data)
+        with self._lock:
+            if sha in self._known:
+                return sha
+            if not self._rows_of(sha):
+                text = base64.b64encode(data).decode("ascii")
+                parts = [text[i:i + PART_SIZE] for i in range(0, len(text), PART_SIZE)] or [""]
+                self.client.append_rows(self.worksheet, self._header, [
+                    {"sha256": sha, "parte": n, "dados": p} for n, p in enumerate(parts)
+                ])
+            self._known.add(sha)
+        return sha
+
+    def get(self, sha):
+        """Conteúdo do blob, ou None se ele não existir"""
+        rows = self._rows_of(sha)
+        if not rows:
+            return None
+        first, last = min(rows), max(rows)
+        part_col, data_col = self._header.index("parte"), self._header.index("dados")
+        lo, hi = min(part_col, data_col), max(part_col, data_col)
+        values = self.client.get(a1(self.worksheet, f"{col_letter(lo)}{first}:{col_letter(hi)}{last}"))
+        parts = {}
+        for offset, row in enumerate(values):
+            # Gravações simultâneas do mesmo blob podem duplicar linhas; vale a primeira de cada parte
+            if first + offset in rows and len(row) > max(part_col, data_col) - lo:
+                parts.setdefault(int(float(row[part_col - lo])), str(row[data_col - lo]))
+        data = base64.b64decode("".join(parts[n] for n in sorted(parts)))
+        if blob_hash(data) != sha:
+            raise ValueError(f"Blob {sha[:12]} incompleto ou corrompido na aba {self.worksheet}.")
+        self._known.add(sha)
+        return data
@@ -0,0 +1,645 @@
+"""
+Cache de leitura compartilhado pelo processo (todas as sessões do Streamlit).
+
+Cada aba cacheada tem um carimbo de versão na aba "_Versoes". Toda gravação feita
+pelo sistema troca o carimbo; a conferência custa uma leitura minúscula e só é
+feita a cada 'check_interval' segundos. Enquanto o carimbo não mudar, load_db não
+baixa a planilha de novo.
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+from .integridade import count_value
+from .sheets import a1, col_letter, is_retryable
+
+_PANDAS_3 = int(pd.__version__.split(".")[0]) >= 3
+
+VERSION_COLUMNS = ["aba", "versao", "linhas", "soma"]
+
+
+class VersionCells:
+    """
+    Carimbos de versão por aba, guardados na aba '_Versoes' (aba | versao | linhas | soma).
+    'linhas' e 'soma' são os metadados de integridade (ver integridade.py), gravados junto com o
+    carimbo, sem requisições a mais; 'meta' guarda os últimos vistos de cada aba.
+    """
+
+    def __init__(self, client, worksheet="_Versoes"):
+        self.client = client
+        self.worksheet = worksheet
+        self.meta = {}
+        self._header_ok = False
+
+    def _rows(self):
+        # Numa planilha nova a aba ainda não existe e a leitura falharia (400): cria antes
+        self._ensure_header()
+        rows = self.client.get(a1(self.worksheet, "A2:D"))
+        found = {}
+        for i, r in enumerate(rows):
+            if r:
+                r = [str(v) for v in r] + [""] * (len(VERSION_COLUMNS) - len(r))
+                found[r[0]] = (i + 2, r[1])
+                self.meta[r[0]] = (count_value(r[2]), r[3])
+        return found
+
+    def _ensure_header(self):
+        if not self._header_ok:
+            self.client.ensure_header(self.worksheet, VERSION_COLUMNS)
+            self._header_ok = True
+
+    def get(self, name):
+        """Carimbo atual da aba, ou None se não foi possível consultá-lo"""
+        try:
+            return self._rows().get(name, (None, ""))[1]
+        except Exception as e:
+            print(f"Aviso: não foi possível ler a versão de {name}: {e}")
+            return None
+
+    def integrity(self, name, fresh=False):
+        """(linhas, soma) registrados para a aba; fresh=True (ou nada visto ainda) relê a aba de versões"""
+        if fresh or name not in self.meta:
+            self._rows()
+            self.meta.setdefault(name, (None, ""))
+        return self.meta[name]
+
+    def cached_integrity(self, name):
+        """(linhas, soma) já vistos para a aba, sem nenhuma leitura; None se ainda não foram lidos"""
+        return self.meta.get(name)
+
+    def bump(self, name, meta=None):
+        """
+        Troca o carimbo da aba. Retorna (carimbo_anterior, carimbo_novo).
+        'meta(linhas, soma) -> (linhas, soma)' atualiza os metadados de integridade na mesma escrita.
+
+        'meta' recebe os valores da linha relida agora por _rows() (não os que este processo tinha
+        em cache), então gravações de outros processos já registradas entram na conta. Sobra a
+        janela entre essa leitura e a escrita: duas trocas simultâneas podem perder um incremento.
+        Essa diferença é pequena: cabe na folga de guard_count e é corrigida na próxima conferência
+        completa (SheetsBackend.backfill_summaries, na inicialização), que regrava a linha de base.
+        """
+        row_number, old = self._rows().get(name, (None, ""))
+        new = uuid.uuid4().hex
+        values = {"aba": name, "versao": new}
+        if meta is not None:
+            count, total = meta(*self.meta.get(name, (None, "")))
+            values.update(linhas="" if count is None else count, soma=total)
+            self.meta[name] = (count, total)
+        if row_number:
+            columns = VERSION_COLUMNS[1:len(values)]
+            self.client.set_values(a1(self.worksheet, f"B{row_number}:{col_letter(len(values) - 1)}{row_number}"),
+                                   [[values[c] for c in columns]])
+        else:
+            self.client.append_rows(self.worksheet, VERSION_COLUMNS, [values])
+        return old, new
+
+    def set_integrity(self, name, count, total):
+        """Grava os metadados de integridade da aba sem trocar o carimbo (linha de base)"""
+        row_number = self._rows().get(name, (None, ""))[0]
+        if row_number:
+            self.client.set_values(a1(self.worksheet, f"C{row_number}:D{row_number}"), [[count, total]])
+        else:
+            self.client.append_rows(self.worksheet, VERSION_COLUMNS,
+                                    [{"aba": name, "versao": uuid.uuid4().hex, "linhas": count, "soma": total}])
+        self.meta[name] = (count, total)
+
+
+def copy_on_write():
+    """True se o pandas tem copy-on-write ativo (sempre no pandas 3; no 2, se o app o ligou)"""
+    return _PANDAS_3 or pd.get_option("mode.copy_on_write") is True
+
+
+def share(frame):
+    """
+    Cópia de um DataFrame compartilhado entre as sessões. Com copy-on-write é rasa (quem alterar
+    copia só o que alterou); sem ele é completa, para que a alteração não chegue ao cache.
+    """
+    return frame.copy(deep=not copy_on_write())
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Agrupa chamadas simultâneas idênticas: enquanto uma busca com a mesma chave está em
+    andamento (em qualquer thread/sessão), as demais esperam por ela e recebem o mesmo resultado
+    (ou o mesmo erro) em vez de repetir a requisição.
+    A chave deve incluir a revisão lida, para que ninguém receba dados anteriores a uma gravação que já viu.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Executa fn() uma única vez por chave em andamento e devolve seu resultado"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "fetches": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / total, 3) if total else 0.0,
+            "in_flight": len(self._flights),
+        }
+
+
+class _Entry:
+    __slots__ = ("frame", "revision", "checked", "loaded")
+
+    def __init__(self, frame, revision):
+        self.frame = frame
+        self.revision = revision
+        self.checked = self.loaded = time.monotonic()
+
+
+class WorksheetCache:
+    """
+    Cache versionado de abas inteiras ou de projeções de colunas (DataFrames).
+    'fetch(aba, colunas)' baixa a aba (colunas=None: todas); 'versions' fornece os carimbos de revisão,
+    um por aba, compartilhado por todas as projeções dela.
+    'max_age' força um download completo de tempos em tempos, cobrindo edições
+    feitas diretamente no Google Sheets (que não trocam o carimbo).
+    Se o download falhar por indisponibilidade da API, a cópia anterior continua sendo servida.
+    Sessões que pedem a mesma aba (e revisão) ao mesmo tempo compartilham um único download ('flights').
+    'delta(aba, carimbo_antigo, carimbo_novo)', se informado, devolve 'mutate(frame) -> frame' com as
+    gravações de outros processos entre os dois carimbos (ou None); assim o cache é atualizado sem download completo.
+    'shared' (SharedStore) divide os snapshots com os outros processos do servidor: cada revisão é baixada uma vez.
+    """
+
+    def __init__(self, fetch, versions, check_interval=5.0, max_age=300.0, flights=None, delta=None, shared=None):
+        self.fetch = fetch
+        self.versions = versions
+        self.flights = flights or SingleFlight()
+        self.delta = delta
+        self.shared = shared
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.version_checks = 0
+        self.stale_served = 0
+        self.patched = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "version_checks": self.version_checks,
+            "stale_served": self.stale_served,
+            "patched": self.patched,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "worksheets": sorted({w for w, _ in self._entries}),
+            # Memória dos snapshots, ocupada uma única vez no processo (não por sessão)
+            "bytes": sum(frame_bytes(e.frame) for e in list(self._entries.values())),
+        }
+
+    def get(self, worksheet, fresh=False, columns=None):
+        """
+        DataFrame da aba: um snapshot compartilhado por todas as sessões, entregue como referência
+        copy-on-write (share). fresh=True ignora o cache e baixa de novo.
+        'columns' pede apenas essas colunas (projeção), cacheadas à parte.
+        """
+        key = (worksheet, tuple(columns) if columns else None)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and not fresh and now - entry.loaded < self.max_age:
+            if now - entry.checked < self.check_interval:
+                self.hits += 1
+                return share(entry.frame)
+            revision = self._revision(worksheet)
+            if revision is not None and revision == entry.revision:
+                entry.checked = now
+                self.hits += 1
+                return share(entry.frame)
+            # Gravações de outros processos: pega o snapshot que outra réplica já tem ou aplica
+            # só as alterações, se o feed as explicar
+            if revision is not None and (self._from_shared(key, revision)
+                                         or self._catch_up(worksheet, entry.revision, revision)):
+                entry = self._entries.get(key)
+                if entry is not None and entry.revision == revision:
+                    self.hits += 1
+                    return share(entry.frame)
+        else:
+            revision = self._revision(worksheet)
+        self.misses += 1
+
+        def load():
+            # Leituras estritas vão sempre ao Sheets
+            if not fresh and self._from_shared(key, revision):
+                return self._entries[key].frame
+            frame = self.fetch(worksheet, key[1])
+            # Guardado ainda dentro do voo, para quem chegar logo depois já encontrar a entrada
+            with self._lock:
+                self._entries[key] = _Entry(frame, revision)
+            self._publish(key, revision, frame)
+            return frame
+
+        try:
+            # Leituras estritas não aproveitam um download que começou antes delas
+            frame = load() if fresh else self.flights.do(("aba", key, revision), load)
+        except Exception as e:
+            # API fora do ar (cota, 5xx, circuito aberto): serve a última cópia, exceto em leituras estritas
+            if entry is None or fresh or not is_retryable(e):
+                raise
+            self.stale_served += 1
+            print(f"Aviso: servindo cópia antiga de {worksheet} (API indisponível: {e})")
+            return share(entry.frame)
+        return share(frame)
+
+    @staticmethod
+    def _shared_key(key):
+        return f"aba:{key[0]}:{','.join(key[1]) if key[1] else '*'}"
+
+    def _from_shared(self, key, revision):
+        """Adota o snapshot da revisão publicado por outro processo, se houver. Retorna True se adotou."""
+        if self.shared is None or revision is None:
+            return False
+        found = self.shared.get(self._shared_key(key), revision, self.max_age)
+        if found is None:
+            return False
+        frame, age = found
+        entry = _Entry(frame, revision)
+        entry.loaded -= age
+        with self._lock:
+            self._entries[key] = entry
+        return True
+
+    def _publish(self, key, revision, frame, age=0.0):
+        if self.shared is not None and revision is not None:
+            self.shared.put(self._shared_key(key), revision, frame, age)
+
+    def _revision(self, worksheet):
+        # A conferência do carimbo também é agrupada: várias sessões vencidas ao mesmo tempo fazem uma leitura
+        def check():
+            self.version_checks += 1
+            return self.versions.get(worksheet)
+        return self.flights.do(("versao", worksheet), check)
+
+    def _catch_up(self, worksheet, old, new):
+        """Leva as entradas da aba do carimbo 'old' ao 'new' aplicando o delta. Retorna True se conseguiu."""
+        if self.delta is None:
+            return False
+
+        def patch():
+            try:
+                mutate = self.delta(worksheet, old, new)
+            except Exception as e:
+                print(f"Aviso: não foi possível aplicar as alterações de {worksheet}: {e}")
+                return False
+            if mutate is None:
+                return False
+            self._apply(worksheet, old, new, mutate, drop_others=False)
+            self.patched += 1
+            return True
+        return self.flights.do(("delta", worksheet, old, new), patch)
+
+    def write_through(self, worksheet, mutate, meta=None):
+        """
+        Registra uma gravação: troca o carimbo da aba e aplica 'mutate(frame) -> frame' nas cópias
+        em cache (inteira e projeções). Se outro processo gravou desde o último download, a entrada é descartada.
+        'meta' atualiza os metadados de integridade junto com o carimbo (ver VersionCells.bump).
+        Retorna (carimbo_anterior, carimbo_novo), ou None se não foi possível trocar o carimbo.
+        """
+        try:
+            old, new = self.versions.bump(worksheet, meta)
+        except Exception as e:
+            print(f"Aviso: não foi possível atualizar a versão de {worksheet}: {e}")
+            self.invalidate(worksheet)
+            return None
+        self._apply(worksheet, old, new, mutate)
+        return old, new
+
+    def _apply(self, worksheet, old, new, mutate, drop_others=True):
+        # Entradas em outro carimbo que não o 'old' não podem receber a alteração
+        updated = []
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == worksheet]:
+                entry = self._entries[key]
+                if entry.revision != old:
+                    if drop_others:
+                        del self._entries[key]
+                    continue
+                try:
+                    frame = mutate(share(entry.frame))
+                    # Numa projeção, mantém apenas as colunas projetadas
+                    entry.frame = frame[list(key[1])] if key[1] else frame
+                except KeyError:
+                    # A projeção não tem as colunas de que a alteração precisa: baixa de novo depois
+                    del self._entries[key]
+                    continue
+                entry.revision = new
+                entry.checked = time.monotonic()
+                updated.append((key, entry))
+        # As outras réplicas do servidor recebem o snapshot já atualizado
+        for key, entry in updated:
+            self._publish(key, new, entry.frame, time.monotonic() - entry.loaded)
+
+    def invalidate(self, worksheet=None):
+        with self._lock:
+            for key in [k for k in self._entries if worksheet is None or k[0] == worksheet]:
+                del self._entries[key]
+
+
+class RowIndex:
+    """
+    Índice chave -> números das linhas (1-based) de uma aba, para ler só as linhas de um aluno.
+    'load()' devolve [(linha, chave), ...] lendo apenas a coluna-chave. O índice acompanha o
+    carimbo de versão da aba: as gravações do próprio processo o atualizam (record_write);
+    as de outros processos trocam o carimbo e são aplicadas pelo 'delta' ou forçam a reconstrução.
+    """
+
+    def __init__(self, load, versions, worksheet, check_interval=5.0, flights=None, delta=None, shared=None):
+        self.load = load
+        self.versions = versions
+        self.flights = flights or SingleFlight()
+        # Como no WorksheetCache: o índice de cada revisão é montado por um processo do servidor
+        self.shared = shared
+        # delta(carimbo_antigo, carimbo_novo) -> change (ver index_add) ou None, como no WorksheetCache
+        self.delta = delta
+        self.worksheet = worksheet
+        self.check_interval = check_interval
+        self.rebuilds = 0
+        self._rows = None
+        self._revision = None
+        self._checked = 0.0
+        self._distrust = False
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        """Devolve o dicionário do índice conferido com o carimbo atual (ler sempre sob a trava)"""
+        now = time.monotonic()
+        with self._lock:
+            current, known, checked = self._rows, self._revision, self._checked
+        if current is not None and now - checked < self.check_interval:
+            return current
+        revision = self.flights.do(("versao", self.worksheet), lambda: self.versions.get(self.worksheet))
+        if current is not None and revision is not None and revision == known:
+            with self._lock:
+                self._checked = now
+            return current
+        if current is not None and revision is not None and self.delta is not None:
+            try:
+                change = self.delta(known, revision)
+            except Exception as e:
+                print(f"Aviso: não foi possível atualizar o índice de {self.worksheet}: {e}")
+                change = None
+            if change is not None:
+                self.record_write((known, revision), change)
+                with self._lock:
+                    current = self._rows
+                if current is not None:
+                    return current
+        found = None
+        if self.shared is not None and revision is not None and not self._distrust:
+            found = self.shared.get(f"indice:{self.worksheet}", revision)
+        if found is not None:
+            pairs = found[0]
+        else:
+            pairs = self.flights.do(("indice", self.worksheet, revision), self.load)
+            self.rebuilds += 1
+        rows = {}
+        for number, key in pairs:
+            rows.setdefault(key, []).append(number)
+        with self._lock:
+            self._rows, self._revision, self._checked = rows, revision, now
+            self._distrust = False
+        if found is None:
+            self._publish()
+        return rows
+
+    def rows(self, key):
+        """Linhas da chave (lista possivelmente vazia)"""
+        rows = self._ensure()
+        with self._lock:
+            return list(rows.get(key, []))
+
+    def record_write(self, revisions, change):
+        """
+        Aplica 'change(índice)' após uma gravação do próprio processo. 'revisions' é o par
+        (carimbo_anterior, carimbo_novo) da gravação; se o índice não estava no anterior, é descartado.
+        """
+        with self._lock:
+            if self._rows is None:
+                return
+            if revisions is None or revisions[0] != self._revision:
+                self._rows = None
+                return
+            change(self._rows)
+            self._revision = revisions[1]
+            self._checked = time.monotonic()
+        self._publish()
+
+    def _publish(self):
+        with self._lock:
+            rows, revision = self._rows, self._revision
+            pairs = [(n, k) for k, numbers in rows.items() for n in numbers] if rows is not None else None
+        if self.shared is not None and revision is not None and pairs is not None:
+            self.shared.put(f"indice:{self.worksheet}", revision, pairs)
+
+    def invalidate(self):
+        """Descarta o índice; a reconstrução seguinte lê a planilha (não aceita o índice compartilhado)"""
+        with self._lock:
+            self._rows = None
+            self._distrust = True
+
+
+def index_add(key, number):
+    """Alteração para RowIndex.record_write: a linha 'number' passa a pertencer a 'key'"""
+    def change(rows):
+        if number is not None and number not in rows.setdefault(key, []):
+            rows[key].append(number)
+    return change
+
+
+def index_delete(numbers):
+    """Alteração para RowIndex.record_write: remove as linhas e desloca as de baixo para cima"""
+    removed = sorted(numbers)
+
+    def change(rows):
+        for key in list(rows):
+            kept = [n - sum(1 for r in removed if r < n) for n in rows[key] if n not in removed]
+            if kept:
+                rows[key] = kept
+            else:
+                del rows[key]
+    return change
+
+
+# --- MEMOIZAÇÃO POR EXECUÇÃO DO SCRIPT ---
+# Cada rerun do Streamlit roda numa thread do ScriptRunner; as leituras memorizadas ficam
+# presas à thread e são descartadas quando a próxima execução chama begin_run().
+_run_local = threading.local()
+
+
+def begin_run():
+    """Abre uma nova execução do script, descartando as leituras da execução anterior"""
+    _run_local.reads = {}
+
+
+def memoized(key, loader):
+    """
+    Executa 'loader()' no máximo uma vez por execução para a mesma chave
+    (a chave é uma tupla cujo 2º elemento é o nome da aba).
+    Devolve sempre uma referência copy-on-write, então quem chama pode alterar o resultado.
+    Fora de uma execução aberta com begin_run(), apenas chama o loader.
+    """
+    reads = getattr(_run_local, "reads", None)
+    if reads is None:
+        return loader()
+    if key not in reads:
+        reads[key] = loader()
+    return share(reads[key])
+
+
+def memoized_many(keys, loader):
+    """
+    Como memoized(), para várias chaves de uma vez: 'loader(chaves_faltantes)' devolve
+    {chave: valor} e é chamado uma única vez, apenas com as chaves ainda não lidas.
+    """
+    reads = getattr(_run_local, "reads", None)
+    if reads is None:
+        return loader(list(keys))
+    missing = [k for k in keys if k not in reads]
+    if missing:
+        reads.update(loader(missing))
+    return {k: share(reads[k]) for k in keys}
+
+
+def forget(worksheet):
+    """Esquece as leituras memorizadas de uma aba (após uma gravação nela)"""
+    reads = getattr(_run_local, "reads", None)
+    if reads:
+        for key in [k for k in reads if k[1] == worksheet]:
+            del reads[key]
+
+
+# --- CACHE DE DOCUMENTOS DECODIFICADOS ---
+def estimate_size(obj):
+    """Estimativa (bytes) da memória ocupada por uma estrutura JSON já decodificada"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    elif isinstance(obj, list):
+        size += sum(estimate_size(v) for v in obj)
+    return size
+
+
+def clone(obj):
+    """Cópia profunda de uma estrutura JSON (bem mais barata que copy.deepcopy)"""
+    if isinstance(obj, dict):
+        return {k: clone(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [clone(v) for v in obj]
+    return obj
+
+
+class DocCache:
+    """
+    LRU de dados_json decodificados, chaveado por (id, hash(dados_json)) e limitado por
+    um orçamento de bytes. Um documento alterado gera outra chave; a versão antiga
+    simplesmente envelhece até ser despejada.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doc_id, raw, mutable=False):
+        """
+        Documento decodificado. O objeto devolvido é compartilhado entre sessões e não deve
+        ser alterado; use mutable=True para receber uma cópia própria.
+        Levanta o mesmo erro de json.loads se o conteúdo for inválido.
+        """
+        key = (doc_id, hash(raw))
+        with self._lock:
+            found = self._docs.get(key)
+            if found is not None and found[0] == raw:
+                self._docs.move_to_end(key)
+                self.hits += 1
+                doc = found[1]
+            else:
+                found = None
+        if found is None:
+            doc = json.loads(raw)
+            size = estimate_size(doc)
+            with self._lock:
+                self.misses += 1
+                old = self._docs.pop(key, None)
+                if old is not None:
+                    self.bytes -= old[2]
+                if size <= self.max_bytes:
+                    self._docs[key] = (raw, doc, size)
+                    self.bytes += size
+                    self._evict()
+        return clone(doc) if mutable else doc
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._docs:
+            _, (_, _, size) = self._docs.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self):
+        return {
+            "documents": len(self._docs),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,93 @@
+"""
+Codificação compacta do dados_json para gravação no Google Sheets.
+
+O JSON é comprimido (zlib) e codificado em base85 com o marcador "z1:<partes>:".
+Se ainda passar do limite de caracteres por célula, o restante é gravado em colunas
+de continuação (dados_json_2, dados_json_3, ...). O número de partes no marcador diz
+quantas colunas ler, então sobras de uma versão maior do documento são ignoradas.
+Valores sem o marcador (JSON puro, gravado antes da compressão) são lidos como estão.
+"""
+import base64
+import zlib
+
+PREFIX = "z1:"
+# O Google Sheets aceita até 50.000 caracteres por célula; sobra espaço para o marcador
+CELL_LIMIT = 49000
+
+
+def continuation_column(column, part):
+    """Nome da coluna da parte 'part' (2, 3, ...) de 'column'"""
+    return f"{column}_{part}"
+
+
+def is_encoded(value):
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+
+def encode(text):
+    """Texto comprimido e codificado (uma única string, ainda sem divisão em partes)"""
+    return base64.b85encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+
+
+def decode(data):
+    return zlib.decompress(base64.b85decode(data)).decode("utf-8")
+
+
+def encode_cells(record, column="dados_json"):
+    """Registro com 'column' comprimido e, se preciso, dividido em colunas de continuação"""
+    text = record.get(column)
+    if not isinstance(text, str) or not text:
+        return dict(record)
+    data = encode(text)
+    parts = [data[i:i + CELL_LIMIT] for i in range(0, len(data), CELL_LIMIT)] or [""]
+    encoded = dict(record)
+    encoded[column] = f"{PREFIX}{len(parts)}:{parts[0]}"
+    for n, part in enumerate(parts[1:], start=2):
+        encoded[continuation_column(column, n)] = part
+    return encoded
+
+
+def decode_cells(record, column="dados_json"):
+    """
+    Inverso de encode_cells: junta as partes, descomprime e remove as colunas de continuação.
+    Registros em JSON puro passam inalterados. Levanta ValueError se o valor comprimido
+    estiver corrompido ou incompleto (ex.: uma coluna de continuação apagada).
+    """
+    decoded = {k: v for k, v in record.items() if not _is_continuation(k, column)}
+    value = record.get(column)
+    if not is_encoded(value):
+        return decoded
+    count, _, first = value[len(PREFIX):].partition(":")
+    try:
+        parts = [first] + [str(record.get(continuation_column(column, n)) or "") for n in range(2, int(count) + 1)]
+        decoded[column] = decode("".join(parts))
+    except (ValueError, zlib.error) as e:
+        raise ValueError(f"{column} comprimido inválido ou incompleto em {record.get('id', '?')}: {e}") from e
+    return decoded
+
+
+def decode_frame(df, column="dados_json"):
+    """DataFrame lido da planilha com 'column' decodificado e sem as colunas de continuação"""
+    if column not in df.columns:
+        return df
+    extra = [c for c in df.columns if _is_continuation(c, column)]
+    if not extra and not df[column].map(is_encoded).any():
+        return df
+    df = df.copy()
+    df[column] = [_decode_or_keep(r, column) for r in df.to_dict("records")]
+    return df.drop(columns=extra)
+
+
+def _decode_or_keep(record, column):
+    # Uma célula corrompida não impede a leitura da aba: fica como está e falha só ao abrir o
+    # documento, como qualquer dados_json inválido
+    try:
+        return decode_cells(record, column)[column]
+    except ValueError as e:
+        print(f"Aviso: {e}")
+        return record[column]
+
+
+def _is_continuation(name, column):
+    suffix = str(name)[len(column) + 1:]
+    return str(name).startswith(column + "_") and suffix.isdigit()
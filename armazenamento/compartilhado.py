@@ -0,0 +1,165 @@
+"""
+Cache compartilhado pelos processos do mesmo servidor (várias réplicas do Streamlit).
+
+Um arquivo SQLite em modo WAL guarda, por chave, o último valor baixado do Google Sheets
+(snapshot da aba Alunos, projeções, índice de linhas) junto com o carimbo de versão a que
+ele corresponde, e o último carimbo conferido de cada aba. Um processo só vai ao Sheets se
+nenhum outro do servidor já tiver baixado aquela revisão; toda gravação publica o carimbo
+novo (e o snapshot já atualizado), o que invalida as cópias dos demais na próxima conferência.
+
+Os documentos decodificados (DocCache) continuam por processo: ler um documento daqui
+custaria o mesmo que decodificar o dados_json de novo.
+
+Confiança: os valores são gravados com pickle, e ler um pickle executa o código que ele
+descrever. Quem puder gravar no arquivo executa código em todas as réplicas; ele deve ficar
+num diretório local que só o usuário do app consegue gravar (nunca numa pasta compartilhada
+com outros usuários ou serviços). O arquivo com permissão de escrita para outros gera aviso.
+
+Custo: a cada gravação o snapshot inteiro da aba é serializado e gravado de novo (tempo e
+E/S proporcionais ao tamanho da aba, não ao registro alterado). Com o tamanho atual da aba
+Alunos isso custa bem menos que um download pelas outras réplicas; se ela crescer a ponto
+de pesar, o caminho é publicar só o carimbo e deixar as réplicas alcançarem pelo feed de
+alterações (mudancas.py).
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS valores (
+    chave TEXT PRIMARY KEY,
+    revisao TEXT NOT NULL,
+    carregado REAL NOT NULL,
+    dados BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versoes (
+    aba TEXT PRIMARY KEY,
+    revisao TEXT NOT NULL,
+    conferido REAL NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """Valores (pickle) por chave e revisão num arquivo SQLite; falhas do arquivo nunca interrompem o app."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+        if os.stat(path).st_mode & 0o002:
+            print(f"Aviso: o cache compartilhado {path} pode ser gravado por outros usuários; "
+                  "como ele guarda pickles, restrinja a permissão ao usuário do app.")
+
+    def _db(self):
+        # Uma conexão por thread; o WAL permite que vários processos leiam enquanto um grava
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key, revision, max_age=None):
+        """(valor, idade em segundos) se houver o valor da chave nessa revisão, senão None"""
+        try:
+            row = self._db().execute("SELECT revisao, carregado, dados FROM valores WHERE chave = ?",
+                                     (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Aviso: cache compartilhado indisponível: {e}")
+            return None
+        age = time.time() - row[1] if row else None
+        if row is None or row[0] != revision or (max_age is not None and age >= max_age):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[2]), age
+
+    def put(self, key, revision, value, age=0.0):
+        """
+        Publica o valor da chave na revisão ('age': há quantos segundos ele foi baixado).
+        O valor é serializado por inteiro a cada chamada, mesmo que só uma linha tenha mudado.
+        """
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self._db().execute(
+                "INSERT INTO valores(chave, revisao, carregado, dados) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(chave) DO UPDATE SET revisao = excluded.revisao, carregado = excluded.carregado, "
+                "dados = excluded.dados",
+                (key, revision, time.time() - age, data)
+            )
+            self.writes += 1
+        except (sqlite3.Error, pickle.PicklingError) as e:
+            print(f"Aviso: não foi possível gravar no cache compartilhado: {e}")
+
+    def revision(self, name, max_age):
+        """Último carimbo da aba conferido por qualquer processo há menos de 'max_age' segundos, ou None"""
+        try:
+            row = self._db().execute("SELECT revisao, conferido FROM versoes WHERE aba = ?", (name,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or time.time() - row[1] >= max_age:
+            return None
+        return row[0]
+
+    def set_revision(self, name, revision):
+        try:
+            self._db().execute(
+                "INSERT INTO versoes(aba, revisao, conferido) VALUES (?, ?, ?) "
+                "ON CONFLICT(aba) DO UPDATE SET revisao = excluded.revisao, conferido = excluded.conferido",
+                (name, revision, time.time())
+            )
+        except sqlite3.Error as e:
+            print(f"Aviso: não foi possível gravar no cache compartilhado: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "path": self.path,
+        }
+
+
+class SharedVersions:
+    """
+    Carimbos de versão (VersionCells) com a conferência dividida entre os processos: um carimbo
+    conferido por qualquer réplica há menos de 'check_interval' segundos vale para todas, e uma
+    gravação publica o carimbo novo na hora.
+    """
+
+    def __init__(self, versions, store, check_interval=5.0):
+        self.versions = versions
+        self.store = store
+        self.check_interval = check_interval
+
+    def get(self, name):
+        revision = self.store.revision(name, self.check_interval)
+        if revision is not None:
+            return revision
+        revision = self.versions.get(name)
+        if revision is not None:
+            self.store.set_revision(name, revision)
+        return revision
+
+    def bump(self, name, meta=None):
+        old, new = self.versions.bump(name, meta)
+        self.store.set_revision(name, new)
+        return old, new
+
+    def integrity(self, name, fresh=False):
+        return self.versions.integrity(name, fresh)
+
+    def cached_integrity(self, name):
+        return self.versions.cached_integrity(name)
+
+    def set_integrity(self, name, count, total):
+        self.versions.set_integrity(name, count, total)
@@ -0,0 +1,156 @@
+"""
+Controle de cota das chamadas ao Google Sheets.
+
+Todas as requisições passam por um QuotaGuard: um balde de fichas por tipo (leitura e
+escrita) mantém o ritmo abaixo da cota por minuto da API; erros 429/5xx são repetidos
+com backoff exponencial com jitter; falhas seguidas abrem um circuito que recusa novas
+chamadas por um tempo, enquanto o app serve a última leitura boa (somente leitura).
+"""
+import random
+import threading
+import time
+
+from .sheets import http_status, is_retryable, is_unsent
+
+
+class CircuitOpenError(ConnectionError):
+    """A API está indisponível (circuito aberto); a chamada nem foi tentada."""
+
+
+class TokenBucket:
+    """Balde de fichas: 'rate' fichas por minuto, acumulando no máximo 'burst'."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate / 60.0
+        self.burst = burst or max(1, rate // 6)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Consome uma ficha, esperando se preciso. Retorna o tempo esperado (segundos)."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class QuotaGuard:
+    """
+    Executa as chamadas à API respeitando a cota (TokenBucket), repetindo erros transitórios
+    e abrindo o circuito após 'failure_threshold' falhas seguidas (por 'reset_timeout' segundos).
+    """
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, max_retries=5, base_delay=1.0,
+                 max_delay=32.0, failure_threshold=5, reset_timeout=30.0):
+        self.buckets = {"read": TokenBucket(reads_per_minute), "write": TokenBucket(writes_per_minute)}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self.last_error = None
+        self._consecutive = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Cria o guarda a partir de [quota] do secrets.toml (chaves iguais aos parâmetros)"""
+        names = ("reads_per_minute", "writes_per_minute", "max_retries", "base_delay", "max_delay",
+                 "failure_threshold", "reset_timeout")
+        return cls(**{k: cfg[k] for k in names if k in cfg})
+
+    # --- CIRCUITO ---
+    @property
+    def is_open(self):
+        """True enquanto o circuito está aberto (a API é considerada indisponível)"""
+        opened = self._opened_at
+        return opened is not None and time.monotonic() - opened < self.reset_timeout
+
+    def _check_circuit(self):
+        # Depois do 'reset_timeout' o circuito fica meio aberto: a próxima chamada é a tentativa
+        if self.is_open:
+            self.rejected += 1
+            raise CircuitOpenError(f"Google Sheets indisponível (circuito aberto): {self.last_error}")
+
+    def _record(self, error=None):
+        with self._lock:
+            if error is None:
+                self._consecutive = 0
+                self._opened_at = None
+                return
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            self._consecutive += 1
+            if self._consecutive >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    # --- EXECUÇÃO ---
+    def call(self, kind, fn, *args, **kwargs):
+        """
+        Executa fn(*args, **kwargs) como chamada do tipo 'read', 'write' ou 'append'. O acréscimo
+        (values.append) usa a cota de escrita, mas, por não ser idempotente, só é repetido quando
+        com certeza não foi gravado: 429 ou requisição que nem saiu.
+        """
+        self._check_circuit()
+        attempt = 0
+        while True:
+            waited = self.buckets["write" if kind == "append" else kind].acquire()
+            with self._lock:
+                self.calls += 1
+                self.throttled_seconds += waited
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self._record(e)
+                if attempt >= self.max_retries or self.is_open:
+                    raise
+                if kind == "append" and http_status(e) != 429 and not is_unsent(e):
+                    raise
+                attempt += 1
+                self.retries += 1
+                time.sleep(min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+                continue
+            self._record()
+            return result
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "throttled_seconds": round(self.throttled_seconds, 1),
+            "circuit_open": self.is_open,
+            "last_error": self.last_error,
+        }
+
+
+class GuardedConnection:
+    """Envolve a conexão do streamlit-gsheets para que read/update passem pelo QuotaGuard."""
+
+    def __init__(self, conn, guard):
+        self.conn = conn
+        self.guard = guard
+
+    def read(self, **kwargs):
+        return self.guard.call("read", self.conn.read, **kwargs)
+
+    def update(self, **kwargs):
+        return self.guard.call("write", self.conn.update, **kwargs)
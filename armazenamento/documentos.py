@@ -0,0 +1,223 @@
+"""Operações sobre documentos (dicts decodificados de dados_json)."""
+import hashlib
+import json
+
+_MISSING = object()
+
+
+def three_way_merge(base, mine, theirs):
+    """
+    Mescla, por campo de primeiro nível, as alterações de 'mine' (feitas a partir de 'base')
+    sobre 'theirs' (a versão atual gravada por outra pessoa).
+    Retorna (documento_mesclado, campos_em_conflito); há conflito quando os dois lados
+    alteraram o mesmo campo para valores diferentes.
+    """
+    merged = dict(theirs)
+    conflicts = []
+    for key in set(base) | set(mine):
+        b = base.get(key, _MISSING)
+        m = mine.get(key, _MISSING)
+        if m == b:
+            continue
+        t = theirs.get(key, _MISSING)
+        if t != b and t != m:
+            conflicts.append(key)
+        elif m is _MISSING:
+            merged.pop(key, None)
+        else:
+            merged[key] = m
+    return merged, sorted(conflicts)
+
+
+def canonical_hash(doc):
+    """Resumo (SHA-256) do documento em forma canônica: chaves ordenadas, sem espaços"""
+    text = json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def changed_fields(base, doc):
+    """Campos de primeiro nível que diferem entre 'base' e 'doc' (incluídos ou removidos também contam)"""
+    return sorted(k for k in set(base) | set(doc) if base.get(k, _MISSING) != doc.get(k, _MISSING))
+
+
+# --- MERGE PATCH (RFC 7386) ---
+def _patchable(value):
+    # Um objeto do patch é mesclado campo a campo, e null nele significa "remover"
+    return not isinstance(value, dict) or all(v is not None and _patchable(v) for v in value.values())
+
+
+def merge_patch(base, doc):
+    """
+    Merge patch (RFC 7386) que leva 'base' a 'doc', ou None se a diferença não couber no formato
+    (um campo alterado para null, já que no merge patch null significa remover o campo).
+    Listas são substituídas inteiras; objetos, mesclados campo a campo.
+    """
+    patch = {}
+    for key in set(base) | set(doc):
+        b = base.get(key, _MISSING)
+        d = doc.get(key, _MISSING)
+        if d == b:
+            continue
+        if d is _MISSING:
+            patch[key] = None
+        elif isinstance(d, dict) and isinstance(b, dict):
+            sub = merge_patch(b, d)
+            if sub is None:
+                return None
+            patch[key] = sub
+        elif d is None or not _patchable(d):
+            return None
+        else:
+            patch[key] = d
+    return patch
+
+
+def apply_merge_patch(target, patch):
+    """Resultado de aplicar o merge patch a 'target' (que não é alterado)"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+# --- SEÇÕES DOS FORMULÁRIOS ---
+# Campos gravados por cada formulário de seção, na ordem das abas. Um salvamento registra no
+# histórico apenas as seções cujos campos mudaram; campos fora do mapa (ex.: as grades da
+# avaliação pedagógica do PDI, com chaves geradas) contam para a seção em que foram salvos.
+SECTION_FIELDS = {
+    "PEI": {
+        "Identificação": ['nome', 'doc_uuid', 'foto_base64', 'foto_sha256', 'nasc', 'idade', 'ano_esc', 'mae',
+                          'pai', 'tel', 'prof_poli', 'prof_aee', 'prof_arte', 'prof_ef', 'prof_tec', 'gestor',
+                          'coord', 'revisoes', 'elab_per'],
+        "Saúde": ['diag_status', 'laudo_data', 'laudo_medico', 'diag_tipo', 'defic_txt', 'neuro_txt',
+                  'aprend_txt', 'terapias', 'med_nome', 'med_hor', 'med_doc', 'med_obj', 'saude_extra'],
+        "Conduta": ['com_tipo', 'com_alt_espec', 'com_necessidades', 'com_necessidades_espec', 'com_chamado',
+                    'com_chamado_espec', 'com_comandos', 'com_comandos_espec', 'loc_reduzida',
+                    'loc_reduzida_espec', 'loc_ambiente', 'loc_ambiente_ajuda', 'loc_ambiente_espec',
+                    'hig_banheiro', 'hig_banheiro_ajuda', 'hig_banheiro_espec', 'hig_dentes',
+                    'hig_dentes_ajuda', 'hig_dentes_espec', 'beh_interesses', 'beh_objetos_gosta',
+                    'beh_objetos_odeia', 'beh_toque', 'beh_calmo', 'beh_atividades', 'beh_gatilhos',
+                    'beh_crise_regula', 'beh_desafios', 'beh_restricoes', 'beh_restricoes_espec',
+                    'beh_autonomia_agua', 'beh_autonomia_agua_espec', 'beh_pertinentes'],
+        "Escolar": ['dev_permanece', 'dev_permanece_espec', 'dev_integrado', 'dev_integrado_espec',
+                    'dev_loc_escola', 'dev_loc_escola_espec', 'dev_tarefas', 'dev_tarefas_espec', 'dev_amigos',
+                    'dev_amigos_espec', 'dev_colega_pref', 'dev_participa', 'dev_participa_espec', 'dev_afetivo'],
+        "Acadêmico": ['aval_port', 'aval_mat', 'aval_con_gerais', 'aval_arte_visuais', 'aval_arte_musica',
+                      'aval_arte_teatro', 'aval_arte_danca', 'aval_ef_motoras', 'aval_ef_corp_conhec',
+                      'aval_ef_exp', 'aval_ling_tec', 'aval_ling_verbal', 'aval_ling_mat', 'aval_ind_soc',
+                      'aval_ef_jogos', 'aval_ef_ritmo', 'aval_ef_corp'],
+        "Metas e Plano": ['meta_social_obj', 'meta_social_est', 'meta_auto_obj', 'meta_auto_est',
+                          'meta_acad_obj', 'meta_acad_est', 'flex_matrix', 'plano_ensino_tri', 'plano_obs_geral'],
+        "Assinatura": ['signatures'],
+    },
+    "CASO": {
+        "Identificação": ['nome', 'doc_uuid', 'ano_esc', 'periodo', 'unidade', 'sexo', 'd_nasc', 'endereco',
+                          'bairro', 'cidade', 'telefones'],
+        "Família": ['pai_nome', 'pai_prof', 'pai_esc', 'pai_dn', 'mae_nome', 'mae_prof', 'mae_esc', 'mae_dn',
+                    'irmaos', 'outros_familia', 'quem_mora', 'convenio', 'convenio_qual', 'social', 'social_qual'],
+        "Histórico": ['hist_idade_entrou', 'hist_outra_escola', 'hist_motivo_transf', 'hist_obs',
+                      'gest_parentesco', 'gest_doenca', 'gest_substancias', 'gest_medicamentos',
+                      'parto_ocorrencia', 'parto_incubadora', 'parto_prematuro', 'parto_uti', 'dev_tempo_gest',
+                      'dev_peso', 'dev_normal_1ano', 'dev_atraso', 'dev_idade_andar', 'dev_idade_falar',
+                      'diag_possui', 'diag_reacao', 'diag_data', 'diag_origem', 'fam_deficiencia', 'fam_altas_hab'],
+        "Saúde": ['saude_prob', 'saude_internacao', 'saude_restricao', 'med_uso', 'med_quais', 'med_hor',
+                  'med_dos', 'med_ini', 'esf_urina', 'esf_fezes', 'esf_idade', 'sono', 'medico_ultimo',
+                  'clinicas', 'clinicas_med_esp', 'clinicas_nome', 'saude_obs_geral'],
+        "Comportamento": ['checklist', 'entrevista_prof', 'entrevista_resp', 'entrevista_data', 'entrevista_extra'],
+        "Assinatura": ['signatures'],
+    },
+    "PDI": {
+        "Plano AEE": ['nome', 'doc_uuid', 'potencialidades', 'areas_interesse', 'acao_escola', 'acao_sala',
+                      'acao_familia', 'acao_saude', 'aee_tempo', 'aee_tipo', 'aee_comp'],
+        "Objetivos Detalhados": ['goals_specific'],
+        "Assinatura": ['signatures'],
+    },
+}
+
+_SECTION_OF = {
+    tipo: {field: section for section, fields in sections.items() for field in fields}
+    for tipo, sections in SECTION_FIELDS.items()
+}
+
+
+def dirty_sections(tipo_doc, fields, default):
+    """Seções (na ordem das abas) dos campos alterados; campos sem seção conhecida contam para 'default'"""
+    known = _SECTION_OF.get(tipo_doc, {})
+    found = {known.get(f, default) for f in fields}
+    order = list(SECTION_FIELDS.get(tipo_doc, {}))
+    return sorted(found, key=lambda s: order.index(s) if s in order else len(order))
+
+
+# --- RESUMO (CAMPOS CONSULTADOS PELAS LISTAGENS) ---
+# Campos lidos pelo painel, pela validação pública e pelo aviso de assinaturas pendentes.
+# São extraídos do dados_json ao salvar, para que essas telas não decodifiquem o documento inteiro.
+SUMMARY_FIELDS = [
+    "doc_uuid", "signatures", "diag_tipo", "diag_status", "diag_possui", "defic_txt",
+    "conclusao_nivel", "apoio_existente",
+    "prof_poli", "prof_aee", "prof_arte", "prof_ef", "prof_tec", "gestor", "coord",  # PEI
+    "resp_sala", "resp_ee", "resp_dir",  # Avaliação
+    "acompanhante",  # Diário
+]
+
+# Campos essenciais de cada tipo de documento, usados no cálculo do progresso de preenchimento
+PROGRESS_KEYS = {
+    "PEI": [
+        'prof_poli', 'prof_aee',       # 1. Identificação
+        'defic_txt', 'saude_extra',    # 2. Saúde
+        'beh_interesses', 'beh_desafios', # 3. Conduta
+        'dev_afetivo',                 # 4. Escolar
+        'aval_port', 'aval_ling_verbal', # 5. Acadêmico (um dos dois)
+        'meta_social_obj', 'meta_acad_obj', # 6. Metas
+        'plano_obs_geral'              # Final
+    ],
+    "CASO": [
+        'endereco', 'quem_mora',                   # Identificação e Família
+        'hist_idade_entrou', 'gest_parentesco',    # Histórico e Gestação
+        'saude_prob', 'med_uso',                   # Saúde
+        'entrevista_prof', 'entrevista_resp'       # Comportamento / Entrevista
+    ],
+    "AVALIACAO": [
+        'aspectos_gerais', 'defic_chk',            # Identificação
+        'alim_nivel', 'hig_nivel', 'loc_nivel',    # Parte I
+        'comportamento', 'part_grupo', 'interacao',# Parte II
+        'rotina', 'ativ_pedag',                    # Parte III
+        'atencao_sust', 'linguagem',               # Parte IV
+        'conclusao_nivel', 'resp_ee'               # Conclusão
+    ],
+    "PDI": [
+        'potencialidades', 'areas_interesse',      # Avaliação Inicial
+        'acao_escola', 'acao_sala', 'acao_familia',# Ações Necessárias
+        'aee_tempo', 'aee_tipo',                   # Organização AEE
+        'goals_specific'                           # Objetivos Detalhados
+    ],
+}
+
+
+def progress(doc, keys):
+    """Percentual (0-100) dos campos 'keys' preenchidos no documento"""
+    try:
+        filled = 0
+        for k in keys:
+            val = doc.get(k)
+            if val:
+                if isinstance(val, list) and len(val) > 0: filled += 1
+                elif isinstance(val, dict) and len(val) > 0: filled += 1
+                elif isinstance(val, str) and val.strip() != "": filled += 1
+                elif isinstance(val, (int, float)): filled += 1
+                elif val is True: filled += 1
+        return int((filled / len(keys)) * 100)
+    except Exception:
+        return 0
+
+
+def summarize(tipo_doc, doc):
+    """Resumo do documento: os SUMMARY_FIELDS presentes e, quando aplicável, o 'progresso'"""
+    summary = {k: doc[k] for k in SUMMARY_FIELDS if k in doc}
+    if tipo_doc in PROGRESS_KEYS:
+        summary["progresso"] = progress(doc, PROGRESS_KEYS[tipo_doc])
+    return summary
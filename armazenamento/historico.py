@@ -0,0 +1,144 @@
+"""
+Registro do histórico em modo somente-anexação.
+
+As entradas ficam numa fila em memória e uma thread de fundo as envia em lotes
+(values.append), sem nunca ler a aba "Historico". O clique do usuário só paga o
+custo de enfileirar. Um lote junta até 'batch_size' entradas ou o que chegar em
+'flush_interval' segundos depois da primeira, o que ocorrer antes.
+"""
+import atexit
+import collections
+import queue
+import threading
+import time
+
+from .sheets import is_retryable
+
+HISTORY_COLUMNS = ["Data_Hora", "Aluno", "Usuario", "Acao", "Detalhes"]
+# Log de merge patches por documento (aba "Patches"), gravado pela mesma fila
+PATCH_COLUMNS = ["data_hora", "id", "versao", "usuario", "patch"]
+
+
+class HistoryLogger:
+    """Fila limitada + thread de envio em lote, com descarga garantida ao encerrar o processo."""
+
+    def __init__(self, client, worksheet="Historico", max_queue=2000, batch_size=100,
+                 flush_interval=2.0, enqueue_timeout=0.5, columns=HISTORY_COLUMNS, max_parked=20):
+        self.client = client
+        self.worksheet = worksheet
+        self.columns = columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        # Lotes recusados pela API com erro definitivo (400/403...): ficam de lado, sem nova tentativa
+        self.parked = collections.deque(maxlen=max_parked)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._header = None
+        self._stop = threading.Event()
+        self._flushing = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"{worksheet.lower()}-logger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, entry):
+        """Enfileira uma entrada (dict com as colunas da aba). Retorna False se a fila estiver cheia."""
+        try:
+            self._queue.put(entry, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"Aviso: fila do histórico cheia, entrada descartada: {entry}")
+            return False
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _drain(self, batch=None):
+        batch = batch if batch is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _collect(self, first):
+        """Junta entradas até 'batch_size' ou até 'flush_interval' após a primeira (flush/close encurtam a espera)"""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set() or self._flushing.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                continue
+        return self._drain(batch)
+
+    def _write(self, batch, confirm=False):
+        with self._write_lock:
+            if self._header is None:
+                self._header = self.client.ensure_header(self.worksheet, self.columns)
+            self.client.append_rows(self.worksheet, self._header, batch, confirm=confirm)
+            self.written += len(batch)
+
+    def _write_with_retry(self, batch):
+        delay = 1.0
+        confirm = False
+        while True:
+            try:
+                self._write(batch, confirm)
+                return
+            except Exception as e:
+                # O envio que falhou pode ter sido gravado: a próxima tentativa confere o fim da aba antes
+                confirm = True
+                if not is_retryable(e):
+                    self.failed += len(batch)
+                    self.parked.append(batch)
+                    print(f"Erro definitivo ao gravar {self.worksheet}, lote de {len(batch)} entradas separado: {e}")
+                    return
+                if self._stop.is_set():
+                    print(f"Erro ao gravar histórico ({len(batch)} entradas perdidas): {e}")
+                    return
+                print(f"Erro ao gravar histórico, nova tentativa em {delay:.0f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = self._collect(first)
+            self._write_with_retry(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """Bloqueia até que todas as entradas enfileiradas tenham sido gravadas (ou separadas)"""
+        self._flushing.set()
+        try:
+            self._queue.join()
+        finally:
+            self._flushing.clear()
+
+    def close(self, timeout=10):
+        """Para a thread e grava, de forma síncrona, o que ainda estiver na fila"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write_with_retry(batch)
+            for _ in batch:
+                self._queue.task_done()
@@ -0,0 +1,45 @@
+"""
+Metadados de integridade da aba Alunos.
+
+Cada linha leva na coluna "hash" o resumo (SHA-256, 128 bits) de id, versão e dados_json.
+Junto do carimbo de versão ficam o número de linhas e a soma de todos esses resumos
+(módulo 2^128). Ao contrário da raiz de uma árvore de Merkle, a soma é atualizada em O(1)
+a cada gravação (soma - resumo anterior + resumo novo), sem ler as outras linhas; uma
+leitura completa que não bata com ela revela linhas perdidas ou alteradas fora do sistema.
+"""
+import hashlib
+
+from .codec import decode_cells
+
+HASH_COLUMN = "hash"
+_MODULUS = 1 << 128
+
+
+def row_hash(record):
+    """Resumo da linha: id, versão e dados_json (já decodificado)"""
+    try:
+        version = int(float(record.get("version") or 0))
+    except (TypeError, ValueError):
+        version = 0
+    text = f"{record.get('id')}\x1f{version}\x1f{record.get('dados_json') or ''}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def stored_hash(raw):
+    """Resumo gravado na linha (ou calculado, se a linha ainda não o tiver)"""
+    return str(raw.get(HASH_COLUMN) or "") or row_hash(decode_cells(raw))
+
+
+def combine(total, add=(), remove=()):
+    """Soma dos resumos 'total' (texto hex, "" = 0) com 'add' acrescentados e 'remove' retirados"""
+    value = int(total, 16) if total else 0
+    value += sum(int(h, 16) for h in add) - sum(int(h, 16) for h in remove)
+    return f"{value % _MODULUS:032x}"
+
+
+def count_value(text):
+    """Número de linhas registrado nos metadados, ou None se ainda não houver"""
+    try:
+        return int(float(text))
+    except (TypeError, ValueError):
+        return None
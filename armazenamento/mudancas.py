@@ -0,0 +1,103 @@
+"""
+Feed de alterações entre processos (réplicas do Streamlit).
+
+Cada gravação na aba Alunos acrescenta uma linha à aba "Changes" com o id alterado, a
+linha gravada e o par de carimbos de versão (anterior -> novo) daquela gravação. O número
+da linha na aba é a sequência global, monotônica e atribuída pelo próprio Sheets.
+
+Quando o carimbo de uma aba muda, o processo lê apenas as linhas novas do feed ("alterações
+desde N") e segue a cadeia de carimbos do seu snapshot até o atual. Se a cadeia fecha, basta
+reler as linhas alteradas; se não fecha (exclusões, gravações simultâneas, edições feitas
+direto na planilha), o chamador volta ao download completo.
+"""
+import threading
+from datetime import datetime
+
+from .sheets import a1, col_letter
+
+CHANGE_COLUMNS = ["aba", "op", "id", "nome", "linha", "anterior", "versao", "data_hora"]
+
+
+class ChangeFeed:
+    """Aba 'worksheet' com uma linha por gravação; 'keep' alterações recentes ficam na memória."""
+
+    def __init__(self, client, worksheet="Changes", keep=2000):
+        self.client = client
+        self.worksheet = worksheet
+        self.keep = keep
+        self.cursor = None
+        self.polls = 0
+        self.read = 0
+        self.recorded = 0
+        self._recent = []
+        self._header = None
+        self._lock = threading.Lock()
+
+    def _columns(self):
+        if self._header is None:
+            self._header = self.client.ensure_header(self.worksheet, CHANGE_COLUMNS)
+        return self._header
+
+    def record(self, worksheet, op, record_id, name, row_number, revisions):
+        """Anota uma gravação; 'revisions' é o par (carimbo_anterior, carimbo_novo) devolvido por write_through"""
+        if revisions is None:
+            return
+        self.client.append_rows(self.worksheet, self._columns(), [{
+            "aba": worksheet, "op": op, "id": record_id or "", "nome": name or "",
+            "linha": row_number or "", "anterior": revisions[0] or "", "versao": revisions[1],
+            "data_hora": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+        }])
+        self.recorded += 1
+
+    def poll(self):
+        """
+        Lê as alterações acrescentadas desde a última leitura (uma requisição pequena).
+        Na primeira chamada apenas posiciona o cursor no fim do feed.
+        """
+        with self._lock:
+            header = self._columns()
+            if self.cursor is None:
+                self.cursor = 1 + len(self.client.column(self.worksheet, header, "aba"))
+                return
+            rows = self.client.get(a1(self.worksheet, f"A{self.cursor + 1}:{col_letter(len(header) - 1)}"))
+            self.polls += 1
+            for offset, values in enumerate(rows):
+                change = {k: (str(values[i]) if i < len(values) else "") for i, k in enumerate(header)}
+                change["seq"] = self.cursor + 1 + offset
+                self._recent.append(change)
+            self.cursor += len(rows)
+            self.read += len(rows)
+            del self._recent[:-self.keep]
+
+    def chain(self, worksheet, old, new):
+        """
+        Alterações de 'worksheet' que levam do carimbo 'old' ao 'new', em ordem, ou None se o feed
+        não explica a diferença (carimbo desconhecido, cadeia interrompida ou bifurcada).
+        """
+        if not old or not new:
+            return None
+        # Primeiro com as alterações já lidas (outro consumidor pode ter lido há pouco); depois lendo as novas
+        for attempt in range(2):
+            with self._lock:
+                recent = list(self._recent)
+            links = {}
+            for change in recent:
+                if change["aba"] != worksheet:
+                    continue
+                # Duas gravações que partiram do mesmo carimbo: uma delas não está na cadeia
+                links[change["anterior"]] = None if change["anterior"] in links else change
+            path, current = [], old
+            while current != new and len(path) <= len(links):
+                change = links.get(current)
+                if change is None:
+                    break
+                path.append(change)
+                current = change["versao"]
+            if current == new:
+                return path
+            if attempt == 0:
+                self.poll()
+        return None
+
+    def stats(self):
+        return {"cursor": self.cursor, "polls": self.polls, "read": self.read, "recorded": self.recorded}
@@ -0,0 +1,333 @@
+"""
+Cliente enxuto da API de valores do Google Sheets (spreadsheets.values).
+
+Permite ler e gravar linhas individuais em vez de reescrever a aba inteira.
+O endpoint é configurável para apontar para um servidor Sheets falso local.
+"""
+import os
+import re
+import socket
+import time
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+
+def col_letter(index):
+    """Converte índice de coluna (0 = A) para a letra A1 correspondente"""
+    letters = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def a1(worksheet, cells=None):
+    """Monta uma referência A1 com o nome da aba entre aspas"""
+    ref = "'" + worksheet.replace("'", "''") + "'"
+    return f"{ref}!{cells}" if cells else ref
+
+
+def http_status(exc):
+    """Código HTTP de um erro do googleapiclient/gspread/requests, se houver"""
+    resp = getattr(exc, "resp", None) or getattr(exc, "response", None)
+    status = getattr(resp, "status", None) or getattr(resp, "status_code", None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    """Erros transitórios: cota (429), falhas do servidor (5xx) e problemas de rede"""
+    status = http_status(exc)
+    if status is not None:
+        return status == 429 or 500 <= status < 600
+    return isinstance(exc, (ConnectionError, TimeoutError, OSError))
+
+
+def is_unsent(exc):
+    """Falhas em que a requisição certamente não chegou à API (conexão recusada, nome não resolvido)"""
+    return isinstance(exc, (ConnectionRefusedError, socket.gaierror))
+
+
+def cell_text(value):
+    """Valor como a API o devolve formatado (FORMATTED_VALUE), para comparar o enviado com o gravado"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def spreadsheet_id_from_url(url):
+    """Extrai o ID da planilha de uma URL do Google Sheets (ou devolve o próprio ID)"""
+    match = re.search(r"/spreadsheets/d/([a-zA-Z0-9-_]+)", url or "")
+    return match.group(1) if match else url
+
+
+class SheetsValuesClient:
+    """Operações por linha na planilha, localizando registros pela coluna-chave."""
+
+    def __init__(self, spreadsheet_id, credentials=None, api_endpoint=None, service=None, guard=None):
+        self.spreadsheet_id = spreadsheet_id
+        # QuotaGuard opcional: ritmo dentro da cota, repetição de 429/5xx e circuito
+        self.guard = guard
+        if service is None:
+            from googleapiclient.discovery import build
+            options = {"api_endpoint": api_endpoint} if api_endpoint else None
+            service = build("sheets", "v4", credentials=credentials, client_options=options,
+                            cache_discovery=False, static_discovery=True)
+        self._spreadsheets = service.spreadsheets()
+        self._values = self._spreadsheets.values()
+        self._titles = None
+        self._titles_at = 0.0
+
+    def _execute(self, request, kind="write"):
+        if self.guard is None:
+            return request.execute()
+        return self.guard.call(kind, request.execute)
+
+    @classmethod
+    def from_secrets(cls, secrets, guard=None):
+        """
+        Cria o cliente a partir de [connections.gsheets] do secrets.toml.
+        'api_endpoint' (ou INTEGRA_SHEETS_ENDPOINT) aponta para um servidor falso em testes locais.
+        """
+        secrets = dict(secrets)
+        endpoint = secrets.get("api_endpoint") or os.environ.get("INTEGRA_SHEETS_ENDPOINT")
+        if secrets.get("private_key"):
+            from google.oauth2 import service_account
+            credentials = service_account.Credentials.from_service_account_info(secrets, scopes=SCOPES)
+        else:
+            from google.auth.credentials import AnonymousCredentials
+            credentials = AnonymousCredentials()
+        return cls(spreadsheet_id_from_url(secrets.get("spreadsheet")), credentials, endpoint, guard=guard)
+
+    # --- LEITURA ---
+    # Valores formatados (texto), como na conexão do Streamlit: números e datas chegam iguais por qualquer caminho
+    def get(self, cells):
+        result = self._execute(self._values.get(spreadsheetId=self.spreadsheet_id, range=cells,
+                                                valueRenderOption="FORMATTED_VALUE"), "read")
+        return result.get("values", [])
+
+    def batch_get(self, ranges):
+        """Vários intervalos A1 numa única requisição (values.batchGet); devolve as linhas de cada um, na ordem"""
+        if not ranges:
+            return []
+        result = self._execute(self._values.batchGet(spreadsheetId=self.spreadsheet_id, ranges=list(ranges),
+                                                     valueRenderOption="FORMATTED_VALUE"), "read")
+        return [vr.get("values", []) for vr in result.get("valueRanges", [])]
+
+    def header(self, worksheet):
+        rows = self.get(a1(worksheet, "1:1"))
+        return [str(c) for c in rows[0]] if rows else []
+
+    def column(self, worksheet, header, name):
+        """Valores de uma coluna (sem o cabeçalho); a posição na lista + 2 é a linha na planilha"""
+        letter = col_letter(header.index(name))
+        rows = self.get(a1(worksheet, f"{letter}2:{letter}"))
+        return [str(r[0]) if r else "" for r in rows]
+
+    def read_row(self, worksheet, header, row_number):
+        rows = self.get(a1(worksheet, f"A{row_number}:{col_letter(len(header) - 1)}{row_number}"))
+        values = rows[0] if rows else []
+        return {k: (values[i] if i < len(values) else "") for i, k in enumerate(header)}
+
+    def read_records(self, worksheet):
+        """Aba inteira como lista de dicts (linhas totalmente vazias são ignoradas)"""
+        rows = self.get(a1(worksheet))
+        if not rows:
+            return []
+        header = [str(c) for c in rows[0]]
+        return [{k: (r[i] if i < len(r) else "") for i, k in enumerate(header)}
+                for r in rows[1:] if any(v != "" for v in r)]
+
+    def find_row(self, worksheet, key, value, header=None):
+        """Número da linha (1-based) cujo campo 'key' é igual a 'value', ou None"""
+        header = header or self.header(worksheet)
+        if key not in header:
+            return None
+        keys = self.column(worksheet, header, key)
+        try:
+            return keys.index(str(value)) + 2
+        except ValueError:
+            return None
+
+    # --- ESCRITA ---
+    def _row_values(self, header, record):
+        # None faz a API manter o valor atual da célula (colunas ausentes no registro)
+        return [record.get(k) for k in header]
+
+    def sheet_id(self, worksheet):
+        """ID numérico da aba (usado nas requisições batchUpdate), criando-a se não existir"""
+        self.ensure_worksheet(worksheet)
+        return self._titles[worksheet]
+
+    def titles(self, max_age=60.0):
+        """Títulos das abas existentes; os metadados são relidos quando têm mais de 'max_age' segundos"""
+        if self._titles is None or time.monotonic() - self._titles_at > max_age:
+            meta = self._execute(self._spreadsheets.get(spreadsheetId=self.spreadsheet_id,
+                                                        fields="sheets.properties(title,sheetId)"), "read")
+            self._titles = {s["properties"]["title"]: s["properties"].get("sheetId")
+                            for s in meta.get("sheets", [])}
+            self._titles_at = time.monotonic()
+        return set(self._titles)
+
+    def ensure_worksheet(self, worksheet):
+        """Cria a aba se ela ainda não existir na planilha"""
+        if self._titles is None or worksheet not in self._titles:
+            self.titles(max_age=0)
+        if worksheet not in self._titles:
+            reply = self._execute(self._spreadsheets.batchUpdate(spreadsheetId=self.spreadsheet_id, body={
+                "requests": [{"addSheet": {"properties": {"title": worksheet}}}]
+            }))
+            self._titles[worksheet] = reply["replies"][0]["addSheet"]["properties"].get("sheetId")
+
+    def ensure_header(self, worksheet, columns):
+        """Garante que a aba exista e que o cabeçalho contenha 'columns', acrescentando as que faltarem"""
+        self.ensure_worksheet(worksheet)
+        header = self.header(worksheet)
+        missing = [c for c in columns if c not in header]
+        if missing:
+            header = header + missing
+            self._execute(self._values.update(spreadsheetId=self.spreadsheet_id, range=a1(worksheet, "A1"),
+                                              valueInputOption="RAW", body={"values": [header]}))
+        return header
+
+    def set_values(self, cells, values):
+        self._execute(self._values.update(spreadsheetId=self.spreadsheet_id, range=cells,
+                                          valueInputOption="RAW", body={"values": values}))
+
+    def batch_set(self, updates):
+        """Grava vários intervalos [(celulas, valores), ...] numa única requisição"""
+        if not updates:
+            return
+        self._execute(self._values.batchUpdate(spreadsheetId=self.spreadsheet_id, body={
+            "valueInputOption": "RAW",
+            "data": [{"range": cells, "values": values} for cells, values in updates],
+        }))
+
+    def update_row(self, worksheet, header, row_number, record):
+        cells = f"A{row_number}:{col_letter(len(header) - 1)}{row_number}"
+        self._execute(self._values.update(spreadsheetId=self.spreadsheet_id, range=a1(worksheet, cells),
+                                          valueInputOption="RAW",
+                                          body={"values": [self._row_values(header, record)]}))
+
+    def append_rows(self, worksheet, header, records, confirm=False):
+        """
+        Acrescenta as linhas no fim da aba; retorna o número da primeira linha gravada (ou None).
+        values.append não é idempotente: se a resposta se perder (5xx, tempo esgotado), o fim da
+        aba é conferido antes de reenviar, para não duplicar linhas. Com 'confirm' (nova tentativa
+        de um envio que falhou antes) a conferência é feita já antes do primeiro envio.
+        """
+        if not records:
+            return None
+        values = [self._row_values(header, r) for r in records]
+        if confirm:
+            landed = self._landed(worksheet, header, values)
+            if landed is not None:
+                return landed
+        try:
+            result = self._append(worksheet, values)
+        except Exception as e:
+            if not is_retryable(e) or is_unsent(e) or http_status(e) == 429:
+                raise
+            landed = self._landed(worksheet, header, values)
+            if landed is not None:
+                return landed
+            result = self._append(worksheet, values)
+        match = re.search(r"![A-Z]+(\d+)", (result or {}).get("updates", {}).get("updatedRange", ""))
+        return int(match.group(1)) if match else None
+
+    def _append(self, worksheet, values):
+        return self._execute(self._values.append(spreadsheetId=self.spreadsheet_id, range=a1(worksheet, "A1"),
+                                                 valueInputOption="RAW", insertDataOption="INSERT_ROWS",
+                                                 body={"values": values}), "append")
+
+    def _landed(self, worksheet, header, values, window=50):
+        """
+        Linha em que 'values' já estão gravadas, entre as últimas da aba, ou None. A última linha
+        sai da coluna A, sempre preenchida nas abas que recebem acréscimos (data/hora, id, chave).
+        """
+        last = len(self.get(a1(worksheet, "A:A")))
+        if last < 2:
+            return None
+        first = max(2, last - len(values) - window + 1)
+        tail = self.get(a1(worksheet, f"A{first}:{col_letter(len(header) - 1)}{last}"))
+
+        def trimmed(row):
+            row = [cell_text(v) for v in row]
+            while row and row[-1] == "":
+                row.pop()
+            return row
+
+        sent = [trimmed(r) for r in values]
+        found = [trimmed(r) for r in tail]
+        for start in range(len(found) - len(sent), -1, -1):
+            if found[start:start + len(sent)] == sent:
+                return first + start
+        return None
+
+    def delete_rows(self, worksheet, row_numbers):
+        """
+        Remove as linhas (1-based) numa única requisição. Linhas consecutivas viram um só
+        intervalo; os intervalos são apagados de baixo para cima para não deslocar os seguintes.
+        """
+        if not row_numbers:
+            return
+        ranges = []
+        for n in sorted(set(row_numbers)):
+            if ranges and ranges[-1][1] == n - 1:
+                ranges[-1][1] = n
+            else:
+                ranges.append([n, n])
+        sheet_id = self.sheet_id(worksheet)
+        self._execute(self._spreadsheets.batchUpdate(spreadsheetId=self.spreadsheet_id, body={"requests": [
+            {"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS",
+                                           "startIndex": first - 1, "endIndex": last}}}
+            for first, last in reversed(ranges)
+        ]}))
+
+    def replace_all(self, worksheet, header, records):
+        """Substitui todo o conteúdo da aba (usado apenas para snapshots completos)"""
+        # No primeiro snapshot a aba ainda não existe: limpar um intervalo inexistente daria 400
+        self.ensure_worksheet(worksheet)
+        self._execute(self._values.clear(spreadsheetId=self.spreadsheet_id, range=a1(worksheet), body={}))
+        self._execute(self._values.update(spreadsheetId=self.spreadsheet_id, range=a1(worksheet, "A1"),
+                                          valueInputOption="RAW",
+                                          body={"values": [header] + [self._row_values(header, r) for r in records]}))
+
+    def upsert(self, worksheet, key, record, before_write=None, check_keys=None):
+        """
+        Atualiza apenas a linha do registro (localizada pela coluna 'key') ou acrescenta uma nova.
+        Antes de escrever, relê a linha alvo para confirmar que ela ainda pertence ao registro,
+        evitando sobrescrever outro aluno caso as linhas tenham se deslocado.
+        'before_write(anterior)' é chamado antes da escrita (ex.: para anotar o backup ou
+        conferir a versão); se devolver um dict, ele é o registro efetivamente gravado.
+        'check_keys(chaves)' recebe a coluna-chave já lida, antes de qualquer escrita (ex.: trava anti-wipe).
+        Retorna (numero_da_linha, registro_anterior ou None, registro_gravado); o número da linha
+        pode ser None num acréscimo se a API não informar onde ele caiu.
+        """
+        header = self.ensure_header(worksheet, list(record.keys()))
+        keys = self.column(worksheet, header, key)
+        if check_keys:
+            check_keys(keys)
+        row_number = keys.index(str(record[key])) + 2 if str(record[key]) in keys else None
+        previous = None
+        if row_number is not None:
+            previous = self.read_row(worksheet, header, row_number)
+            if str(previous.get(key)) != str(record[key]):
+                raise RuntimeError(f"Linha {row_number} deixou de corresponder a '{record[key]}' durante o salvamento.")
+        if before_write:
+            record = before_write(previous) or record
+            # O registro final pode ocupar colunas (de continuação) que o cabeçalho ainda não tem
+            if any(k not in header for k in record):
+                header = self.ensure_header(worksheet, list(record.keys()))
+        if row_number is None:
+            row_number = self.append_rows(worksheet, header, [record])
+        else:
+            self.update_row(worksheet, header, row_number, record)
+        return row_number, previous, record
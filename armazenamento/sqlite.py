@@ -0,0 +1,326 @@
+"""
+Backend local em SQLite (modo WAL), indexado por id, nome, tipo_doc e doc_uuid.
+Os campos consultados pelas listagens ficam nas colunas doc_uuid e resumo, extraídas do
+dados_json ao salvar.
+
+Funciona sem rede. Opcionalmente espelha cada gravação num backend de sincronização
+(o Google Sheets), por uma fila write-behind; o espelho também é usado para popular
+o banco na primeira inicialização.
+"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from .backends import (
+    DB_COLUMNS, SEED_WORKSHEETS, SUMMARY_COLUMNS, StorageBackend, apply_patch, check_version, effective_patch,
+    guard_delete, parse_row, patch_entry, record_version, with_summary,
+)
+from .backup import RESTORE_COLUMNS, replay
+from .blobs import blob_hash
+from .sync import WriteBehindQueue
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alunos (
+    id TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    tipo_doc TEXT NOT NULL,
+    dados_json TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    doc_uuid TEXT,
+    resumo TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_alunos_nome ON alunos(nome);
+CREATE INDEX IF NOT EXISTS ix_alunos_tipo_doc ON alunos(tipo_doc);
+
+CREATE TABLE IF NOT EXISTS planilhas (
+    aba TEXT NOT NULL,
+    linha INTEGER NOT NULL,
+    dados TEXT NOT NULL,
+    PRIMARY KEY (aba, linha)
+);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    dados BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS backup_journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_hora TEXT NOT NULL DEFAULT (strftime('%d/%m/%Y %H:%M:%S', 'now', 'localtime')),
+    usuario TEXT,
+    operacao TEXT,
+    id TEXT,
+    nome TEXT,
+    tipo_doc TEXT,
+    dados_anterior TEXT,
+    dados_novo TEXT
+);
+
+CREATE TABLE IF NOT EXISTS doc_patches (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_hora TEXT NOT NULL,
+    id TEXT NOT NULL,
+    versao INTEGER NOT NULL,
+    usuario TEXT,
+    patch TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_doc_patches_id ON doc_patches(id);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Persistência em um arquivo SQLite local; 'mirror' é o alvo opcional de sincronização."""
+
+    def __init__(self, path, mirror=None, write_behind=True):
+        self.path = path
+        self.mirror = mirror
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+        self._migrate()
+        if mirror is not None and self._count("alunos") == 0:
+            self.seed_from(mirror)
+        # Com write-behind, o espelho é atualizado por uma fila durável em segundo plano
+        self.sync_queue = WriteBehindQueue(mirror, path) if mirror is not None and write_behind else None
+
+    # --- CONEXÃO ---
+    def _db(self):
+        # Uma conexão por thread; o WAL permite leituras concorrentes com uma escrita
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _migrate(self):
+        """Acrescenta colunas introduzidas depois da criação do arquivo e preenche as derivadas"""
+        db = self._db()
+        columns = {r[1] for r in db.execute("PRAGMA table_info(alunos)")}
+        if "version" not in columns:
+            db.execute("ALTER TABLE alunos ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "doc_uuid" not in columns:
+            db.execute("ALTER TABLE alunos ADD COLUMN doc_uuid TEXT")
+            db.execute("ALTER TABLE alunos ADD COLUMN resumo TEXT")
+            # Substitui o índice por expressão JSON pelo índice na coluna
+            db.execute("DROP INDEX IF EXISTS ix_alunos_doc_uuid")
+        db.execute("CREATE INDEX IF NOT EXISTS ix_alunos_uuid ON alunos(doc_uuid)")
+        pending = db.execute("SELECT id, tipo_doc, dados_json FROM alunos WHERE resumo IS NULL").fetchall()
+        if pending:
+            filled = [with_summary({"id": i, "tipo_doc": t, "dados_json": d}) for i, t, d in pending]
+            with self._write() as db:
+                db.executemany("UPDATE alunos SET doc_uuid = :doc_uuid, resumo = :resumo WHERE id = :id", filled)
+
+    def _count(self, table):
+        return self._db().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _frame(self, sql, params=(), columns=DB_COLUMNS):
+        rows = self._db().execute(sql, params).fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+    def _sync(self, method, *args, **kwargs):
+        """Repete a operação no backend espelho; falhas não afetam o banco local"""
+        if self.mirror is None:
+            return
+        if self.sync_queue is not None:
+            self.sync_queue.enqueue(method, *args)
+            return
+        try:
+            getattr(self.mirror, method)(*args, **kwargs)
+        except Exception as e:
+            print(f"Aviso: sincronização ({method}) falhou: {e}")
+
+    def seed_from(self, source):
+        """Copia Alunos e as abas auxiliares de outro backend para o banco local"""
+        df = source.load_db(strict=True)
+        records = [with_summary({"id": str(r["id"]), "nome": str(r["nome"]), "tipo_doc": str(r["tipo_doc"]),
+                                 "dados_json": r["dados_json"], "version": record_version(r)})
+                   for _, r in df.iterrows() if isinstance(r.get("dados_json"), str)]
+        with self._write() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO alunos(id, nome, tipo_doc, dados_json, version, doc_uuid, resumo) "
+                "VALUES (:id, :nome, :tipo_doc, :dados_json, :version, :doc_uuid, :resumo)",
+                records
+            )
+        for worksheet in SEED_WORKSHEETS:
+            try:
+                self._replace_worksheet(worksheet, source.safe_read(worksheet))
+            except Exception as e:
+                print(f"Aviso: não foi possível copiar a aba {worksheet}: {e}")
+
+    # --- ALUNOS ---
+    _SELECT = "SELECT " + ", ".join(DB_COLUMNS) + " FROM alunos"
+
+    def load_db(self, strict=False):
+        return self._frame(f"{self._SELECT} ORDER BY rowid")
+
+    def load_columns(self, columns):
+        unknown = [c for c in columns if c not in DB_COLUMNS]
+        if unknown:
+            raise ValueError(f"Colunas inexistentes em alunos: {unknown}")
+        return self._frame("SELECT " + ", ".join(columns) + " FROM alunos ORDER BY rowid", columns=list(columns))
+
+    def load_summary(self):
+        return self._frame("SELECT " + ", ".join(SUMMARY_COLUMNS) + " FROM alunos ORDER BY rowid",
+                           columns=SUMMARY_COLUMNS)
+
+    def load_student(self, name):
+        return self._frame(f"{self._SELECT} WHERE nome = ? ORDER BY rowid", (name,))
+
+    def find_by_uuid(self, doc_uuid, parse=None):
+        df = self._frame(f"{self._SELECT} WHERE doc_uuid = ?", (doc_uuid,))
+        if df.empty:
+            return None
+        parse = parse or parse_row
+        row = df.iloc[0]
+        return row, parse(row)
+
+    def save_student(self, record, user, operation, backup=True, expected_version=None, patch=None):
+        with self._write() as db:
+            found = db.execute(f"{self._SELECT} WHERE id = ?", (record["id"],)).fetchone()
+            previous = dict(zip(DB_COLUMNS, found)) if found else None
+            patch = effective_patch(previous, patch)
+            # Compare-and-swap atômico: a transação IMMEDIATE bloqueia outras escritas até o COMMIT.
+            # O patch é aplicado na mesma transação, sobre o dados_json gravado
+            saved = with_summary(check_version(apply_patch(record, previous, patch), previous, expected_version))
+            if backup:
+                self._journal(db, previous, saved, user, operation)
+            if patch is not None:
+                db.execute("INSERT INTO doc_patches(data_hora, id, versao, usuario, patch) "
+                           "VALUES (:data_hora, :id, :versao, :usuario, :patch)", patch_entry(saved, user, patch))
+            db.execute(
+                "INSERT INTO alunos(id, nome, tipo_doc, dados_json, version, doc_uuid, resumo) "
+                "VALUES (:id, :nome, :tipo_doc, :dados_json, :version, :doc_uuid, :resumo) "
+                "ON CONFLICT(id) DO UPDATE SET nome = excluded.nome, tipo_doc = excluded.tipo_doc, "
+                "dados_json = excluded.dados_json, version = excluded.version, "
+                "doc_uuid = excluded.doc_uuid, resumo = excluded.resumo",
+                saved
+            )
+        self._sync("save_student", saved, user, operation, backup=False)
+        return saved
+
+    def patch_log(self, record_id):
+        rows = self._db().execute("SELECT data_hora, id, versao, usuario, patch FROM doc_patches "
+                                  "WHERE id = ? ORDER BY seq", (record_id,)).fetchall()
+        return [{"data_hora": d, "id": i, "versao": v, "usuario": u, "patch": json.loads(p)}
+                for d, i, v, u, p in rows]
+
+    def delete_student(self, name, user, backup=True):
+        with self._write() as db:
+            rows = db.execute(f"{self._SELECT} WHERE nome = ?", (name,)).fetchall()
+            records = [dict(zip(DB_COLUMNS, r)) for r in rows]
+            # Trava: no máximo um documento por tipo, cada um com o id do aluno; apaga só esses ids
+            guard_delete(name, records)
+            if backup:
+                for r in records:
+                    self._journal(db, r, None, user, "Exclusão")
+            db.executemany("DELETE FROM alunos WHERE id = ?", [(r["id"],) for r in records])
+        if records:
+            self._sync("delete_student", name, user, backup=False)
+        return records
+
+    # --- BLOBS (FOTOS) ---
+    def put_blob(self, data):
+        sha = blob_hash(data)
+        with self._write() as db:
+            inserted = db.execute("INSERT OR IGNORE INTO blobs(sha256, dados) VALUES (?, ?)", (sha, data)).rowcount
+        if inserted:
+            self._sync("put_blob", data)
+        return sha
+
+    def get_blob(self, sha):
+        row = self._db().execute("SELECT dados FROM blobs WHERE sha256 = ?", (sha,)).fetchone()
+        if row is not None:
+            return bytes(row[0])
+        # Blob gravado por outro processo apenas no espelho: busca e guarda localmente
+        if self.mirror is None:
+            return None
+        data = self.mirror.get_blob(sha)
+        if data is not None:
+            with self._write() as db:
+                db.execute("INSERT OR IGNORE INTO blobs(sha256, dados) VALUES (?, ?)", (sha, data))
+        return data
+
+    # --- BACKUP E HISTÓRICO ---
+    def _journal(self, db, previous, new, user, operation):
+        base = new if new is not None else previous
+        db.execute(
+            "INSERT INTO backup_journal(usuario, operacao, id, nome, tipo_doc, dados_anterior, dados_novo) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user, operation, base.get("id"), base.get("nome"), base.get("tipo_doc"),
+             "" if previous is None else previous.get("dados_json", ""),
+             "" if new is None else new.get("dados_json", ""))
+        )
+
+    def create_backup(self, previous, new, user, operation):
+        if previous is None and new is None:
+            return
+        with self._write() as db:
+            self._journal(db, previous, new, user, operation)
+
+    def restore_to(self, seq=None):
+        # O journal pode não ter o começo do banco (semeado de outro backend): parte do estado atual
+        # e desfaz as entradas posteriores a 'seq', lidos na mesma transação
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            current = db.execute("SELECT id, nome, tipo_doc, dados_json FROM alunos").fetchall()
+            journal = [] if seq is None else db.execute(
+                "SELECT seq, id, nome, tipo_doc, dados_anterior, dados_novo FROM backup_journal WHERE seq > ?",
+                (int(seq),)).fetchall()
+        finally:
+            db.execute("COMMIT")
+        fields = ["seq", "id", "nome", "tipo_doc", "dados_anterior", "dados_novo"]
+        return replay([dict(zip(RESTORE_COLUMNS, r)) for r in current], [dict(zip(fields, r)) for r in journal],
+                      float("inf"), seq)
+
+    def log_action(self, entry):
+        with self._write() as db:
+            self._append(db, "Historico", entry)
+        self._sync("log_action", entry)
+
+    # --- ABAS AUXILIARES ---
+    def _append(self, db, worksheet, row):
+        db.execute(
+            "INSERT INTO planilhas(aba, linha, dados) "
+            "VALUES (?, (SELECT COALESCE(MAX(linha), 0) + 1 FROM planilhas WHERE aba = ?), ?)",
+            (worksheet, worksheet, json.dumps(row, ensure_ascii=False, default=str))
+        )
+
+    def _replace_worksheet(self, worksheet, df):
+        rows = df.dropna(how="all").to_dict("records") if df is not None else []
+        with self._write() as db:
+            db.execute("DELETE FROM planilhas WHERE aba = ?", (worksheet,))
+            db.executemany(
+                "INSERT INTO planilhas(aba, linha, dados) VALUES (?, ?, ?)",
+                [(worksheet, i + 1, json.dumps(r, ensure_ascii=False, default=str)) for i, r in enumerate(rows)]
+            )
+
+    def safe_read(self, worksheet):
+        rows = self._db().execute("SELECT dados FROM planilhas WHERE aba = ? ORDER BY linha",
+                                  (worksheet,)).fetchall()
+        return pd.DataFrame([json.loads(r[0]) for r in rows])
+
+    def safe_update(self, worksheet, df):
+        self._replace_worksheet(worksheet, df)
+        self._sync("safe_update", worksheet, df)
+
+    def stats(self):
+        stats = {"alunos": self._count("alunos"), "journal": self._count("backup_journal"), "path": self.path}
+        if self.sync_queue is not None:
+            stats["sync"] = self.sync_queue.stats()
+        return stats
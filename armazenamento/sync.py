@@ -0,0 +1,207 @@
+"""
+Fila de sincronização write-behind.
+
+As operações destinadas ao backend remoto (Google Sheets) são gravadas numa fila
+durável (tabela SQLite) e enviadas por uma thread de fundo. Salvamentos repetidos
+do mesmo documento ainda pendentes são mesclados num só; erros de cota (429) e do
+servidor (5xx) são repetidos com backoff exponencial.
+"""
+import base64
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from .sheets import is_retryable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_pendentes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    chave TEXT,
+    metodo TEXT NOT NULL,
+    args TEXT NOT NULL,
+    criado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_sync_pendentes_chave ON sync_pendentes(chave);
+CREATE TABLE IF NOT EXISTS sync_falhas (
+    seq INTEGER PRIMARY KEY,
+    metodo TEXT NOT NULL,
+    args TEXT NOT NULL,
+    criado REAL NOT NULL,
+    erro TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    dono TEXT,
+    ate REAL
+);
+"""
+
+
+def _coalesce_key(method, args):
+    """Chave de mesclagem: operações pendentes com a mesma chave são substituídas pela mais nova"""
+    if method == "save_student":
+        return f"registro:{args[0]['id']}"
+    if method == "safe_update":
+        return f"aba:{args[0]}"
+    return None
+
+
+def _encode(method, args):
+    if method == "safe_update":
+        worksheet, df = args
+        args = [worksheet, json.loads(df.to_json(orient="records", force_ascii=False))]
+    elif method == "put_blob":
+        args = [base64.b64encode(args[0]).decode("ascii")]
+    return json.dumps(args, ensure_ascii=False, default=str)
+
+
+def _decode(method, raw):
+    args = json.loads(raw)
+    if method == "safe_update":
+        args = [args[0], pd.DataFrame(args[1])]
+    elif method == "put_blob":
+        args = [base64.b64decode(args[0])]
+    return args
+
+
+class WriteBehindQueue:
+    """
+    Fila durável + worker de envio para 'target' (um StorageBackend).
+    Com vários processos usando o mesmo arquivo, apenas o dono do 'lease' envia.
+    """
+
+    def __init__(self, target, path, batch_size=20, poll_interval=1.0, min_backoff=1.0, max_backoff=120.0,
+                 lease_seconds=30.0):
+        self.target = target
+        self.path = path
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self.flushed = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.last_error = None
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._db().executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._run, name="sync-write-behind", daemon=True)
+        self._thread.start()
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    # --- ENFILEIRAMENTO ---
+    def enqueue(self, method, *args):
+        """Grava a operação na fila (durável) e retorna imediatamente"""
+        key = _coalesce_key(method, args)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if key is not None:
+                merged = db.execute("DELETE FROM sync_pendentes WHERE chave = ?", (key,)).rowcount
+                self.coalesced += merged
+            db.execute("INSERT INTO sync_pendentes(chave, metodo, args, criado) VALUES (?, ?, ?, ?)",
+                       (key, method, _encode(method, args), time.time()))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        self._wake.set()
+
+    # --- ENVIO ---
+    def _acquire_lease(self):
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT dono, ate FROM sync_lease WHERE id = 1").fetchone()
+            if row is None or row[0] == self.owner or row[1] < now:
+                db.execute("INSERT OR REPLACE INTO sync_lease(id, dono, ate) VALUES (1, ?, ?)",
+                           (self.owner, now + self.lease_seconds))
+                acquired = True
+            else:
+                acquired = False
+        finally:
+            db.execute("COMMIT")
+        return acquired
+
+    def _send(self, seq, method, raw, created):
+        """Envia uma operação. Retorna False se ela deve ser tentada de novo mais tarde."""
+        # O backup já foi feito no banco local; o destino recebe apenas a gravação
+        kwargs = {"backup": False} if method in ("save_student", "delete_student") else {}
+        try:
+            getattr(self.target, method)(*_decode(method, raw), **kwargs)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            if is_retryable(e):
+                return False
+            print(f"Aviso: sincronização ({method}) descartada para sync_falhas: {e}")
+            self._db().execute("INSERT OR REPLACE INTO sync_falhas(seq, metodo, args, criado, erro) "
+                               "VALUES (?, ?, ?, ?, ?)", (seq, method, raw, created, self.last_error))
+        # Remove pela seq: se uma versão mais nova foi enfileirada durante o envio, ela permanece
+        self._db().execute("DELETE FROM sync_pendentes WHERE seq = ?", (seq,))
+        self.flushed += 1
+        return True
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                if not self._acquire_lease():
+                    continue
+                rows = self._db().execute("SELECT seq, metodo, args, criado FROM sync_pendentes "
+                                          "ORDER BY seq LIMIT ?", (self.batch_size,)).fetchall()
+            except sqlite3.Error as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                continue
+            for row in rows:
+                if self._stop.is_set():
+                    return
+                if not self._send(*row):
+                    # 429/5xx/rede: espera com backoff exponencial (com jitter) e recomeça do mais antigo
+                    self.retries += 1
+                    self._stop.wait(backoff * random.uniform(0.5, 1.0))
+                    backoff = min(backoff * 2, self.max_backoff)
+                    break
+                backoff = self.min_backoff
+            else:
+                if len(rows) == self.batch_size:
+                    self._wake.set()
+
+    def close(self, timeout=5):
+        """Para o worker e libera o lease para outro processo assumir o envio"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._db().execute("DELETE FROM sync_lease WHERE id = 1 AND dono = ?", (self.owner,))
+
+    # --- MÉTRICAS ---
+    def stats(self):
+        db = self._db()
+        depth, oldest = db.execute("SELECT COUNT(*), MIN(criado) FROM sync_pendentes").fetchone()
+        failed = db.execute("SELECT COUNT(*) FROM sync_falhas").fetchone()[0]
+        return {
+            "depth": depth,
+            "lag_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+            "flushed": self.flushed,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failed": failed,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from armazenamento import JsonFileBackend, SheetsBackend, SheetsValuesClient, SQLiteBackend
+
+from fake_sheets import FakeConn, FakeService, Planilha
+
+
+def registro(nome, tipo="PEI", **campos):
+    """Registro de aluno como o app monta em save_student"""
+    return {"id": f"{nome} ({tipo})", "nome": nome, "tipo_doc": tipo,
+            "dados_json": json.dumps(dict({"nome": nome}, **campos), ensure_ascii=False)}
+
+
+def documento(registro_salvo):
+    return json.loads(registro_salvo["dados_json"])
+
+
+@pytest.fixture
+def planilha():
+    p = Planilha()
+    p.add_sheet("Alunos")
+    p.add_sheet("Professores", [["matricula", "nome"], ["1", "Ana Prof"]])
+    return p
+
+
+@pytest.fixture
+def service(planilha):
+    return FakeService(planilha)
+
+
+@pytest.fixture
+def sheets(planilha, service):
+    """Fábrica de SheetsBackend (um por 'processo') sobre a mesma planilha, sem intervalo de conferência"""
+    created = []
+
+    def make(**kwargs):
+        client = SheetsValuesClient("planilha-teste", service=service)
+        backend = SheetsBackend(FakeConn(planilha), client, **kwargs)
+        backend.cache.check_interval = 0
+        backend.index.check_interval = 0
+        created.append(backend)
+        return backend
+
+    yield make
+    for backend in created:
+        if backend._logger is not None:
+            backend._logger.close()
+        if backend._patches is not None:
+            backend._patches.close()
+
+
+@pytest.fixture
+def sqlite(tmp_path):
+    return SQLiteBackend(str(tmp_path / "integra.db"))
+
+
+@pytest.fixture
+def arquivo(tmp_path):
+    backend = JsonFileBackend(str(tmp_path / "banco.json"))
+    yield backend
+    backend.close()
+
+
+@pytest.fixture(params=["sheets", "sqlite", "arquivo"])
+def backend(request, sheets):
+    """Cada backend de persistência, para os testes do contrato comum de StorageBackend"""
+    if request.param == "sheets":
+        return sheets()
+    return request.getfixturevalue(request.param)
@@ -0,0 +1,355 @@
+"""
+Google Sheets falso para os testes: uma planilha em memória (Planilha) exposta de duas formas,
+como objeto 'service' no formato do googleapiclient (FakeService, usado pela maioria dos testes)
+e como servidor HTTP local (FakeSheetsServer), para o cliente real apontado por 'api_endpoint'.
+
+Cobre só o que o SheetsValuesClient usa: values.get/batchGet/update/append/batchUpdate/clear,
+spreadsheets.get (títulos das abas) e spreadsheets.batchUpdate (addSheet e deleteDimension).
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+import pandas as pd
+from googleapiclient.errors import HttpError
+
+
+def http_error(status, message="erro simulado"):
+    """HttpError como o googleapiclient levanta (http_status() lê o 'resp.status')"""
+    return HttpError(httplib2.Response({"status": status}), json.dumps({"error": {"message": message}}).encode())
+
+
+def _col(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def _letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def _formatted(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _trim(rows):
+    rows = [list(r) for r in rows]
+    for r in rows:
+        while r and r[-1] in ("", None):
+            r.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+class Planilha:
+    """Abas em memória: título -> lista de linhas (listas de valores)."""
+
+    def __init__(self):
+        self.tabs = {}
+        self.ids = {}
+        self.calls = []
+        self._lock = threading.RLock()
+
+    # --- REFERÊNCIAS A1 ---
+    def _split(self, ref):
+        match = re.match(r"^(?:'((?:[^']|'')*)'|([^!]+?))(?:!(.*))?$", ref)
+        title = match.group(1).replace("''", "'") if match.group(1) is not None else match.group(2)
+        if title not in self.tabs:
+            raise http_error(400, f"Unable to parse range: {ref}")
+        return title, match.group(3)
+
+    @staticmethod
+    def _bounds(cells):
+        """(linha1, linha2, col1, col2), 0-based e inclusivos; None = sem limite"""
+        if not cells:
+            return 0, None, 0, None
+        match = re.match(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$", cells)
+        c1, r1, c2, r2 = match.groups()
+        if match.group(3) is None and match.group(4) is None:
+            c2, r2 = c1, r1
+        return (int(r1) - 1 if r1 else 0, int(r2) - 1 if r2 else None,
+                _col(c1) if c1 else 0, _col(c2) if c2 else None)
+
+    # --- VALORES ---
+    def get(self, ref, render="FORMATTED_VALUE"):
+        with self._lock:
+            self.calls.append(("get", ref))
+            title, cells = self._split(ref)
+            r1, r2, c1, c2 = self._bounds(cells)
+            rows = self.tabs[title][r1:None if r2 is None else r2 + 1]
+            block = [r[c1:None if c2 is None else c2 + 1] for r in rows]
+            if render == "FORMATTED_VALUE":
+                block = [[_formatted(v) for v in r] for r in block]
+            return _trim(block)
+
+    def update(self, ref, values):
+        with self._lock:
+            self.calls.append(("update", ref))
+            title, cells = self._split(ref)
+            r1, _, c1, _ = self._bounds(cells)
+            rows = self.tabs[title]
+            for dr, vals in enumerate(values):
+                while len(rows) <= r1 + dr:
+                    rows.append([])
+                row = rows[r1 + dr]
+                for dc, v in enumerate(vals):
+                    if v is None:
+                        continue  # null mantém o valor atual da célula
+                    while len(row) <= c1 + dc:
+                        row.append("")
+                    row[c1 + dc] = v
+            return {"updatedRange": ref}
+
+    def append(self, ref, values):
+        with self._lock:
+            self.calls.append(("append", ref))
+            title, _ = self._split(ref)
+            rows = self.tabs[title]
+            del rows[len(_trim(rows)):]
+            first = len(rows) + 1
+            rows.extend([["" if v is None else v for v in r] for r in values])
+            width = max((len(r) for r in values), default=1)
+            cells = f"A{first}:{_letters(width - 1)}{first + len(values) - 1}"
+            return {"updates": {"updatedRange": f"'{title}'!{cells}", "updatedRows": len(values)}}
+
+    def clear(self, ref):
+        with self._lock:
+            self.calls.append(("clear", ref))
+            title, cells = self._split(ref)
+            if not cells:
+                self.tabs[title] = []
+                return {}
+            r1, r2, c1, c2 = self._bounds(cells)
+            for row in self.tabs[title][r1:None if r2 is None else r2 + 1]:
+                for c in range(c1, len(row) if c2 is None else min(c2 + 1, len(row))):
+                    row[c] = ""
+            return {}
+
+    # --- ABAS ---
+    def add_sheet(self, title, rows=None):
+        with self._lock:
+            if title not in self.tabs:
+                self.tabs[title] = [list(r) for r in (rows or [])]
+                self.ids[title] = len(self.ids) + 1
+            return self.ids[title]
+
+    def meta(self):
+        with self._lock:
+            self.calls.append(("meta", None))
+            return {"sheets": [{"properties": {"title": t, "sheetId": self.ids[t]}} for t in self.tabs]}
+
+    def batch_update(self, requests):
+        with self._lock:
+            replies = []
+            for req in requests:
+                if "addSheet" in req:
+                    title = req["addSheet"]["properties"]["title"]
+                    replies.append({"addSheet": {"properties": {"title": title, "sheetId": self.add_sheet(title)}}})
+                elif "deleteDimension" in req:
+                    rng = req["deleteDimension"]["range"]
+                    title = next(t for t, i in self.ids.items() if i == rng["sheetId"])
+                    self.calls.append(("delete", title))
+                    del self.tabs[title][rng["startIndex"]:rng["endIndex"]]
+                    replies.append({})
+            return {"replies": replies}
+
+    # --- AJUDAS PARA OS TESTES ---
+    def rows(self, title):
+        """Conteúdo da aba como lista de dicts (pelo cabeçalho), sem linhas vazias"""
+        rows = _trim(self.tabs.get(title, []))
+        if not rows:
+            return []
+        header = [str(c) for c in rows[0]]
+        return [{k: (r[i] if i < len(r) else "") for i, k in enumerate(header)} for r in rows[1:] if r]
+
+
+# --- SERVICE NO FORMATO DO GOOGLEAPICLIENT ---
+class _Request:
+    def __init__(self, service, op, run):
+        self.service = service
+        self.op = op
+        self.run = run
+
+    def execute(self):
+        return self.service.execute(self.op, self.run)
+
+
+class FakeService:
+    """
+    spreadsheets() / values() como no googleapiclient, sobre uma Planilha.
+    falhar(op, erro, depois=False) faz a próxima chamada 'op' levantar 'erro'; com depois=True
+    a operação é aplicada antes do erro (ex.: timeout depois que o servidor gravou).
+    """
+
+    def __init__(self, planilha):
+        self.planilha = planilha
+        self.executed = []
+        self._failures = []
+
+    def falhar(self, op, error, depois=False):
+        self._failures.append((op, error, depois))
+
+    def execute(self, op, run):
+        self.executed.append(op)
+        for i, (name, error, after) in enumerate(self._failures):
+            if name == op:
+                del self._failures[i]
+                if after:
+                    run()
+                raise error
+        return run()
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+
+class _Spreadsheets:
+    def __init__(self, service):
+        self.service = service
+        self.p = service.planilha
+
+    def get(self, spreadsheetId, fields=None):
+        return _Request(self.service, "meta", self.p.meta)
+
+    def batchUpdate(self, spreadsheetId, body):
+        return _Request(self.service, "batchUpdate", lambda: self.p.batch_update(body["requests"]))
+
+    def values(self):
+        return _Values(self.service)
+
+
+class _Values:
+    def __init__(self, service):
+        self.service = service
+        self.p = service.planilha
+
+    def get(self, spreadsheetId, range, valueRenderOption="FORMATTED_VALUE"):
+        return _Request(self.service, "get", lambda: {"range": range,
+                                                      "values": self.p.get(range, valueRenderOption)})
+
+    def batchGet(self, spreadsheetId, ranges, valueRenderOption="FORMATTED_VALUE"):
+        return _Request(self.service, "batchGet", lambda: {
+            "valueRanges": [{"range": r, "values": self.p.get(r, valueRenderOption)} for r in ranges]})
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return _Request(self.service, "update", lambda: self.p.update(range, body["values"]))
+
+    def append(self, spreadsheetId, range, valueInputOption, insertDataOption=None, body=None):
+        return _Request(self.service, "append", lambda: self.p.append(range, body["values"]))
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            for item in body["data"]:
+                self.p.update(item["range"], item["values"])
+            return {}
+        return _Request(self.service, "batchUpdate", run)
+
+    def clear(self, spreadsheetId, range, body=None):
+        return _Request(self.service, "clear", lambda: self.p.clear(range))
+
+
+class FakeConn:
+    """Conexão do streamlit-gsheets (read/update de abas inteiras, valores formatados)."""
+
+    def __init__(self, planilha):
+        self.planilha = planilha
+
+    def read(self, worksheet, ttl=0):
+        rows = self.planilha.get(f"'{worksheet}'")
+        if not rows:
+            return pd.DataFrame()
+        header = rows[0]
+        return pd.DataFrame([[r[i] if i < len(r) and r[i] != "" else None for i in range(len(header))]
+                             for r in rows[1:]], columns=header)
+
+    def update(self, worksheet, data):
+        self.planilha.add_sheet(worksheet)
+        self.planilha.tabs[worksheet] = [list(data.columns)] + data.fillna("").values.tolist()
+
+
+# --- SERVIDOR HTTP ---
+class FakeSheetsServer:
+    """Servidor local com as rotas v4 da API sobre uma Planilha; 'endpoint' vai no api_endpoint."""
+
+    def __init__(self, planilha):
+        self.planilha = planilha
+        handler = type("Handler", (_Handler,), {"planilha": planilha})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.endpoint = f"http://127.0.0.1:{self.httpd.server_port}/"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    planilha = None
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        match = re.match(r"^/v4/spreadsheets/([^/:]+)(?::(\w+)|/values(?::(\w+)|/([^:]+)(?::(\w+))?))?$", url.path)
+        if not match:
+            return self._reply(404, {"error": {"message": url.path}})
+        _, sheet_action, values_action, cells, cells_action = match.groups()
+        cells = unquote(cells) if cells else None
+        render = query.get("valueRenderOption", ["FORMATTED_VALUE"])[0]
+        p = self.planilha
+        try:
+            if sheet_action == "batchUpdate":
+                return self._reply(200, p.batch_update(body["requests"]))
+            if values_action == "batchGet":
+                return self._reply(200, {"valueRanges": [{"range": r, "values": p.get(r, render)}
+                                                         for r in query.get("ranges", [])]})
+            if values_action == "batchUpdate":
+                for item in body["data"]:
+                    p.update(item["range"], item["values"])
+                return self._reply(200, {})
+            if cells_action == "append":
+                return self._reply(200, p.append(cells, body["values"]))
+            if cells_action == "clear":
+                return self._reply(200, p.clear(cells))
+            if cells is not None and self.command == "PUT":
+                return self._reply(200, p.update(cells, body["values"]))
+            if cells is not None:
+                return self._reply(200, {"range": cells, "values": p.get(cells, render)})
+            return self._reply(200, p.meta())
+        except HttpError as e:
+            return self._reply(e.resp.status, {"error": {"code": e.resp.status, "message": str(e)}})
+
+    do_GET = do_POST = do_PUT = _handle
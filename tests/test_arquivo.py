@@ -0,0 +1,86 @@
+"""JsonFileBackend: journal de backup e fotos em arquivos próprios e semente das abas auxiliares."""
+import base64
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from armazenamento import JsonFileBackend, blob_hash
+
+from conftest import registro
+
+
+def test_backup_fica_no_journal_e_fora_do_auxiliar(arquivo):
+    arquivo.save_student(registro("Ana", v=1), "prof", "s")
+    arquivo.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    arquivo.compact()
+    with open(arquivo.aux_path, encoding="utf-8") as f:
+        assert "backup" not in json.load(f)
+    assert [json.loads(e["dados_novo"])["v"] for e in arquivo.read_backups()] == [1, 2]
+    assert arquivo.stats()["journal"] == 2
+
+
+def test_backups_de_versoes_anteriores_migram_para_o_journal(tmp_path):
+    path = tmp_path / "banco.json"
+    antigo = {"id": "Ana (PEI)", "operacao": "Salvar", "dados_anterior": "", "dados_novo": "{}"}
+    path.write_text("{}", encoding="utf-8")
+    (tmp_path / "banco.aux.json").write_text(json.dumps({"seq": 1, "backup": [antigo]}), encoding="utf-8")
+    (tmp_path / "banco.log").write_text(json.dumps({"op": "backup", "registro": antigo, "seq": 2}) + "\n",
+                                        encoding="utf-8")
+    backend = JsonFileBackend(str(path))
+    assert [e["id"] for e in backend.read_backups()] == ["Ana (PEI)", "Ana (PEI)"]
+    backend.close()
+    with open(backend.aux_path, encoding="utf-8") as f:
+        assert "backup" not in json.load(f)
+
+
+@pytest.mark.parametrize("local", ["sqlite", "arquivo"])
+def test_semente_preenche_so_as_abas_vazias(local, request):
+    backend = request.getfixturevalue(local)
+    backend.safe_update("Monitores", pd.DataFrame([{"matricula": "9", "nome": "Davi"}]))
+    gravadas = backend.seed_worksheets({"Professores": [{"matricula": "1", "nome": "Ana Prof"}],
+                                        "Monitores": [{"matricula": "2", "nome": "Outro"}]})
+    assert gravadas == ["Professores"]
+    assert backend.safe_read("Professores")["nome"].tolist() == ["Ana Prof"]
+    assert backend.safe_read("Monitores")["nome"].tolist() == ["Davi"]
+
+
+def test_foto_fica_num_arquivo_proprio_e_fora_do_auxiliar(arquivo):
+    foto = b"\x89PNG foto"
+    sha = arquivo.put_blob(foto)
+    assert arquivo.put_blob(foto) == sha
+    assert os.listdir(arquivo.blobs_path) == [sha]
+    arquivo.save_student(registro("Ana", foto_sha256=sha), "prof", "s")
+    arquivo.close()
+    with open(arquivo.aux_path, encoding="utf-8") as f:
+        assert "blobs" not in json.load(f)
+    assert JsonFileBackend(arquivo.path).get_blob(sha) == foto
+
+
+def test_foto_inexistente_corrompida_ou_com_hash_invalido(arquivo):
+    assert arquivo.get_blob(blob_hash(b"outra")) is None
+    assert arquivo.get_blob("../banco.json") is None
+    sha = arquivo.put_blob(b"foto")
+    with open(os.path.join(arquivo.blobs_path, sha), "wb") as f:
+        f.write(b"outra coisa")
+    with pytest.raises(ValueError, match="corrompida"):
+        arquivo.get_blob(sha)
+
+
+def test_fotos_de_versoes_anteriores_migram_para_arquivos(tmp_path):
+    path = tmp_path / "banco.json"
+    no_aux, no_log = b"foto do auxiliar", b"foto do log"
+    path.write_text("{}", encoding="utf-8")
+    (tmp_path / "banco.aux.json").write_text(json.dumps({
+        "seq": 1, "blobs": {blob_hash(no_aux): base64.b64encode(no_aux).decode()}}), encoding="utf-8")
+    (tmp_path / "banco.log").write_text(json.dumps({
+        "op": "blob", "sha256": blob_hash(no_log), "dados": base64.b64encode(no_log).decode(), "seq": 2}) + "\n",
+        encoding="utf-8")
+    backend = JsonFileBackend(str(path))
+    assert sorted(os.listdir(backend.blobs_path)) == sorted([blob_hash(no_aux), blob_hash(no_log)])
+    with open(backend.aux_path, encoding="utf-8") as f:
+        assert "blobs" not in json.load(f)
+    assert os.path.getsize(backend.log_path) == 0
+    backend = JsonFileBackend(str(path))
+    assert (backend.get_blob(blob_hash(no_aux)), backend.get_blob(blob_hash(no_log))) == (no_aux, no_log)
@@ -0,0 +1,94 @@
+"""Contrato comum dos backends (Sheets, SQLite e arquivo JSON): gravação, conflito, patch e exclusão."""
+import pytest
+
+from armazenamento import AntiWipeError, VersionConflictError, merge_patch, record_version
+
+from conftest import documento, registro
+
+
+def test_salva_e_le_o_documento(backend):
+    salvo = backend.save_student(registro("Ana", diag="TEA"), "prof", "Salvou PEI")
+    assert record_version(salvo) == 1
+    linhas = backend.load_student("Ana")
+    assert linhas["id"].tolist() == ["Ana (PEI)"]
+    assert documento(linhas.iloc[0]) == {"nome": "Ana", "diag": "TEA"}
+
+
+def test_versao_desatualizada_levanta_conflito_sem_gravar(backend):
+    backend.save_student(registro("Ana", v=1), "prof", "s")
+    backend.save_student(registro("Ana", v=2), "outro", "s", expected_version=1)
+    with pytest.raises(VersionConflictError) as erro:
+        backend.save_student(registro("Ana", v=3), "prof", "s", expected_version=1)
+    assert record_version(erro.value.current) == 2
+    assert documento(backend.load_student("Ana").iloc[0])["v"] == 2
+
+
+def test_patch_aplicado_sobre_a_versao_gravada(backend):
+    base = {"nome": "Ana", "saude": {"med": "A", "dose": 1}, "metas": ["ler"], "obs": "x"}
+    salvo = backend.save_student(registro("Ana", **{k: v for k, v in base.items() if k != "nome"}), "prof", "s")
+    novo = dict(base, saude={"med": "B", "dose": 1}, metas=["ler", "contar"])
+    del novo["obs"]
+    patch = merge_patch(base, novo)
+    # O dados_json do registro não importa: o backend aplica o patch ao documento gravado
+    gravado = backend.save_student(dict(registro("Ana"), dados_json="{}"), "prof", "s",
+                                   expected_version=record_version(salvo), patch=patch)
+    assert documento(gravado) == novo
+    assert documento(backend.load_student("Ana").iloc[0]) == novo
+    if hasattr(backend, "patches"):
+        backend.patches.flush()
+    log = backend.patch_log("Ana (PEI)")
+    assert [(e["versao"], e["patch"]) for e in log] == [(2, patch)]
+
+
+def test_patch_sem_versao_gravada_grava_o_documento_completo(backend):
+    # Documento novo (ou excluído por outro usuário): não há base, o patch não pode valer sobre {}
+    gravado = backend.save_student(registro("Ana", diag="TEA", obs="x"), "prof", "s",
+                                   expected_version=0, patch={"obs": "x"})
+    assert documento(gravado) == {"nome": "Ana", "diag": "TEA", "obs": "x"}
+    assert documento(backend.load_student("Ana").iloc[0]) == {"nome": "Ana", "diag": "TEA", "obs": "x"}
+    if hasattr(backend, "patches"):
+        backend.patches.flush()
+    assert backend.patch_log("Ana (PEI)") == []
+
+
+def test_exclusao_remove_apenas_o_aluno(backend):
+    for nome in ["Ana", "Bia", "Caio"]:
+        backend.save_student(registro(nome), "prof", "s")
+    backend.save_student(registro("Bia", "CASO"), "prof", "s")
+    removidos = backend.delete_student("Bia", "prof")
+    assert sorted(r["id"] for r in removidos) == ["Bia (CASO)", "Bia (PEI)"]
+    assert sorted(backend.load_db()["id"]) == ["Ana (PEI)", "Caio (PEI)"]
+
+
+def test_exclusao_sem_nome_e_bloqueada(backend):
+    backend.save_student(registro("Ana"), "prof", "s")
+    with pytest.raises(AntiWipeError):
+        backend.delete_student("  ", "prof")
+    assert len(backend.load_db()) == 1
+
+
+@pytest.mark.parametrize("destino", ["sqlite", "arquivo"])
+def test_copia_de_outro_backend_preserva_as_versoes(sheets, destino, request):
+    origem = sheets()
+    origem.save_student(registro("Ana", v=1), "prof", "s")
+    origem.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    alvo = request.getfixturevalue(destino)
+    alvo.seed_from(origem)
+    linha = alvo.load_student("Ana").iloc[0]
+    assert (record_version(linha), documento(linha)["v"]) == (2, 2)
+
+
+def test_versao_e_backup_aceitam_a_linha_do_dataframe(backend):
+    backend.save_student(registro("Ana"), "prof", "s")
+    linha = backend.load_student("Ana").iloc[0]
+    assert record_version(linha) == 1
+    backend.create_backup(linha, None, "prof", "Exclusão")
+
+
+def test_linha_com_id_de_outro_aluno_bloqueia_a_exclusao(sqlite):
+    sqlite.save_student(registro("Ana"), "prof", "s")
+    with sqlite._write() as db:
+        db.execute("INSERT INTO alunos(id, nome, tipo_doc, dados_json, version) VALUES ('Bia (PEI)', 'Ana', 'PEI', '{}', 1)")
+    with pytest.raises(AntiWipeError):
+        sqlite.delete_student("Ana", "prof")
+    assert len(sqlite.load_student("Ana")) == 2
@@ -0,0 +1,95 @@
+"""Journal de backup: restauração (com e sem snapshot) e a janela de reaplicação da compactação."""
+import json
+
+import pytest
+
+from armazenamento import BackupJournal, JOURNAL_COLUMNS, SheetsValuesClient
+from armazenamento.backup import SNAPSHOT_MARGIN
+
+from conftest import registro
+
+
+def estado(registros):
+    return {r["id"]: json.loads(r["dados_json"]) for r in registros}
+
+
+def historia(backend):
+    """Ana v1, Ana v2, Bia, exclusão de Bia: uma entrada de journal por passo"""
+    backend.save_student(registro("Ana", v=1), "prof", "s")
+    backend.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    backend.save_student(registro("Bia", v=1), "prof", "s")
+    backend.delete_student("Bia", "prof")
+
+
+@pytest.fixture
+def journal(planilha, service):
+    return BackupJournal(SheetsValuesClient("planilha-teste", service=service))
+
+
+@pytest.mark.parametrize("local", ["sqlite", "arquivo"])
+def test_restauracao_local_volta_a_cada_ponto_do_journal(local, request):
+    backend = request.getfixturevalue(local)
+    historia(backend)
+    assert estado(backend.restore_to()) == {"Ana (PEI)": {"nome": "Ana", "v": 2}}
+    assert estado(backend.restore_to(3)) == {"Ana (PEI)": {"nome": "Ana", "v": 2}, "Bia (PEI)": {"nome": "Bia", "v": 1}}
+    assert estado(backend.restore_to(1)) == {"Ana (PEI)": {"nome": "Ana", "v": 1}}
+    assert estado(backend.restore_to(0)) == {}
+
+
+def test_restauracao_sem_snapshot_reaplica_o_journal_desde_o_vazio(sheets, planilha):
+    backend = sheets()
+    historia(backend)
+    assert "Backup_Alunos" not in planilha.tabs
+    seqs = [int(r["seq"]) for r in planilha.rows("Backup_Journal")]
+    assert estado(backend.restore_to()) == {"Ana (PEI)": {"nome": "Ana", "v": 2}}
+    assert estado(backend.restore_to(seqs[2])) == {"Ana (PEI)": {"nome": "Ana", "v": 2},
+                                                   "Bia (PEI)": {"nome": "Bia", "v": 1}}
+    assert estado(backend.restore_to(seqs[0])) == {"Ana (PEI)": {"nome": "Ana", "v": 1}}
+
+
+def test_restauracao_sem_journal_nem_snapshot_e_vazia(journal):
+    assert journal.restore_to() == []
+
+
+def test_compactacao_grava_snapshot_e_restauracao_anda_para_os_dois_lados(sheets, planilha):
+    backend = sheets()
+    backend.save_student(registro("Ana", v=1), "prof", "s")
+    antes = int(planilha.rows("Backup_Journal")[-1]["seq"])
+    backend.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    stamp = backend.journal.compact()
+    assert [int(r["_seq"]) for r in planilha.rows("Backup_Alunos")] == [stamp]
+    assert not backend.journal.compaction_due()
+    backend.save_student(registro("Bia", v=1), "prof", "s")
+    assert estado(backend.restore_to()) == {"Ana (PEI)": {"nome": "Ana", "v": 2}, "Bia (PEI)": {"nome": "Bia", "v": 1}}
+    assert estado(backend.restore_to(stamp)) == {"Ana (PEI)": {"nome": "Ana", "v": 2}}
+    # Para trás do carimbo: desfaz com 'dados_anterior'
+    assert estado(backend.restore_to(antes)) == {"Ana (PEI)": {"nome": "Ana", "v": 1}}
+
+
+def test_compactacao_devida_por_numero_de_entradas(journal):
+    journal.compact_every = 2
+    journal.record(None, registro("Ana"), "prof", "s")
+    assert not journal.compaction_due()
+    journal.record(None, registro("Bia"), "prof", "s")
+    assert journal.compaction_due()
+
+
+def test_entrada_anotada_pouco_antes_do_snapshot_e_reaplicada(journal, planilha):
+    # Journal anotado, mas a linha ainda não estava em Alunos quando o snapshot foi lido
+    planilha.tabs["Alunos"] = [["id", "nome", "tipo_doc", "dados_json"], ["Ana (PEI)", "Ana", "PEI", "{}"]]
+    journal.record(None, registro("Bia", v=1), "prof", "s")
+    stamp = journal.compact()
+    assert [r["id"] for r in planilha.rows("Backup_Alunos")] == ["Ana (PEI)"]
+    assert estado(journal.restore_to(stamp)) == {"Ana (PEI)": {}, "Bia (PEI)": {"nome": "Bia", "v": 1}}
+
+
+def test_entrada_anterior_a_janela_nao_sobrescreve_o_snapshot(journal, planilha):
+    planilha.tabs["Alunos"] = [["id", "nome", "tipo_doc", "dados_json"], ["Ana (PEI)", "Ana", "PEI", json.dumps({"v": 2})]]
+    stamp = journal.compact()
+    header = journal.client.ensure_header("Backup_Journal", JOURNAL_COLUMNS)
+    velha = {"seq": stamp - 2 * SNAPSHOT_MARGIN, "id": "Ana (PEI)", "nome": "Ana", "tipo_doc": "PEI",
+             "dados_anterior": "", "dados_novo": json.dumps({"v": 1})}
+    journal.client.append_rows("Backup_Journal", header, [velha])
+    assert estado(journal.restore_to()) == {"Ana (PEI)": {"v": 2}}
+    # Recuar até antes dela desfaz a inserção
+    assert journal.restore_to(velha["seq"] - 1) == []
@@ -0,0 +1,92 @@
+"""Fotos endereçadas pelo conteúdo: externalize_photo, SheetsBlobStore e migrate_photos."""
+import base64
+import os
+
+import pytest
+
+from armazenamento import SheetsBlobStore, SheetsValuesClient, blob_hash, externalize_photo
+from armazenamento import blobs
+
+from conftest import documento, registro
+
+FOTO = os.urandom(2000)
+
+
+@pytest.fixture
+def loja(planilha, service):
+    return SheetsBlobStore(SheetsValuesClient("planilha-teste", service=service))
+
+
+def test_externalize_photo_troca_o_base64_pelo_hash():
+    gravados = []
+
+    def put_blob(data):
+        gravados.append(data)
+        return blob_hash(data)
+
+    doc = {"nome": "Ana", "foto_base64": base64.b64encode(FOTO).decode()}
+    assert externalize_photo(doc, put_blob)
+    assert doc == {"nome": "Ana", "foto_sha256": blob_hash(FOTO)}
+    assert gravados == [FOTO]
+    assert not externalize_photo(doc, put_blob)
+    vazia = {"foto_base64": ""}
+    assert externalize_photo(vazia, put_blob) and vazia == {}
+
+
+def test_blob_em_varias_partes(loja, planilha, monkeypatch):
+    monkeypatch.setattr(blobs, "PART_SIZE", 1000)
+    sha = loja.put(FOTO)
+    assert [int(r["parte"]) for r in planilha.rows("Fotos")] == [0, 1, 2]
+    assert SheetsBlobStore(loja.client).get(sha) == FOTO
+
+
+def test_blob_repetido_e_gravado_uma_vez(loja, planilha):
+    sha = loja.put(FOTO)
+    # Outro processo (sem o conjunto de hashes já vistos) confere a aba antes de gravar
+    assert SheetsBlobStore(loja.client).put(FOTO) == sha
+    assert [r["sha256"] for r in planilha.rows("Fotos")] == [sha]
+
+
+def test_blob_inexistente_e_none(loja):
+    assert loja.get(blob_hash(b"outra")) is None
+
+
+def test_parte_corrompida_e_recusada_pelo_hash(loja, planilha, monkeypatch):
+    monkeypatch.setattr(blobs, "PART_SIZE", 1000)
+    sha = loja.put(FOTO)
+    planilha.tabs["Fotos"][2][2] = base64.b64encode(os.urandom(750)).decode()
+    with pytest.raises(ValueError, match="corrompido"):
+        loja.get(sha)
+
+
+def test_partes_duplicadas_por_gravacoes_simultaneas(loja, planilha, monkeypatch):
+    monkeypatch.setattr(blobs, "PART_SIZE", 1000)
+    sha = loja.put(FOTO)
+    planilha.tabs["Fotos"] += [list(r) for r in planilha.tabs["Fotos"][1:]]
+    assert SheetsBlobStore(loja.client).get(sha) == FOTO
+
+
+def com_foto(nome, tipo):
+    return registro(nome, tipo, foto_base64=base64.b64encode(FOTO).decode())
+
+
+def test_migracao_move_as_fotos_para_os_blobs(backend):
+    backend.save_student(com_foto("Ana", "PEI"), "prof", "s")
+    backend.save_student(com_foto("Ana", "CASO"), "prof", "s")
+    backend.save_student(registro("Bia"), "prof", "s")
+    assert backend.migrate_photos() == 2
+    for _, row in backend.load_student("Ana").iterrows():
+        doc = documento(row)
+        assert "foto_base64" not in doc and doc["foto_sha256"] == blob_hash(FOTO)
+        assert int(row["version"]) == 2
+    assert backend.get_blob(blob_hash(FOTO)) == FOTO
+    assert backend.migrate_photos() == 0
+
+
+def test_pei_e_caso_com_a_mesma_foto_gravam_um_blob(sheets, planilha):
+    backend = sheets()
+    backend.save_student(com_foto("Ana", "PEI"), "prof", "s")
+    backend.save_student(com_foto("Ana", "CASO"), "prof", "s")
+    backend.migrate_photos()
+    assert {r["sha256"] for r in planilha.rows("Fotos")} == {blob_hash(FOTO)}
+    assert len(planilha.rows("Fotos")) == 1
@@ -0,0 +1,283 @@
+"""Cache versionado (WorksheetCache), SingleFlight, RowIndex, memoização por execução e DocCache."""
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from armazenamento import (
+    DocCache, RowIndex, SheetsValuesClient, SingleFlight, VersionCells, WorksheetCache, cache, estimate_size, share,
+)
+
+
+class Versoes:
+    """Carimbos em memória, no lugar da aba _Versoes"""
+
+    def __init__(self):
+        self.stamps = {}
+
+    def get(self, name):
+        return self.stamps.get(name, "v0")
+
+    def bump(self, name, meta=None):
+        old = self.get(name)
+        self.stamps[name] = f"v{int(old[1:]) + 1}"
+        return old, self.stamps[name]
+
+
+def test_singleflight_agrupa_chamadas_simultaneas():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "dados"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("k", fetch)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("k", fetch))) for _ in range(5)]
+    for t in followers:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+    assert results == ["dados"] * 6
+    assert len(calls) == 1
+    assert flights.stats()["coalesced"] == 5
+
+
+def test_singleflight_repassa_o_erro_e_libera_a_chave():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        flights.do("k", lambda: (_ for _ in ()).throw(ValueError("falhou")))
+    assert flights.do("k", lambda: 1) == 1
+
+
+def test_cache_so_baixa_de_novo_quando_o_carimbo_muda():
+    versions = Versoes()
+    downloads = []
+
+    def fetch(worksheet, columns=None):
+        downloads.append(worksheet)
+        return pd.DataFrame({"id": ["a"], "v": [len(downloads)]})
+
+    cache = WorksheetCache(fetch, versions, check_interval=0)
+    assert cache.get("Alunos")["v"].tolist() == [1]
+    assert cache.get("Alunos")["v"].tolist() == [1]
+    versions.bump("Alunos")  # gravação de outro processo
+    assert cache.get("Alunos")["v"].tolist() == [2]
+    assert len(downloads) == 2
+
+
+def test_write_through_altera_o_cache_sem_download_e_a_copia_entregue_fica_intacta():
+    versions = Versoes()
+    cache = WorksheetCache(lambda w, c=None: pd.DataFrame({"id": ["a"], "v": [1]}), versions, check_interval=0)
+    antes = cache.get("Alunos")
+    cache.write_through("Alunos", lambda df: pd.concat([df, pd.DataFrame({"id": ["b"], "v": [1]})],
+                                                       ignore_index=True))
+    assert cache.get("Alunos")["id"].tolist() == ["a", "b"]
+    assert antes["id"].tolist() == ["a"]
+    assert cache.stats()["misses"] == 1
+
+
+def test_indice_reconstruido_quando_o_carimbo_muda():
+    versions = Versoes()
+    pairs = [[(2, "Ana"), (3, "Bia")]]
+    index = RowIndex(lambda: pairs[0], versions, "Alunos", check_interval=0)
+    assert index.rows("Bia") == [3]
+    pairs[0] = [(2, "Bia")]
+    versions.bump("Alunos")
+    assert index.rows("Bia") == [2]
+    assert index.rows("Ana") == []
+    assert index.rebuilds == 2
+
+
+
+def test_indice_descartado_durante_a_consulta_nao_quebra_a_leitura():
+    class Compartilhado:
+        """Publicar o índice é E/S fora da trava: aqui outra thread o descarta nesse intervalo"""
+
+        def get(self, key, revision):
+            return None
+
+        def put(self, key, revision, value):
+            index.invalidate()
+
+    index = RowIndex(lambda: [(2, "Ana")], Versoes(), "Alunos", check_interval=60, shared=Compartilhado())
+    assert index.rows("Ana") == [2]
+
+
+@pytest.mark.parametrize("cow", [True, False])
+def test_copia_entregue_nao_altera_o_dataframe_compartilhado(monkeypatch, cow):
+    monkeypatch.setattr(cache, "copy_on_write", lambda: cow)
+    original = pd.DataFrame({"id": ["a", "b"], "v": [1, 2]})
+    copia = share(original)
+    assert np.shares_memory(copia["v"].to_numpy(), original["v"].to_numpy()) == cow
+    copia.loc[0, "v"] = 9
+    assert original["v"].tolist() == [1, 2]
+
+
+# --- MEMOIZAÇÃO POR EXECUÇÃO ---
+@pytest.fixture
+def execucao(monkeypatch):
+    """Estado de execução próprio do teste (o da thread principal não vaza para os outros testes)"""
+    monkeypatch.setattr(cache, "_run_local", threading.local())
+    cache.begin_run()
+
+
+class Carga:
+    def __init__(self, df=None):
+        self.df = df if df is not None else pd.DataFrame({"id": ["a", "b"], "v": [1, 2]})
+        self.vezes = 0
+
+    def __call__(self):
+        self.vezes += 1
+        return self.df
+
+
+def test_leitura_memorizada_uma_vez_por_execucao(execucao):
+    carga = Carga()
+    for _ in range(3):
+        assert cache.memoized(("load_db", "Alunos"), carga)["id"].tolist() == ["a", "b"]
+    assert carga.vezes == 1
+    cache.begin_run()
+    cache.memoized(("load_db", "Alunos"), carga)
+    assert carga.vezes == 2
+
+
+def test_sem_execucao_aberta_nao_memoriza(monkeypatch):
+    monkeypatch.setattr(cache, "_run_local", threading.local())
+    carga = Carga()
+    cache.memoized(("load_db", "Alunos"), carga)
+    cache.memoized(("load_db", "Alunos"), carga)
+    assert carga.vezes == 2
+
+
+def test_resultado_memorizado_pode_ser_alterado_por_quem_chama(execucao):
+    carga = Carga()
+    df = cache.memoized(("load_db", "Alunos"), carga)
+    df.loc[0, "v"] = 99
+    assert cache.memoized(("load_db", "Alunos"), carga)["v"].tolist() == [1, 2]
+
+
+def test_execucoes_em_threads_diferentes_nao_se_misturam(execucao):
+    carga = Carga()
+    cache.memoized(("load_db", "Alunos"), carga)
+
+    def outra_sessao():
+        cache.begin_run()
+        cache.memoized(("load_db", "Alunos"), carga)
+        cache.memoized(("load_db", "Alunos"), carga)
+
+    thread = threading.Thread(target=outra_sessao)
+    thread.start()
+    thread.join()
+    assert carga.vezes == 2
+    # A execução da thread principal continua com a sua leitura
+    cache.memoized(("load_db", "Alunos"), carga)
+    assert carga.vezes == 2
+
+
+def test_leitura_em_lote_busca_so_as_abas_faltantes(execucao):
+    pedidas = []
+
+    def carga(chaves):
+        pedidas.append(list(chaves))
+        return {k: pd.DataFrame({"aba": [k[1]]}) for k in chaves}
+
+    cache.memoized_many([("safe_read", "Professores")], carga)
+    lidas = cache.memoized_many([("safe_read", "Professores"), ("safe_read", "Monitores")], carga)
+    assert pedidas == [[("safe_read", "Professores")], [("safe_read", "Monitores")]]
+    assert lidas[("safe_read", "Monitores")]["aba"].tolist() == ["Monitores"]
+
+
+def test_gravacao_esquece_so_as_leituras_da_aba(execucao):
+    alunos, professores = Carga(), Carga()
+    cache.memoized(("load_db", "Alunos"), alunos)
+    cache.memoized(("load_summary", "Alunos"), alunos)
+    cache.memoized(("safe_read", "Professores"), professores)
+    cache.forget("Alunos")
+    cache.memoized(("load_db", "Alunos"), alunos)
+    cache.memoized(("load_summary", "Alunos"), alunos)
+    cache.memoized(("safe_read", "Professores"), professores)
+    assert (alunos.vezes, professores.vezes) == (4, 1)
+
+
+# --- CACHE DE DOCUMENTOS ---
+def doc_json(**campos):
+    return json.dumps(dict({"nome": "Ana", "lista": [1, 2], "sub": {"a": 1}}, **campos))
+
+
+def test_documento_decodificado_uma_vez_e_trocado_quando_o_conteudo_muda():
+    docs = DocCache()
+    raw = doc_json()
+    assert docs.get("Ana (PEI)", raw) is docs.get("Ana (PEI)", raw)
+    assert (docs.hits, docs.misses) == (1, 1)
+    assert docs.get("Ana (PEI)", doc_json(v=2))["v"] == 2
+    assert docs.misses == 2
+
+
+def test_copia_mutavel_nao_altera_o_documento_compartilhado():
+    docs = DocCache()
+    raw = doc_json()
+    copia = docs.get("Ana (PEI)", raw, mutable=True)
+    copia["sub"]["a"] = 9
+    copia["lista"].append(3)
+    assert docs.get("Ana (PEI)", raw) == json.loads(raw)
+    assert docs.get("Ana (PEI)", raw, mutable=True) is not docs.get("Ana (PEI)", raw, mutable=True)
+
+
+def test_despejo_do_menos_usado_pelo_orcamento_de_bytes():
+    docs = DocCache()
+    tamanho = estimate_size(json.loads(doc_json(i=0)))
+    docs.resize(int(tamanho * 2.5))
+    for i in range(2):
+        docs.get(i, doc_json(i=i))
+    docs.get(0, doc_json(i=0))  # 0 passa a ser o mais recente
+    docs.get(2, doc_json(i=2))
+    assert (docs.stats()["documents"], docs.evictions) == (2, 1)
+    misses = docs.misses
+    docs.get(0, doc_json(i=0))
+    docs.get(1, doc_json(i=1))
+    assert docs.misses == misses + 1
+    assert docs.bytes <= docs.max_bytes
+
+
+def test_documento_maior_que_o_orcamento_nao_fica_no_cache():
+    docs = DocCache(max_bytes=10)
+    assert docs.get("Ana (PEI)", doc_json())["nome"] == "Ana"
+    assert docs.stats()["documents"] == 0 and docs.bytes == 0
+
+
+def test_json_invalido_levanta_o_erro_do_json_loads():
+    with pytest.raises(json.JSONDecodeError):
+        DocCache().get("Ana (PEI)", "{quebrado")
+
+
+# --- CARIMBOS E METADADOS DE INTEGRIDADE ---
+def test_troca_de_carimbo_conta_sobre_os_metadados_relidos(planilha, service):
+    a = VersionCells(SheetsValuesClient("planilha-teste", service=service))
+    b = VersionCells(SheetsValuesClient("planilha-teste", service=service))
+    a.set_integrity("Alunos", 1, "s1")
+    assert b.integrity("Alunos") == (1, "s1")
+    # Outro processo grava duas vezes; o cache de 'b' continua com a contagem antiga
+    a.bump("Alunos", lambda count, total: (count + 1, "s2"))
+    a.bump("Alunos", lambda count, total: (count + 1, "s3"))
+    assert b.cached_integrity("Alunos") == (1, "s1")
+    vistos = []
+
+    def meta(count, total):
+        vistos.append((count, total))
+        return count + 1, "s4"
+
+    b.bump("Alunos", meta)
+    assert vistos == [(3, "s3")]
+    assert a.integrity("Alunos", fresh=True) == (4, "s4")
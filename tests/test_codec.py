@@ -0,0 +1,84 @@
+"""Codificação do dados_json na planilha: compressão, colunas de continuação e valores legados."""
+import base64
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from armazenamento import decode_cells, decode_frame, encode_cells
+
+from conftest import documento, registro
+
+
+def grande():
+    # Texto aleatório (quase incompressível) com 200 mil caracteres
+    return registro("Ana", texto=base64.b64encode(os.urandom(150_000)).decode())
+
+
+def test_documento_pequeno_cabe_numa_celula():
+    r = registro("Ana", diag="TEA")
+    encoded = encode_cells(r)
+    assert encoded["dados_json"].startswith("z1:1:")
+    assert decode_cells(encoded) == r
+
+
+def test_documento_grande_usa_colunas_de_continuacao():
+    r = grande()
+    encoded = encode_cells(r)
+    assert encoded["dados_json"].startswith("z1:4:")
+    assert [k for k in encoded if k.startswith("dados_json_")] == ["dados_json_2", "dados_json_3", "dados_json_4"]
+    # Limite do Google Sheets por célula, já contando o marcador
+    assert all(len(v) <= 50_000 for k, v in encoded.items() if k.startswith("dados_json"))
+    assert decode_cells(encoded) == r
+
+
+def test_sobras_de_uma_versao_maior_sao_ignoradas():
+    encoded = dict(encode_cells(registro("Ana")), dados_json_2="sobra", dados_json_3="sobra")
+    assert decode_cells(encoded) == registro("Ana")
+
+
+def test_json_puro_legado_passa_inalterado():
+    r = registro("Ana", diag="TEA")
+    assert decode_cells(r) == r
+    df = pd.DataFrame([r])
+    assert decode_frame(df) is df
+
+
+@pytest.mark.parametrize("valor", ["z1:", "z1:x:abc", "z1:1:@@@@", "z1:2:"])
+def test_valor_comprimido_corrompido_levanta_value_error(valor):
+    with pytest.raises(ValueError, match="Ana"):
+        decode_cells({"id": "Ana (PEI)", "dados_json": valor})
+
+
+def test_valor_truncado_levanta_value_error():
+    encoded = encode_cells(grande())
+    del encoded["dados_json_3"]
+    with pytest.raises(ValueError, match="incompleto"):
+        decode_cells(encoded)
+
+
+def test_celula_corrompida_nao_impede_a_leitura_da_aba():
+    df = pd.DataFrame([encode_cells(registro("Ana")), {"id": "Bia (PEI)", "dados_json": "z1:1:corrompido"}])
+    decoded = decode_frame(df)
+    assert json.loads(decoded["dados_json"][0]) == {"nome": "Ana"}
+    assert decoded["dados_json"][1] == "z1:1:corrompido"
+
+
+def test_documento_grande_pela_planilha_e_depois_encolhido(sheets, planilha):
+    backend = sheets()
+    r = grande()
+    backend.save_student(r, "prof", "s")
+    linha = planilha.rows("Alunos")[0]
+    assert all(linha[f"dados_json_{n}"] for n in (2, 3, 4))
+    assert documento(sheets().load_student("Ana").iloc[0]) == json.loads(r["dados_json"])
+    backend.save_student(registro("Ana", diag="TEA"), "prof", "s", expected_version=1)
+    linha = planilha.rows("Alunos")[0]
+    assert [linha[f"dados_json_{n}"] for n in (2, 3, 4)] == ["", "", ""]
+    assert documento(sheets().load_student("Ana").iloc[0]) == {"nome": "Ana", "diag": "TEA"}
+
+
+def test_json_puro_legado_lido_pela_planilha(sheets, planilha):
+    planilha.tabs["Alunos"] = [["id", "nome", "tipo_doc", "dados_json"],
+                               ["Ana (PEI)", "Ana", "PEI", json.dumps({"nome": "Ana", "diag": "TEA"})]]
+    assert documento(sheets().load_db().iloc[0]) == {"nome": "Ana", "diag": "TEA"}
@@ -0,0 +1,97 @@
+"""SharedStore: valores por revisão entre processos do mesmo servidor e invalidação pelas gravações."""
+import os
+import sqlite3
+import time
+
+import pandas as pd
+import pytest
+
+from armazenamento import SharedStore
+
+from conftest import documento, registro
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / "compartilhado.db")
+
+
+def baixou_alunos(planilha):
+    return ("get", "'Alunos'") in planilha.calls
+
+
+def test_valor_so_vale_na_mesma_revisao(caminho):
+    store = SharedStore(caminho)
+    store.put("aba:Alunos:*", "r1", pd.DataFrame({"id": ["a"]}))
+    frame, age = SharedStore(caminho).get("aba:Alunos:*", "r1")
+    assert frame["id"].tolist() == ["a"] and age < 5
+    assert store.get("aba:Alunos:*", "r2") is None
+    assert store.get("outra", "r1") is None
+    assert (store.hits, store.misses, store.writes) == (0, 2, 1)
+
+
+def test_valor_mais_velho_que_max_age_nao_e_servido(caminho):
+    store = SharedStore(caminho)
+    store.put("k", "r1", [1], age=10)
+    assert store.get("k", "r1", max_age=5) is None
+    assert store.get("k", "r1", max_age=60)[0] == [1]
+
+
+def test_carimbo_conferido_vale_por_max_age(caminho):
+    store = SharedStore(caminho)
+    assert store.revision("Alunos", 5) is None
+    store.set_revision("Alunos", "r7")
+    assert SharedStore(caminho).revision("Alunos", 5) == "r7"
+    time.sleep(0.05)
+    assert store.revision("Alunos", 0.01) is None
+
+
+def test_falha_no_arquivo_nao_interrompe(caminho, capsys):
+    store = SharedStore(caminho)
+    sqlite3.connect(caminho).execute("DROP TABLE valores")
+    assert store.get("k", "r1") is None
+    store.put("k", "r1", [1])
+    assert "Aviso" in capsys.readouterr().out
+
+
+def test_arquivo_gravavel_por_outros_gera_aviso(caminho, capsys):
+    SharedStore(caminho)
+    assert "Aviso" not in capsys.readouterr().out
+    os.chmod(caminho, 0o666)
+    SharedStore(caminho)
+    assert "pickles" in capsys.readouterr().out
+
+
+def test_duas_replicas_dividem_o_download(sheets, planilha, caminho):
+    a, b = sheets(shared=SharedStore(caminho)), sheets(shared=SharedStore(caminho))
+    a.save_student(registro("Ana"), "prof", "s")
+    a.load_db()
+    planilha.calls.clear()
+    assert b.load_db()["id"].tolist() == ["Ana (PEI)"]
+    assert not baixou_alunos(planilha)
+    assert b.shared.hits >= 1
+
+
+def test_gravacao_publica_o_snapshot_e_invalida_a_copia_da_outra_replica(sheets, planilha, caminho):
+    a, b = sheets(shared=SharedStore(caminho)), sheets(shared=SharedStore(caminho))
+    a.save_student(registro("Ana", v=1), "prof", "s")
+    a.load_db()
+    assert documento(b.load_db().iloc[0])["v"] == 1
+    planilha.calls.clear()
+    hits = b.shared.hits
+    a.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    a.save_student(registro("Bia"), "prof", "s")
+    df = b.load_db()
+    assert {r["id"]: documento(r).get("v") for _, r in df.iterrows()} == {"Ana (PEI)": 2, "Bia (PEI)": None}
+    # O snapshot já atualizado por 'a' veio do arquivo: sem download nem leitura das linhas pelo feed
+    assert not baixou_alunos(planilha)
+    assert b.cache.patched == 0 and b.shared.hits > hits
+
+
+def test_snapshot_de_revisao_antiga_nao_e_adotado(sheets, planilha, caminho):
+    a, b = sheets(shared=SharedStore(caminho)), sheets(shared=SharedStore(caminho))
+    a.save_student(registro("Ana", v=1), "prof", "s")
+    b.load_db()
+    # Gravação de uma réplica sem cópia em cache: o carimbo muda, mas nenhum snapshot novo é publicado
+    a.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    assert documento(b.load_db().iloc[0])["v"] == 2
@@ -0,0 +1,132 @@
+"""QuotaGuard: balde de fichas, repetições e estados do circuito (aberto, meio aberto, fechado)."""
+import time
+
+import pytest
+
+from armazenamento import CircuitOpenError, QuotaGuard, TokenBucket
+
+from conftest import registro
+from fake_sheets import http_error
+
+
+class Chamada:
+    """Função da API simulada: levanta os erros de 'erros' em ordem e depois responde 'ok'"""
+
+    def __init__(self, *erros):
+        self.erros = list(erros)
+        self.vezes = 0
+
+    def __call__(self):
+        self.vezes += 1
+        if self.erros:
+            raise self.erros.pop(0)
+        return "ok"
+
+
+def guarda(**kwargs):
+    return QuotaGuard(**dict({"max_retries": 0, "base_delay": 0, "max_delay": 0, "failure_threshold": 2,
+                              "reset_timeout": 0.2}, **kwargs))
+
+
+def abrir(guard):
+    for _ in range(guard.failure_threshold):
+        with pytest.raises(Exception):
+            guard.call("read", Chamada(http_error(503)))
+    assert guard.is_open
+
+
+def test_balde_libera_a_rajada_e_depois_espera_pelo_ritmo():
+    bucket = TokenBucket(600, burst=2)  # 10 fichas por segundo
+    assert [bucket.acquire(), bucket.acquire()] == [0.0, 0.0]
+    assert 0.05 < bucket.acquire() <= 0.11
+
+
+def test_balde_reabastece_sem_passar_da_rajada():
+    bucket = TokenBucket(600, burst=2)
+    bucket.acquire(), bucket.acquire()
+    time.sleep(0.5)
+    assert [bucket.acquire(), bucket.acquire()] == [0.0, 0.0]
+    assert bucket.acquire() > 0
+
+
+def test_erros_transitorios_sao_repetidos_ate_o_limite():
+    guard = guarda(max_retries=2, failure_threshold=10)
+    assert guard.call("read", Chamada(http_error(429), http_error(503))) == "ok"
+    chamada = Chamada(*[http_error(500)] * 3)
+    with pytest.raises(Exception, match="500"):
+        guard.call("read", chamada)
+    assert (chamada.vezes, guard.retries) == (3, 4)
+
+
+def test_acrescimo_so_e_repetido_em_429():
+    guard = guarda(max_retries=2, failure_threshold=10)
+    assert guard.call("append", Chamada(http_error(429))) == "ok"
+    chamada = Chamada(http_error(503))
+    with pytest.raises(Exception, match="503"):
+        guard.call("append", chamada)
+    assert chamada.vezes == 1
+
+
+def test_falhas_seguidas_abrem_o_circuito_e_recusam_sem_chamar():
+    guard = guarda()
+    abrir(guard)
+    chamada = Chamada()
+    with pytest.raises(CircuitOpenError):
+        guard.call("read", chamada)
+    assert chamada.vezes == 0
+    stats = guard.stats()
+    assert (stats["circuit_open"], stats["rejected"], stats["failures"]) == (True, 1, 2)
+    assert "503" in stats["last_error"]
+
+
+def test_erro_definitivo_nao_conta_para_o_circuito():
+    guard = guarda()
+    for _ in range(3):
+        with pytest.raises(Exception, match="400"):
+            guard.call("read", Chamada(http_error(400)))
+    assert not guard.is_open and guard.failures == 0
+
+
+def test_sucesso_zera_a_contagem_de_falhas_seguidas():
+    guard = guarda()
+    with pytest.raises(Exception):
+        guard.call("read", Chamada(http_error(503)))
+    guard.call("read", Chamada())
+    with pytest.raises(Exception):
+        guard.call("read", Chamada(http_error(503)))
+    assert not guard.is_open
+
+
+def test_meio_aberto_uma_falha_reabre_e_um_sucesso_fecha():
+    guard = guarda()
+    abrir(guard)
+    time.sleep(0.25)
+    # Meio aberto: a próxima chamada é tentada; uma única falha já reabre, sem repetição
+    assert not guard.is_open
+    chamada = Chamada(http_error(503))
+    with pytest.raises(Exception, match="503"):
+        guard.call("read", chamada)
+    assert guard.is_open and chamada.vezes == 1
+    time.sleep(0.25)
+    assert guard.call("read", Chamada()) == "ok"
+    # Fechado de novo: volta a precisar de 'failure_threshold' falhas seguidas
+    with pytest.raises(Exception):
+        guard.call("read", Chamada(http_error(503)))
+    assert not guard.is_open
+
+
+def test_circuito_aberto_serve_a_ultima_leitura_boa(sheets):
+    guard = guarda(reset_timeout=60, reads_per_minute=60_000, writes_per_minute=60_000)
+    backend = sheets(guard=guard)
+    backend.save_student(registro("Ana"), "prof", "s")
+    assert backend.load_db()["id"].tolist() == ["Ana (PEI)"]
+    assert backend.safe_read("Professores")["nome"].tolist() == ["Ana Prof"]
+    abrir(guard)
+    assert backend.load_db()["id"].tolist() == ["Ana (PEI)"]
+    assert backend.safe_read("Professores")["nome"].tolist() == ["Ana Prof"]
+    assert backend.cache.stale_served >= 1
+    # Leituras estritas (ex.: antes de gravar) não aceitam a cópia antiga
+    with pytest.raises(CircuitOpenError):
+        backend.load_db(strict=True)
+    with pytest.raises(CircuitOpenError):
+        backend.save_student(registro("Bia"), "prof", "s")
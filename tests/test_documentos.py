@@ -0,0 +1,36 @@
+from armazenamento import (
+    apply_merge_patch, canonical_hash, changed_fields, dirty_sections, merge_patch, three_way_merge,
+)
+
+
+def test_mescla_campos_diferentes_e_aponta_conflito_no_mesmo_campo():
+    base = {"a": 1, "b": 1, "c": 1}
+    mine = {"a": 2, "b": 1, "c": 5}
+    theirs = {"a": 1, "b": 3, "c": 6}
+    merged, conflicts = three_way_merge(base, mine, theirs)
+    assert merged == {"a": 2, "b": 3, "c": 6}
+    assert conflicts == ["c"]
+
+
+def test_merge_patch_leva_a_base_ao_documento():
+    base = {"a": 1, "t": {"x": {"r": True}, "y": 2}, "l": [1, None], "fora": 3}
+    doc = {"a": 1, "t": {"x": {"r": False, "d": ["2ª"]}, "y": 2}, "l": [1, None, 3], "novo": {"k": "v"}}
+    patch = merge_patch(base, doc)
+    assert patch == {"t": {"x": {"r": False, "d": ["2ª"]}}, "l": [1, None, 3], "novo": {"k": "v"}, "fora": None}
+    assert apply_merge_patch(base, patch) == doc
+    assert base["t"]["x"] == {"r": True}
+
+
+def test_campo_alterado_para_null_nao_cabe_no_merge_patch():
+    assert merge_patch({"a": 1}, {"a": None}) is None
+    assert merge_patch({}, {"a": {"b": None}}) is None
+
+
+def test_resumo_canonico_ignora_a_ordem_das_chaves():
+    assert canonical_hash({"a": 1, "b": [1, 2]}) == canonical_hash({"b": [1, 2], "a": 1})
+    assert canonical_hash({"a": 1}) != canonical_hash({"a": 2})
+
+
+def test_secoes_alteradas_na_ordem_das_abas():
+    campos = changed_fields({"tel": "1", "med_nome": "A"}, {"tel": "2", "med_nome": "B", "extra": 1})
+    assert dirty_sections("PEI", campos, "Geral") == ["Identificação", "Saúde", "Geral"]
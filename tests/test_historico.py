@@ -0,0 +1,49 @@
+"""HistoryLogger: janela de agrupamento dos lotes e lotes com erro definitivo."""
+import time
+
+from armazenamento import HistoryLogger
+
+from fake_sheets import http_error
+
+
+class Cliente:
+    """Só o que o HistoryLogger usa do SheetsValuesClient; 'erros' são levantados em ordem"""
+
+    def __init__(self, erros=()):
+        self.lotes = []
+        self.tentativas = 0
+        self.erros = list(erros)
+
+    def ensure_header(self, worksheet, columns):
+        return list(columns)
+
+    def append_rows(self, worksheet, header, records, confirm=False):
+        self.tentativas += 1
+        if self.erros:
+            raise self.erros.pop(0)
+        self.lotes.append(list(records))
+
+
+def test_entradas_proximas_vao_num_unico_lote():
+    cliente = Cliente()
+    logger = HistoryLogger(cliente, flush_interval=0.5)
+    for i in range(3):
+        logger.log({"Acao": str(i)})
+        time.sleep(0.05)
+    time.sleep(1)
+    assert [len(lote) for lote in cliente.lotes] == [3]
+    logger.close()
+
+
+def test_erro_definitivo_separa_o_lote_sem_repetir():
+    cliente = Cliente(erros=[http_error(400)])
+    logger = HistoryLogger(cliente, flush_interval=0.1)
+    logger.log({"Acao": "invalida"})
+    logger.flush()
+    logger.log({"Acao": "ok"})
+    logger.flush()
+    assert cliente.tentativas == 2
+    assert [list(lote) for lote in logger.parked] == [[{"Acao": "invalida"}]]
+    assert cliente.lotes == [[{"Acao": "ok"}]]
+    assert logger.failed == 1
+    logger.close()
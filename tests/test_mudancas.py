@@ -0,0 +1,98 @@
+"""ChangeFeed: alcance por delta entre processos e volta ao download completo quando a cadeia não fecha."""
+import pytest
+
+from armazenamento import ChangeFeed, SheetsValuesClient
+
+from conftest import documento, registro
+from fake_sheets import http_error
+
+
+def baixou_alunos(planilha):
+    return ("get", "'Alunos'") in planilha.calls
+
+
+@pytest.fixture
+def feed(planilha, service):
+    return ChangeFeed(SheetsValuesClient("planilha-teste", service=service))
+
+
+def anotar(feed, *carimbos, aba="Alunos"):
+    for old, new in zip(carimbos, carimbos[1:]):
+        feed.record(aba, "save", new, "Ana", 2, (old, new))
+
+
+def test_primeira_leitura_so_posiciona_o_cursor(feed):
+    anotar(feed, "v1", "v2")
+    feed.poll()
+    assert (feed.cursor, feed.read) == (2, 0)
+    anotar(feed, "v2", "v3")
+    feed.poll()
+    assert (feed.cursor, feed.read) == (3, 1)
+
+
+def test_cadeia_de_carimbos_le_so_as_alteracoes_novas(feed):
+    feed.poll()
+    anotar(feed, "v1", "v2", "v3", "v4")
+    assert [c["versao"] for c in feed.chain("Alunos", "v1", "v4")] == ["v2", "v3", "v4"]
+    assert feed.polls == 1
+    # Já lidas: a próxima cadeia não vai à planilha
+    assert [c["versao"] for c in feed.chain("Alunos", "v2", "v3")] == ["v3"]
+    assert feed.polls == 1
+
+
+@pytest.mark.parametrize("old,new", [("v0", "v3"), ("v1", "v9"), ("", "v3"), ("v1", None)])
+def test_cadeia_que_nao_fecha_e_none(feed, old, new):
+    feed.poll()
+    anotar(feed, "v1", "v2", "v3")
+    assert feed.chain("Alunos", old, new) is None
+
+
+def test_gravacoes_simultaneas_bifurcam_a_cadeia(feed):
+    feed.poll()
+    anotar(feed, "v1", "v2a")
+    anotar(feed, "v1", "v2b")
+    assert feed.chain("Alunos", "v1", "v2b") is None
+
+
+def test_alteracoes_de_outra_aba_nao_entram_na_cadeia(feed):
+    feed.poll()
+    anotar(feed, "v1", "v2", aba="Outra")
+    assert feed.chain("Alunos", "v1", "v2") is None
+
+
+def test_outro_processo_alcanca_gravacoes_pelo_delta(sheets, planilha):
+    a, b = sheets(), sheets()
+    a.save_student(registro("Ana", v=1), "prof", "s")
+    a.save_student(registro("Bia"), "prof", "s")
+    b.load_db()
+    planilha.calls.clear()
+    a.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    a.save_student(registro("Bia", v=2), "prof", "s", expected_version=1)
+    df = b.load_db()
+    assert not baixou_alunos(planilha)
+    assert b.cache.patched == 1
+    assert {r["id"]: documento(r)["v"] for _, r in df.iterrows()} == {"Ana (PEI)": 2, "Bia (PEI)": 2}
+
+
+def test_exclusao_forca_o_download_completo(sheets, planilha):
+    a, b = sheets(), sheets()
+    for nome in ("Ana", "Bia"):
+        a.save_student(registro(nome), "prof", "s")
+    b.load_db()
+    planilha.calls.clear()
+    a.delete_student("Ana", "prof")
+    assert b.load_db()["id"].tolist() == ["Bia (PEI)"]
+    assert baixou_alunos(planilha) and b.cache.patched == 0
+
+
+def test_lacuna_no_feed_forca_o_download_completo(sheets, planilha, service):
+    a, b = sheets(), sheets()
+    a.save_student(registro("Ana", v=1), "prof", "s")
+    b.load_db()
+    planilha.calls.clear()
+    # A anotação no feed falha: a gravação vale, mas a cadeia de carimbos fica com um buraco
+    service.falhar("append", http_error(400))
+    a.save_student(registro("Ana", v=2), "prof", "s", backup=False, expected_version=1)
+    a.save_student(registro("Ana", v=3), "prof", "s", backup=False, expected_version=2)
+    assert documento(b.load_db().iloc[0])["v"] == 3
+    assert baixou_alunos(planilha) and b.cache.patched == 0
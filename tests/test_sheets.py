@@ -0,0 +1,82 @@
+"""SheetsValuesClient: servidor Sheets falso local (endpoint configurável) e acréscimos sem duplicação."""
+import pytest
+
+from armazenamento import HISTORY_COLUMNS, QuotaGuard, SheetsBackend, SheetsValuesClient
+
+from conftest import documento, registro
+from fake_sheets import FakeConn, FakeSheetsServer, Planilha, http_error
+
+URL = "https://docs.google.com/spreadsheets/d/planilha-teste/edit"
+
+
+@pytest.fixture
+def servidor():
+    p = Planilha()
+    p.add_sheet("Alunos", [["id", "nome", "tipo_doc", "dados_json"],
+                           ["Ana (PEI)", "Ana", "PEI", "{}"], ["Bia (PEI)", "Bia", "PEI", "{}"]])
+    with FakeSheetsServer(p) as server:
+        yield server
+
+
+def test_upsert_grava_so_a_linha_do_registro_pelo_endpoint_configurado(servidor):
+    client = SheetsValuesClient.from_secrets({"spreadsheet": URL, "api_endpoint": servidor.endpoint})
+    row, previous, _ = client.upsert("Alunos", "id", {"id": "Bia (PEI)", "nome": "Bia", "tipo_doc": "PEI",
+                                                      "dados_json": '{"v": 2}'})
+    assert (row, previous["dados_json"]) == (3, "{}")
+    row, previous, _ = client.upsert("Alunos", "id", {"id": "Caio (PEI)", "nome": "Caio", "tipo_doc": "PEI",
+                                                      "dados_json": "{}"})
+    assert (row, previous) == (4, None)
+    assert [(r["id"], r["dados_json"]) for r in servidor.planilha.rows("Alunos")] == [
+        ("Ana (PEI)", "{}"), ("Bia (PEI)", '{"v": 2}'), ("Caio (PEI)", "{}")]
+
+
+def test_endpoint_pela_variavel_de_ambiente(servidor, monkeypatch):
+    monkeypatch.setenv("INTEGRA_SHEETS_ENDPOINT", servidor.endpoint)
+    client = SheetsValuesClient.from_secrets({"spreadsheet": URL})
+    assert client.column("Alunos", client.header("Alunos"), "nome") == ["Ana", "Bia"]
+
+
+def test_backend_completo_pelo_servidor_falso(servidor):
+    client = SheetsValuesClient.from_secrets({"spreadsheet": URL, "api_endpoint": servidor.endpoint})
+    backend = SheetsBackend(FakeConn(servidor.planilha), client)
+    salvo = backend.save_student(registro("Ana", diag="TEA"), "prof", "s", expected_version=0)
+    assert documento(backend.load_student("Ana").iloc[0]) == {"nome": "Ana", "diag": "TEA"}
+    assert salvo["version"] == 1
+    assert sorted(backend.load_db()["id"]) == ["Ana (PEI)", "Bia (PEI)"]
+    for worker in (backend._logger, backend._patches):
+        if worker is not None:
+            worker.close()
+
+
+def entrada(acao):
+    return {"Data_Hora": "17/10/2026 10:00:00", "Aluno": "Ana", "Usuario": "prof", "Acao": acao, "Detalhes": 1}
+
+
+@pytest.fixture
+def cliente(planilha, service):
+    return SheetsValuesClient("planilha-teste", service=service,
+                              guard=QuotaGuard(max_retries=3, base_delay=0, max_delay=0))
+
+
+def test_acrescimo_gravado_com_resposta_perdida_nao_e_repetido(cliente, planilha, service):
+    header = cliente.ensure_header("Historico", HISTORY_COLUMNS)
+    cliente.append_rows("Historico", header, [entrada("antes")])
+    service.falhar("append", http_error(503), depois=True)
+    assert cliente.append_rows("Historico", header, [entrada("a"), entrada("b")]) == 3
+    assert [r["Acao"] for r in planilha.rows("Historico")] == ["antes", "a", "b"]
+    assert service.executed.count("append") == 2
+
+
+def test_acrescimo_que_nao_chegou_e_reenviado_uma_vez(cliente, planilha, service):
+    header = cliente.ensure_header("Historico", HISTORY_COLUMNS)
+    service.falhar("append", http_error(503))
+    cliente.append_rows("Historico", header, [entrada("a")])
+    assert [r["Acao"] for r in planilha.rows("Historico")] == ["a"]
+
+
+def test_acrescimo_recusado_pela_cota_e_repetido_pelo_guarda(cliente, planilha, service):
+    header = cliente.ensure_header("Historico", HISTORY_COLUMNS)
+    service.falhar("append", http_error(429))
+    cliente.append_rows("Historico", header, [entrada("a")])
+    assert [r["Acao"] for r in planilha.rows("Historico")] == ["a"]
+    assert cliente.guard.retries == 1
@@ -0,0 +1,142 @@
+"""SheetsBackend: cache versionado entre processos, índice de linhas e trava anti-wipe."""
+import threading
+import time
+
+import pytest
+
+from armazenamento import AntiWipeError, backends
+
+from conftest import documento, registro
+
+
+def test_gravacao_de_outro_processo_invalida_o_cache(sheets):
+    a, b = sheets(), sheets()
+    a.save_student(registro("Ana", v=1), "prof", "s")
+    assert documento(b.load_db().iloc[0])["v"] == 1
+    a.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    a.save_student(registro("Bia"), "prof", "s")
+    df = b.load_db()
+    assert sorted(df["id"]) == ["Ana (PEI)", "Bia (PEI)"]
+    assert documento(df[df["id"] == "Ana (PEI)"].iloc[0])["v"] == 2
+
+
+def test_gravacao_propria_atualiza_o_cache_sem_novo_download(sheets, planilha):
+    a = sheets()
+    a.save_student(registro("Ana"), "prof", "s")
+    a.load_db()
+    planilha.calls.clear()
+    a.save_student(registro("Bia"), "prof", "s")
+    assert sorted(a.load_db()["id"]) == ["Ana (PEI)", "Bia (PEI)"]
+    assert ("get", "'Alunos'") not in planilha.calls
+
+
+def test_indice_acompanha_exclusao_feita_por_outro_processo(sheets):
+    a, b = sheets(), sheets()
+    for nome in ["Ana", "Bia", "Caio"]:
+        a.save_student(registro(nome), "prof", "s")
+    assert b.load_student("Caio")["id"].tolist() == ["Caio (PEI)"]
+    a.delete_student("Ana", "prof")
+    # As linhas abaixo da excluída sobem: o índice de 'b' não pode apontar para a linha antiga
+    assert b.load_student("Caio")["id"].tolist() == ["Caio (PEI)"]
+    assert b.load_student("Ana").empty
+
+
+def test_planilha_esvaziada_por_fora_bloqueia_a_gravacao(sheets, planilha):
+    a = sheets()
+    a.backfill_summaries()  # linha de base dos metadados, como na inicialização do app
+    for i in range(30):
+        a.save_student(registro(f"A{i}"), "prof", "s")
+    del planilha.tabs["Alunos"][2:]
+    with pytest.raises(AntiWipeError):
+        a.save_student(registro("Novo"), "prof", "s")
+    assert len(planilha.rows("Alunos")) == 1
+
+
+def test_exclusao_le_as_linhas_numa_unica_requisicao(sheets, service):
+    a = sheets()
+    for tipo in ["PEI", "CASO", "PDI"]:
+        a.save_student(registro("Ana", tipo), "prof", "s")
+    service.executed.clear()
+    assert len(a.delete_student("Ana", "prof")) == 3
+    # Cabeçalho e coluna 'nome', depois um batchGet com as linhas; nenhuma leitura linha a linha
+    assert service.executed.count("batchGet") == 1
+    ops = service.executed
+    assert "get" not in ops[ops.index("batchGet"):ops.index("batchUpdate")]
+
+
+def test_linha_duplicada_bloqueia_a_exclusao(sheets, planilha):
+    a = sheets()
+    a.save_student(registro("Ana"), "prof", "s")
+    a.save_student(registro("Bia"), "prof", "s")
+    planilha.tabs["Alunos"].append(list(planilha.tabs["Alunos"][1]))  # 'Ana (PEI)' repetida
+    with pytest.raises(AntiWipeError):
+        a.delete_student("Ana", "prof")
+    assert [r["id"] for r in planilha.rows("Alunos")] == ["Ana (PEI)", "Bia (PEI)", "Ana (PEI)"]
+
+
+def test_leitura_em_lote_ignora_aba_inexistente(sheets, planilha):
+    planilha.add_sheet("Avisos", [["texto", "ordem"], ["Reunião", 2.0], ["Prova", True]])
+    frames = sheets().read_many(["Professores", "Monitores", "Avisos"])
+    assert frames["Monitores"].empty
+    assert frames["Professores"]["nome"].tolist() == ["Ana Prof"]
+    # Valores formatados, como a conexão do Streamlit devolve
+    assert frames["Avisos"]["ordem"].tolist() == ["2", "TRUE"]
+
+
+def test_aba_removida_depois_da_consulta_aos_metadados(sheets, planilha):
+    planilha.add_sheet("Avisos", [["texto"], ["Reunião"]])
+    a = sheets()
+    assert len(a.read_many(["Avisos", "Professores"])["Avisos"]) == 1
+    del planilha.tabs["Avisos"]
+    a.safe_update("Professores", a.safe_read("Professores"))  # nova geração: não reaproveita a leitura anterior
+    frames = a.read_many(["Avisos", "Professores"])
+    assert frames["Avisos"].empty and len(frames["Professores"]) == 1
+
+
+def test_primeira_gravacao_cria_a_aba_de_versoes(sheets, planilha):
+    assert "_Versoes" not in planilha.tabs
+    sheets().save_student(registro("Ana"), "prof", "s")
+    assert [r["aba"] for r in planilha.rows("_Versoes")] == ["Alunos"]
+
+
+def test_estatisticas_nao_consultam_a_planilha(sheets, service):
+    a = sheets()
+    service.executed.clear()
+    assert a.stats()["integrity"]["rows"] == "unknown"
+    a.backfill_summaries()
+    a.save_student(registro("Ana"), "prof", "s")
+    service.executed.clear()
+    assert a.stats()["integrity"]["rows"] == 1
+    assert service.executed == []
+
+
+def test_gravacao_sobre_o_cache_lido_da_planilha(sheets, planilha):
+    sheets().save_student(registro("Ana", v=1), "prof", "s")
+    a = sheets()
+    assert len(a.load_db()) == 1  # cache com as colunas de texto vindas da planilha
+    salvo = a.save_student(registro("Ana", v=2), "prof", "s", expected_version=1)
+    assert salvo["version"] == 2
+    df = a.load_db()
+    assert documento(df.iloc[0])["v"] == 2 and str(df.iloc[0]["version"]) == "2"
+    a.save_student(registro("Ana", v=3), "prof", "s", expected_version=2)
+
+
+def test_sessoes_simultaneas_criam_um_unico_envio_do_historico(sheets, monkeypatch):
+    criados = []
+
+    class Lento(backends.HistoryLogger):
+        def __init__(self, *args, **kwargs):
+            time.sleep(0.05)  # alarga a janela entre conferir e atribuir
+            super().__init__(*args, **dict(kwargs, flush_interval=0.05))
+            criados.append(self)
+
+    monkeypatch.setattr(backends, "HistoryLogger", Lento)
+    a = sheets()
+    vistos = []
+    threads = [threading.Thread(target=lambda: vistos.append((a.logger, a.patches))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(criados) == 2
+    assert len({(id(logger), id(patches)) for logger, patches in vistos}) == 1
@@ -0,0 +1,134 @@
+"""WriteBehindQueue: mesclagem, repetição de 429/5xx, lease entre processos, sync_falhas e métricas."""
+import sqlite3
+import time
+
+import pytest
+
+from armazenamento import WriteBehindQueue
+from armazenamento.sync import SCHEMA
+
+from conftest import documento, registro
+from fake_sheets import http_error
+
+
+def esperar(condicao, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        assert time.monotonic() < limite, "condição não atingida a tempo"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fila(sheets, tmp_path):
+    """Fábrica de filas (uma por 'processo') sobre o mesmo arquivo, enviando ao mesmo SheetsBackend"""
+    destino = sheets()
+    path = str(tmp_path / "integra.db")
+    created = []
+
+    def make():
+        queue = WriteBehindQueue(destino, path, poll_interval=0.01, min_backoff=0.01)
+        created.append(queue)
+        return queue
+
+    make.destino = destino
+    make.path = path
+    yield make
+    for queue in created:
+        queue.close()
+
+
+def lease_de(path):
+    row = sqlite3.connect(path).execute("SELECT dono FROM sync_lease WHERE id = 1").fetchone()
+    return row and row[0]
+
+
+def ocupar_lease(path, segundos=60):
+    """Outro processo segurando o envio: nada sai da fila até o lease ser liberado"""
+    db = sqlite3.connect(path, isolation_level=None)
+    db.executescript(SCHEMA)
+    db.execute("INSERT OR REPLACE INTO sync_lease(id, dono, ate) VALUES (1, 'outro', ?)", (time.time() + segundos,))
+    return lambda: db.execute("DELETE FROM sync_lease WHERE id = 1")
+
+
+def salvar(queue, nome, **campos):
+    queue.enqueue("save_student", registro(nome, **campos), "prof", "s")
+
+
+def test_salvamentos_pendentes_do_mesmo_documento_sao_mesclados(fila, planilha):
+    liberar = ocupar_lease(fila.path)
+    queue = fila()
+    for v in range(3):
+        salvar(queue, "Ana", v=v)
+    salvar(queue, "Bia")
+    stats = queue.stats()
+    assert (stats["depth"], stats["coalesced"]) == (2, 2)
+    liberar()
+    esperar(lambda: queue.stats()["depth"] == 0)
+    assert [r["id"] for r in planilha.rows("Alunos")] == ["Ana (PEI)", "Bia (PEI)"]
+    assert documento(fila.destino.load_student("Ana").iloc[0]) == {"nome": "Ana", "v": 2}
+    assert queue.flushed == 2
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_erro_de_cota_ou_do_servidor_e_repetido_com_backoff(fila, planilha, service, status):
+    service.falhar("update", http_error(status))
+    service.falhar("update", http_error(status))
+    queue = fila()
+    salvar(queue, "Ana")
+    esperar(lambda: queue.stats()["depth"] == 0)
+    assert queue.retries == 2
+    assert str(status) in queue.last_error
+    assert [r["id"] for r in planilha.rows("Alunos")] == ["Ana (PEI)"]
+    assert queue.stats()["failed"] == 0
+
+
+def test_erro_definitivo_vai_para_sync_falhas_e_a_fila_segue(fila, planilha, service):
+    service.falhar("update", http_error(400))
+    liberar = ocupar_lease(fila.path)
+    queue = fila()
+    salvar(queue, "Ana")
+    salvar(queue, "Bia")
+    liberar()
+    esperar(lambda: queue.stats()["depth"] == 0)
+    assert queue.stats()["failed"] == 1
+    assert queue.retries == 0
+    falhas = sqlite3.connect(fila.path).execute("SELECT metodo, erro FROM sync_falhas").fetchall()
+    assert [(m, "400" in e) for m, e in falhas] == [("save_student", True)]
+    assert [r["id"] for r in planilha.rows("Alunos")] == ["Bia (PEI)"]
+
+
+def test_so_o_dono_do_lease_envia_e_outro_processo_assume_no_fechamento(fila, planilha):
+    primeira = fila()
+    esperar(lambda: lease_de(fila.path) == primeira.owner)
+    segunda = fila()
+    salvar(segunda, "Ana")
+    esperar(lambda: primeira.flushed == 1)
+    assert segunda.flushed == 0
+    primeira.close()
+    salvar(segunda, "Bia")
+    esperar(lambda: segunda.flushed == 1)
+    assert lease_de(fila.path) == segunda.owner
+    assert [r["id"] for r in planilha.rows("Alunos")] == ["Ana (PEI)", "Bia (PEI)"]
+
+
+def test_lease_vencido_de_processo_que_caiu_e_assumido(fila):
+    ocupar_lease(fila.path, segundos=-1)
+    queue = fila()
+    salvar(queue, "Ana")
+    esperar(lambda: queue.flushed == 1)
+    assert lease_de(fila.path) == queue.owner
+
+
+def test_metricas_de_profundidade_e_atraso(fila):
+    liberar = ocupar_lease(fila.path)
+    queue = fila()
+    assert queue.stats()["lag_seconds"] == 0.0
+    salvar(queue, "Ana")
+    salvar(queue, "Bia")
+    time.sleep(0.3)
+    stats = queue.stats()
+    assert stats["depth"] == 2 and stats["lag_seconds"] >= 0.2
+    liberar()
+    esperar(lambda: queue.stats()["depth"] == 0)
+    stats = queue.stats()
+    assert (stats["lag_seconds"], stats["flushed"]) == (0.0, 2)